@@ -32,7 +32,7 @@ class AsyncHttpRequest:
     
     async def EditCode(
         self,
-        history: List[_baml.types.Message],feedback: str,code_files: List[_baml.types.File],package_json: str,
+        history: List[_baml.types.Message],history_summary: str,feedback: str,code_files: List[_baml.types.File],package_json: str,
         baml_options: _baml.BamlCallOptionsModApi = {},
     ) -> baml_py.HTTPRequest:
       __tb__ = baml_options.get("tb", None)
@@ -47,6 +47,7 @@ class AsyncHttpRequest:
         "EditCode",
         {
           "history": history,
+          "history_summary": history_summary,
           "feedback": feedback,
           "code_files": code_files,
           "package_json": package_json,
@@ -58,6 +59,32 @@ class AsyncHttpRequest:
         False,
       )
     
+    async def PlanCodeChanges(
+        self,
+        history: List[_baml.types.Message],feedback: str,
+        baml_options: _baml.BamlCallOptionsModApi = {},
+    ) -> baml_py.HTTPRequest:
+      __tb__ = baml_options.get("tb", None)
+      if __tb__ is not None:
+        tb = __tb__._tb # type: ignore (we know how to use this private attribute)
+      else:
+        tb = None
+      __cr__ = baml_options.get("client_registry", None)
+      env = _baml.env_vars_to_dict(baml_options.get("env", {}))
+
+      return await self.__runtime.build_request(
+        "PlanCodeChanges",
+        {
+          "history": history,
+          "feedback": feedback,
+        },
+        self.__ctx_manager.get(),
+        tb,
+        __cr__,
+        env,
+        False,
+      )
+    
 
 
 class AsyncHttpStreamRequest:
@@ -71,7 +98,7 @@ class AsyncHttpStreamRequest:
     
     async def EditCode(
         self,
-        history: List[_baml.types.Message],feedback: str,code_files: List[_baml.types.File],package_json: str,
+        history: List[_baml.types.Message],history_summary: str,feedback: str,code_files: List[_baml.types.File],package_json: str,
         baml_options: _baml.BamlCallOptionsModApi = {},
     ) -> baml_py.HTTPRequest:
       __tb__ = baml_options.get("tb", None)
@@ -86,6 +113,7 @@ class AsyncHttpStreamRequest:
         "EditCode",
         {
           "history": history,
+          "history_summary": history_summary,
           "feedback": feedback,
           "code_files": code_files,
           "package_json": package_json,
@@ -97,6 +125,32 @@ class AsyncHttpStreamRequest:
         True,
       )
     
+    async def PlanCodeChanges(
+        self,
+        history: List[_baml.types.Message],feedback: str,
+        baml_options: _baml.BamlCallOptionsModApi = {},
+    ) -> baml_py.HTTPRequest:
+      __tb__ = baml_options.get("tb", None)
+      if __tb__ is not None:
+        tb = __tb__._tb # type: ignore (we know how to use this private attribute)
+      else:
+        tb = None
+      __cr__ = baml_options.get("client_registry", None)
+      env = _baml.env_vars_to_dict(baml_options.get("env", {}))
+
+      return await self.__runtime.build_request(
+        "PlanCodeChanges",
+        {
+          "history": history,
+          "feedback": feedback,
+        },
+        self.__ctx_manager.get(),
+        tb,
+        __cr__,
+        env,
+        True,
+      )
+    
 
 
 __all__ = ["AsyncHttpRequest", "AsyncHttpStreamRequest"]
\ No newline at end of file
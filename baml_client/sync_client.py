@@ -96,7 +96,7 @@ class BamlSyncClient:
     
     def EditCode(
         self,
-        history: List[_baml.types.Message],feedback: str,code_files: List[_baml.types.File],package_json: str,
+        history: List[_baml.types.Message],history_summary: str,feedback: str,code_files: List[_baml.types.File],package_json: str,
         baml_options: _baml.BamlCallOptions = {},
     ) -> _baml.types.CodeChanges:
       options: _baml.BamlCallOptions = {**self.__baml_options, **(baml_options or {})}
@@ -112,7 +112,7 @@ class BamlSyncClient:
       raw = self.__runtime.call_function_sync(
         "EditCode",
         {
-          "history": history,"feedback": feedback,"code_files": code_files,"package_json": package_json,
+          "history": history,"history_summary": history_summary,"feedback": feedback,"code_files": code_files,"package_json": package_json,
         },
         self.__ctx_manager.get(),
         tb,
@@ -122,6 +122,34 @@ class BamlSyncClient:
       )
       return cast(_baml.types.CodeChanges, raw.cast_to(_baml.types, _baml.types, _baml.partial_types, False))
     
+    def PlanCodeChanges(
+        self,
+        history: List[_baml.types.Message],feedback: str,
+        baml_options: _baml.BamlCallOptions = {},
+    ) -> str:
+      options: _baml.BamlCallOptions = {**self.__baml_options, **(baml_options or {})}
+      __tb__ = options.get("tb", None)
+      if __tb__ is not None:
+        tb = __tb__._tb # type: ignore (we know how to use this private attribute)
+      else:
+        tb = None
+      __cr__ = options.get("client_registry", None)
+      collector = options.get("collector", None)
+      collectors = collector if isinstance(collector, list) else [collector] if collector is not None else []
+      env = _baml.env_vars_to_dict(options.get("env", {}))
+      raw = self.__runtime.call_function_sync(
+        "PlanCodeChanges",
+        {
+          "history": history,"feedback": feedback,
+        },
+        self.__ctx_manager.get(),
+        tb,
+        __cr__,
+        collectors,
+        env,
+      )
+      return cast(str, raw.cast_to(_baml.types, _baml.types, _baml.partial_types, False))
+    
 
 
 
@@ -137,7 +165,7 @@ class BamlStreamClient:
     
     def EditCode(
         self,
-        history: List[_baml.types.Message],feedback: str,code_files: List[_baml.types.File],package_json: str,
+        history: List[_baml.types.Message],history_summary: str,feedback: str,code_files: List[_baml.types.File],package_json: str,
         baml_options: _baml.BamlCallOptions = {},
     ) -> baml_py.BamlSyncStream[_baml.partial_types.CodeChanges, _baml.types.CodeChanges]:
       options: _baml.BamlCallOptions = {**self.__baml_options, **(baml_options or {})}
@@ -154,6 +182,7 @@ class BamlStreamClient:
         "EditCode",
         {
           "history": history,
+          "history_summary": history_summary,
           "feedback": feedback,
           "code_files": code_files,
           "package_json": package_json,
@@ -173,6 +202,42 @@ class BamlStreamClient:
         self.__ctx_manager.get(),
       )
     
+    def PlanCodeChanges(
+        self,
+        history: List[_baml.types.Message],feedback: str,
+        baml_options: _baml.BamlCallOptions = {},
+    ) -> baml_py.BamlSyncStream[Optional[str], str]:
+      options: _baml.BamlCallOptions = {**self.__baml_options, **(baml_options or {})}
+      __tb__ = options.get("tb", None)
+      if __tb__ is not None:
+        tb = __tb__._tb # type: ignore (we know how to use this private attribute)
+      else:
+        tb = None
+      __cr__ = options.get("client_registry", None)
+      collector = options.get("collector", None)
+      collectors = collector if isinstance(collector, list) else [collector] if collector is not None else []
+      env = _baml.env_vars_to_dict(options.get("env", {}))
+      raw = self.__runtime.stream_function_sync(
+        "PlanCodeChanges",
+        {
+          "history": history,
+          "feedback": feedback,
+        },
+        None,
+        self.__ctx_manager.get(),
+        tb,
+        __cr__,
+        collectors,
+        env,
+      )
+
+      return baml_py.BamlSyncStream[Optional[str], str](
+        raw,
+        lambda x: cast(Optional[str], x.cast_to(_baml.types, _baml.types, _baml.partial_types, True)),
+        lambda x: cast(str, x.cast_to(_baml.types, _baml.types, _baml.partial_types, False)),
+        self.__ctx_manager.get(),
+      )
+    
 
 
 b = BamlSyncClient(DO_NOT_USE_DIRECTLY_UNLESS_YOU_KNOW_WHAT_YOURE_DOING_RUNTIME, DO_NOT_USE_DIRECTLY_UNLESS_YOU_KNOW_WHAT_YOURE_DOING_CTX)
@@ -16,6 +16,8 @@ export class WebSocketBus {
   private reconnectAttempts = 0;
   private maxReconnectAttempts = 5;
   private reconnectDelay = 1000;
+  // Reassembled plan text per message id (AGENT_PARTIAL/AGENT_FINAL carry deltas)
+  private planTexts = new Map<string, string>();
 
   constructor(config: WebSocketBusConfig) {
     this.config = config;
@@ -47,7 +49,7 @@ export class WebSocketBus {
         }
         console.log("Received WebSocket message:", rawMessage);
 
-        const message = this.convertRawMessage(rawMessage);
+        const message = this.convertRawMessage(this.applyPlanDelta(rawMessage));
         if (message) {
           // Handle ping messages automatically
           if (message.type === MessageType.PING) {
@@ -131,6 +133,55 @@ export class WebSocketBus {
     }, delay);
   }
 
+  private applyPlanDelta(rawMessage: any): any {
+    const data = rawMessage?.data;
+    if (
+      !rawMessage?.id ||
+      (rawMessage.type !== MessageType.AGENT_PARTIAL &&
+        rawMessage.type !== MessageType.AGENT_FINAL) ||
+      typeof data?.delta !== "string"
+    ) {
+      return rawMessage;
+    }
+
+    // Offsets are UTF-16 code units, which is what String.slice uses
+    const current = data.reset ? "" : this.planTexts.get(rawMessage.id) ?? "";
+    if (data.offset !== current.length) {
+      console.warn(
+        `Plan delta gap for ${rawMessage.id}: have ${current.length}, got offset ${data.offset}`
+      );
+    }
+    const text = current.slice(0, data.offset) + data.delta;
+
+    if (rawMessage.type === MessageType.AGENT_FINAL) {
+      this.planTexts.delete(rawMessage.id);
+      this.verifyChecksum(rawMessage.id, text, data.checksum);
+    } else {
+      this.planTexts.set(rawMessage.id, text);
+    }
+
+    return { ...rawMessage, data: { ...data, text } };
+  }
+
+  private async verifyChecksum(id: string, text: string, checksum?: string) {
+    if (!checksum || !globalThis.crypto?.subtle) {
+      return;
+    }
+    const digest = await crypto.subtle.digest(
+      "SHA-256",
+      new TextEncoder().encode(text)
+    );
+    const hex = Array.from(new Uint8Array(digest))
+      .map((b) => b.toString(16).padStart(2, "0"))
+      .join("");
+    if (hex !== checksum) {
+      console.error(`Plan text checksum mismatch for ${id}`);
+      this.config.messageBus.sendError("Streamed plan text was not received intact", {
+        id,
+      });
+    }
+  }
+
   private convertRawMessage(rawMessage: any): Message | null {
     if (
       !rawMessage ||
@@ -115,7 +115,7 @@ class Agent:
 
         history = self.get_history()
         stream = self.model_client.stream.EditCode(
-            history, feedback, code_files, package_json
+            history, "", feedback, code_files, package_json
         )
         sent_plan = False
 
@@ -1,5 +1,6 @@
 """New agent implementation with Supabase and multiple AI models."""
 
+import asyncio
 import json
 import time
 import uuid
@@ -7,11 +8,33 @@ from dataclasses import dataclass
 from enum import Enum
 from typing import AsyncGenerator
 
-from baml_client.sync_client import BamlSyncClient, b
+from baml_py import Collector
+
+from baml_client.async_client import BamlAsyncClient, b
 from baml_client.types import Message as ConvoMessage
 
-from .code_executor import code_executor
+from .blob_store import blob_store
+from .build_service import build_key, build_service
+from .code_executor import WriteOrigin, code_executor
+from .config import config
+from .conversation_memory import conversation_memory
 from .database import db
+from .llm_metrics import llm_metrics
+from .llm_replay import MOCK_CLIENT_NAME, ReplayMode, llm_replay, mock_client_registry
+from .model_router import STREAM_RESET, client_registry_for, model_router
+from .partial_stream import (
+    FRAME_DUE,
+    FileProgressThrottle,
+    PlanDeltaEncoder,
+    earliest_due,
+    with_frame_ticks,
+)
+from .persistence_queue import persistence_queue
+from .project_cache import project_cache
+
+
+# Conversation messages returned when a session is opened
+BOOTSTRAP_HISTORY_LIMIT = 50
 
 
 class MessageType(Enum):
@@ -28,15 +51,20 @@ class MessageType(Enum):
     BUILD_PROGRESS = "build_progress"
     BUILD_COMPLETED = "build_completed"
     BUILD_ERROR = "build_error"
+    CANCEL = "cancel"
+    RESUME = "resume"
 
 
-@dataclass
+@dataclass(slots=True)
 class Message:
+    """An outbound agent message; the codec serializes it without an intermediate dict."""
     id: str
     timestamp: int
     type: MessageType
     data: dict
     session_id: str
+    request_id: str | None = None  # Client request the message answers
+    seq: int | None = None  # Position in the session's event stream
 
     @classmethod
     def new(
@@ -61,6 +89,8 @@ class Message:
             "data": self.data,
             "timestamp": self.timestamp,
             "session_id": self.session_id,
+            "request_id": self.request_id,
+            "seq": self.seq,
         }
 
 
@@ -68,69 +98,236 @@ class Agent:
     """Agent that uses multiple AI models and Supabase for storage."""
 
     def __init__(self):
-        self.model_client: BamlSyncClient = b
+        self.model_client: BamlAsyncClient = b
+
+    def get_edit_clients(self) -> list[str] | None:
+        """Candidate clients for EditCode (None lets the router use all configured clients)."""
+        if config.LLM_MOCK_BASE_URL:
+            return [MOCK_CLIENT_NAME]
+        if llm_replay.mode == ReplayMode.REPLAY:
+            # Recordings are keyed by client, so replay must not re-route
+            return [model_router.clients[0]]
+        return None
+
+    def get_model_client(self, client_name: str, collector: Collector | None = None) -> BamlAsyncClient:
+        """Get a BAML client that runs functions on the given client."""
+        if client_name == MOCK_CLIENT_NAME:
+            registry = mock_client_registry(config.LLM_MOCK_BASE_URL)
+        else:
+            registry = client_registry_for(client_name)
+        return self.model_client.with_options(client_registry=registry, collector=collector)
+
+    def stream_function(
+        self, function_name: str, client_name: str, args: dict, *, session_id: str, turn_id: str
+    ) -> AsyncGenerator:
+        """Stream a BAML function's partials, recorded/replayed and instrumented per call."""
+        collector = llm_metrics.new_collector(f"{function_name}-{turn_id}-{client_name}")
+        model_client = self.get_model_client(client_name, collector)
+        return llm_metrics.track(
+            llm_replay.stream(
+                function_name,
+                client_name,
+                args,
+                lambda: getattr(model_client.stream, function_name)(**args),
+            ),
+            session_id=session_id,
+            turn_id=turn_id,
+            function_name=function_name,
+            client_name=client_name,
+            collector=collector,
+        )
 
     async def init(self, session_id: str) -> bool:
-        """Initialize a new session."""
-        # Check if session exists in database
-        existing_session = db.get_session(session_id)
-        exists = existing_session is not None
+        """Initialize a session; returns whether it already existed."""
+        result = await self.bootstrap(session_id)
+        return result["exists"]
+
+    async def bootstrap(self, session_id: str) -> dict:
+        """
+        Open a session: get or create it, make sure its project exists locally and load its code.
+
+        The database part is a single round trip (session, latest snapshot
+        and recent history); the code comes from the project cache.
+        """
+        result = await db.bootstrap_session(session_id, history_limit=BOOTSTRAP_HISTORY_LIMIT)
+        exists = not result["created"]
 
         if not exists:
-            # Create session in database
-            db.create_session(session_id)
             # Create project file structure
             code_executor.create_project(session_id)
+            # Initial snapshot (template blobs are shared by all sessions)
+            project = await project_cache.load(session_id)
+            blob_store.schedule_snapshot(session_id, None, project.code_map, project.package_json)
+        elif not code_executor.get_project_path(session_id).exists():
+            # Known session without a local copy (e.g. a new instance): restore it from the database
+            await self.restore_project(session_id, result["snapshot"])
+
+        code_data = await self.load_code(session_id=session_id)
+        return {
+            "exists": exists,
+            "session": result["session"],
+            "history": result["history"],
+            **code_data,
+        }
+
+    async def restore_project(self, session_id: str, snapshot: dict | None):
+        """Recreate a session's local project from a snapshot (or its code files if it has none)."""
+        code_executor.create_project(session_id)
+        if snapshot:
+            code_map, package_json = await blob_store.load_snapshot(snapshot)
+            if package_json is not None:
+                code_executor.save_package_json(session_id, package_json)
         else:
-            # Ensure project exists
-            code_executor.create_project(session_id)
+            code_map = await db.get_code_files(session_id)
+        if code_map:
+            code_executor.save_code(session_id, code_map, WriteOrigin.RESTORE)
+        project_cache.invalidate(session_id)
+
+    async def load_snapshot(self, session_id: str, snapshot_id: str) -> tuple[dict[str, str], str | None]:
+        """Load the files of one of a session's snapshots."""
+        snapshot = await db.get_snapshot(snapshot_id)
+        if snapshot is None or snapshot["session_id"] != session_id:
+            raise ValueError(f"Snapshot {snapshot_id} not found for session {session_id}")
+        return await blob_store.load_snapshot(snapshot)
+
+    async def rollback(self, session_id: str, snapshot_id: str) -> dict:
+        """Restore a session's project to a snapshot, reusing its archived build if there is one."""
+        code_map, package_json = await self.load_snapshot(session_id, snapshot_id)
+        current = await project_cache.load(session_id)
+
+        changed, removed = await asyncio.to_thread(code_executor.write_project, session_id, code_map)
+        if package_json is not None and package_json != current.package_json:
+            code_executor.save_package_json(session_id, package_json)
+        project_cache.invalidate(session_id)
+        persistence_queue.enqueue(session_id, changed, removed)
+
+        # The restored state becomes the newest snapshot, so history stays linear
+        project = await project_cache.load(session_id)
+        blob_store.schedule_snapshot(session_id, None, project.code_map, project.package_json)
+
+        build_restored = await build_service.restore_build(
+            session_id, build_key(project.code_map, project.package_json)
+        )
+        if not build_restored:
+            await build_service.queue_build(session_id, force_rebuild=True)
 
-        return exists
+        return {
+            "session_id": session_id,
+            "snapshot_id": snapshot_id,
+            "version": project.version,
+            "changed": sorted(changed),
+            "removed": removed,
+            "build_restored": build_restored,
+        }
 
-    async def load_code(self, *, session_id: str) -> dict:
-        """Load code files for a session."""
-        # Load from file system
-        file_map, package_json = code_executor.load_code(session_id)
+    async def fork(self, source_session_id: str, snapshot_id: str | None = None) -> dict:
+        """Start a new session from a snapshot (or the current state) of another session."""
+        if snapshot_id:
+            code_map, package_json = await self.load_snapshot(source_session_id, snapshot_id)
+        else:
+            source = await project_cache.load(source_session_id)
+            if not source.code_map:
+                raise ValueError(f"Session {source_session_id} has no project to fork")
+            code_map, package_json = source.code_map, source.package_json
+
+        session_id = str(uuid.uuid4())
+        await db.create_session(
+            session_id, metadata={"forked_from": source_session_id, "snapshot_id": snapshot_id}
+        )
+        await asyncio.to_thread(
+            code_executor.fork_project, source_session_id, session_id, code_map, package_json
+        )
+        persistence_queue.enqueue(session_id, code_map)
 
-        # Also sync with database
-        db_files = db.get_code_files(session_id)
-        if db_files:
-            # Database takes precedence if it exists
-            file_map = {k: v.encode("utf-8") for k, v in db_files.items()}
+        project = await project_cache.load(session_id)
+        blob_store.schedule_snapshot(session_id, None, project.code_map, project.package_json)
 
-        # Convert bytes to strings for JSON serialization
-        code_map = {path: content.decode("utf-8") for path, content in file_map.items()}
+        build_restored = await build_service.restore_build(
+            session_id, build_key(project.code_map, project.package_json)
+        )
+        if not build_restored:
+            await build_service.queue_build(session_id, force_rebuild=True)
 
-        return {"code_map": code_map, "package_json": package_json}
+        return {
+            "session_id": session_id,
+            "forked_from": source_session_id,
+            "snapshot_id": snapshot_id,
+            "version": project.version,
+            "build_restored": build_restored,
+        }
+
+    async def load_code(
+        self, *, session_id: str, known_hashes: dict[str, str] | None = None
+    ) -> dict:
+        """
+        Load code files for a session.
+
+        With `known_hashes` (path -> content hash of the files a client
+        already has) only the difference is returned: changed and added
+        files, and the paths that no longer exist.
+        """
+        # The local file system is the source of truth (the database is written behind it)
+        project = await project_cache.load(session_id)
+
+        if known_hashes is None:
+            return {
+                "code_map": project.code_map,
+                "package_json": project.package_json,
+                "version": project.version,
+            }
+
+        hashes = project.file_hashes()
+        return {
+            "delta": True,
+            "changed": {
+                path: project.code_map[path]
+                for path, file_hash in hashes.items()
+                if known_hashes.get(path) != file_hash
+            },
+            "removed": [path for path in known_hashes if path not in hashes],
+            "package_json": project.package_json,
+            "version": project.version,
+        }
 
-    async def edit_code(self, *, session_id: str, code_map: dict):
+    async def edit_code(
+        self, *, session_id: str, code_map: dict, deleted: list[str] | None = None
+    ):
         """Save code changes for a session."""
+        # One spelling per file for the disk, the cache and the database
+        code_map, deleted = code_executor.normalize_changes(session_id, code_map, deleted)
+
         # Save to file system
         code_executor.save_code(session_id, code_map)
+        if deleted:
+            code_executor.delete_files(session_id, deleted)
 
-        # Also save to database
-        for file_path, content in code_map.items():
-            db.save_code_file(session_id, file_path, content)
+        version = project_cache.update(session_id, code_map, deleted)
 
-        return {"session_id": session_id}
+        # The database copy is written behind, off the turn's critical path
+        persistence_queue.enqueue(session_id, code_map, deleted)
 
-    def get_history(self, session_id: str) -> list[ConvoMessage]:
-        """Get conversation history from database."""
-        history = db.get_conversation_history(session_id)
-        return [
-            ConvoMessage(role=msg["role"], content=msg["content"]) for msg in history
+        return {"session_id": session_id, "version": version}
+
+    async def get_history(self, session_id: str) -> tuple[str, list[ConvoMessage]]:
+        """Get token-budgeted conversation history: the rolling summary and recent turns."""
+        history = await conversation_memory.get_history(session_id)
+        return history.summary, [
+            ConvoMessage(role=msg["role"], content=msg["content"]) for msg in history.messages
         ]
 
     async def add_to_history(self, session_id: str, user_feedback: str, agent_plan: str):
         """Add messages to conversation history."""
-        db.save_conversation(session_id, "user", user_feedback)
-        db.save_conversation(session_id, "assistant", agent_plan)
+        await db.save_conversation(session_id, "user", user_feedback)
+        await db.save_conversation(session_id, "assistant", agent_plan)
 
     async def send_feedback(
-        self, *, session_id: str, feedback: str
-    ) -> AsyncGenerator[dict, None]:
+        self, *, session_id: str, feedback: str, turn_id: str | None = None
+    ) -> AsyncGenerator[Message, None]:
         """Process user feedback and generate code changes."""
-        yield Message.new(MessageType.UPDATE_IN_PROGRESS, {}, session_id=session_id).to_dict()
+        turn_id = turn_id or str(uuid.uuid4())
+        yield Message.new(
+            MessageType.UPDATE_IN_PROGRESS, {"turn_id": turn_id}, session_id=session_id
+        )
 
         # Load current code
         code_data = await self.load_code(session_id=session_id)
@@ -141,63 +338,139 @@ class Agent:
         for path, content in code_map.items():
             code_files.append({"path": path, "content": content})
 
-        # Get conversation history
-        history = self.get_history(session_id)
+        # Get conversation history (the summary goes into the system prompt)
+        history_summary, history = await self.get_history(session_id)
 
-        # Use the EditCode function (which uses FastCodingClient for quick edits)
-        stream = self.model_client.stream.EditCode(
-            history, feedback, code_files, package_json
+        # EditCode runs on the client the router expects to be fastest
+        args = {
+            "history": history,
+            "history_summary": history_summary,
+            "feedback": feedback,
+            "code_files": code_files,
+            "package_json": package_json,
+        }
+
+        def open_stream(client_name: str):
+            return self.stream_function(
+                "EditCode", client_name, args, session_id=session_id, turn_id=turn_id
+            )
+
+        input_chars = sum(len(f["content"]) for f in code_files) + len(package_json)
+        stream = model_router.stream(
+            open_stream,
+            input_chars=input_chars,
+            is_complete=lambda partial: partial.plan.state == "Complete" and bool(partial.plan.value),
+            clients=self.get_edit_clients(),
         )
 
         sent_plan = False
+        plan_text = ""
         new_code_map = {}
         plan_msg_id = str(uuid.uuid4())
         file_msg_id = str(uuid.uuid4())
 
-        for partial in stream:
+        # Plan text goes out as appended deltas, coalesced per frame
+        frame_interval = config.STREAM_FRAME_INTERVAL_MS / 1000
+        plan_encoder = PlanDeltaEncoder(frame_interval)
+        file_progress = FileProgressThrottle(frame_interval)
+
+        def next_frame_due():
+            if sent_plan:
+                return earliest_due(file_progress)
+            return earliest_due(plan_encoder, file_progress)
+
+        async for partial in with_frame_ticks(stream, next_frame_due):
+            if partial is FRAME_DUE:
+                # Updates held back by the throttles are due before the model's next chunk
+                delta = None if sent_plan else plan_encoder.flush()
+                if delta:
+                    yield Message.new(
+                        MessageType.AGENT_PARTIAL, delta, id=plan_msg_id, session_id=session_id
+                    )
+                progress = file_progress.flush()
+                if progress:
+                    yield Message.new(
+                        MessageType.UPDATE_FILE, progress, id=file_msg_id, session_id=session_id
+                    )
+                continue
+
+            if partial is STREAM_RESET:
+                # Another model took over: drop what the previous one produced
+                plan_encoder.restart()
+                new_code_map = {}
+                file_progress = FileProgressThrottle(frame_interval)
+                continue
+
             if partial.plan.state != "Complete" and not sent_plan:
-                yield Message.new(
-                    MessageType.AGENT_PARTIAL,
-                    {"text": partial.plan.value},
-                    id=plan_msg_id,
-                    session_id=session_id,
-                ).to_dict()
+                delta = plan_encoder.update(partial.plan.value or "")
+                if delta:
+                    yield Message.new(
+                        MessageType.AGENT_PARTIAL,
+                        delta,
+                        id=plan_msg_id,
+                        session_id=session_id,
+                    )
 
             if partial.plan.state == "Complete" and not sent_plan:
+                plan_text = partial.plan.value
                 yield Message.new(
                     MessageType.AGENT_FINAL,
-                    {"text": partial.plan.value},
+                    plan_encoder.finish(plan_text),
                     id=plan_msg_id,
                     session_id=session_id,
-                ).to_dict()
-
-                await self.add_to_history(session_id, feedback, partial.plan.value)
+                )
                 sent_plan = True
 
             for file in partial.files:
                 if file.path not in new_code_map:
-                    yield Message.new(
-                        MessageType.UPDATE_FILE,
-                        {"text": f"Working on {file.path}"},
-                        id=file_msg_id,
-                        session_id=session_id,
-                    ).to_dict()
-
                     new_code_map[file.path] = file.content
+                    progress = file_progress.add(file.path)
+                    if progress:
+                        yield Message.new(
+                            MessageType.UPDATE_FILE,
+                            progress,
+                            id=file_msg_id,
+                            session_id=session_id,
+                        )
+
+        if not sent_plan:
+            delta = plan_encoder.flush()
+            if delta:
+                yield Message.new(
+                    MessageType.AGENT_PARTIAL, delta, id=plan_msg_id, session_id=session_id
+                )
+
+        progress = file_progress.flush()
+        if progress:
+            yield Message.new(
+                MessageType.UPDATE_FILE, progress, id=file_msg_id, session_id=session_id
+            )
+
+        # Files returned with empty content were removed by the model
+        deleted = [path for path, content in new_code_map.items() if not content.strip()]
+        for path in deleted:
+            del new_code_map[path]
 
         # Save code changes
-        await self.edit_code(session_id=session_id, code_map=new_code_map)
+        await self.edit_code(session_id=session_id, code_map=new_code_map, deleted=deleted)
+
+        # Record the turn's resulting project state as a snapshot, in the background
+        project = await project_cache.load(session_id)
+        blob_store.schedule_snapshot(session_id, turn_id, project.code_map, project.package_json)
+
+        # Only completed turns enter the history (a cancelled turn left no changes)
+        await self.add_to_history(session_id, feedback, plan_text)
 
         yield Message.new(
-            MessageType.UPDATE_COMPLETED, {}, session_id=session_id
-        ).to_dict()
+            MessageType.UPDATE_COMPLETED, {"turn_id": turn_id}, session_id=session_id
+        )
         
         # Automatically trigger build after code changes (better than lovable!)
         yield Message.new(
             MessageType.BUILD_STARTED,
             {"message": "Building your changes..."},
             session_id=session_id
-        ).to_dict()
+        )
         
         # Queue build in background (non-blocking)
         await build_service.queue_build(session_id, force_rebuild=True)
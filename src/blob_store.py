@@ -0,0 +1,183 @@
+"""Content-addressed blob storage and per-turn project snapshots."""
+
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Optional
+
+from .config import config
+from .database import db
+from .metrics import Sample, metrics_registry
+
+
+def content_hash(content: str) -> str:
+    """Address of a file's content."""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class BlobStore:
+    """
+    Stores project files as deduplicated blobs plus snapshot manifests.
+
+    A snapshot maps each file path to the hash of its content, so identical
+    files (template files, shared components, unchanged files across turns)
+    are stored once. Saving a snapshot only uploads blobs the database
+    doesn't have; hashes known to be stored are remembered so repeat saves
+    skip the lookup. Loading a snapshot is a manifest fetch plus blob lookups
+    served from a size-bounded LRU content cache.
+    """
+
+    def __init__(
+        self,
+        max_cache_bytes: int = config.BLOB_CACHE_MAX_BYTES,
+        max_known_hashes: int = config.BLOB_KNOWN_HASHES_MAX,
+    ):
+        self.max_cache_bytes = max_cache_bytes
+        self.max_known_hashes = max_known_hashes
+        self.cache: OrderedDict[str, str] = OrderedDict()
+        self.cache_bytes = 0
+        self.known: OrderedDict[str, None] = OrderedDict()
+        self.snapshot_tasks: dict[str, asyncio.Task] = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.blobs_uploaded = 0
+        self.blobs_deduplicated = 0
+        self.bytes_uploaded = 0
+        self.snapshots_saved = 0
+        self.snapshot_errors = 0
+
+    def _cache_put(self, blob_hash: str, content: str):
+        """Add a blob to the content cache, evicting least recently used ones."""
+        if blob_hash in self.cache:
+            self.cache.move_to_end(blob_hash)
+            return
+        self.cache[blob_hash] = content
+        self.cache_bytes += len(content)
+        while self.cache_bytes > self.max_cache_bytes and len(self.cache) > 1:
+            _, evicted = self.cache.popitem(last=False)
+            self.cache_bytes -= len(evicted)
+
+    def _mark_known(self, blob_hash: str):
+        """Remember that a blob is stored in the database."""
+        self.known[blob_hash] = None
+        self.known.move_to_end(blob_hash)
+        while len(self.known) > self.max_known_hashes:
+            self.known.popitem(last=False)
+
+    async def save_snapshot(
+        self,
+        session_id: str,
+        turn_id: Optional[str],
+        code_map: dict[str, str],
+        package_json: Optional[str],
+    ) -> dict:
+        """Save a snapshot of a project, uploading only blobs not stored yet."""
+        contents = {content_hash(content): content for content in code_map.values()}
+        manifest = {path: content_hash(content) for path, content in code_map.items()}
+        package_json_hash = None
+        if package_json is not None:
+            package_json_hash = content_hash(package_json)
+            contents[package_json_hash] = package_json
+
+        unknown = [blob_hash for blob_hash in contents if blob_hash not in self.known]
+        missing = await db.get_missing_blobs(unknown) if unknown else set()
+        upload = {blob_hash: contents[blob_hash] for blob_hash in missing}
+
+        snapshot = await db.save_snapshot(session_id, turn_id, manifest, package_json_hash, upload)
+
+        self.blobs_uploaded += len(upload)
+        self.blobs_deduplicated += len(contents) - len(upload)
+        self.bytes_uploaded += sum(len(content) for content in upload.values())
+        self.snapshots_saved += 1
+        for blob_hash, content in contents.items():
+            self._mark_known(blob_hash)
+            self._cache_put(blob_hash, content)
+        return snapshot
+
+    def schedule_snapshot(
+        self,
+        session_id: str,
+        turn_id: Optional[str],
+        code_map: dict[str, str],
+        package_json: Optional[str],
+    ):
+        """Save a snapshot in the background, after the session's previous one."""
+        previous = self.snapshot_tasks.get(session_id)
+
+        async def run():
+            if previous is not None:
+                await asyncio.gather(previous, return_exceptions=True)
+            try:
+                await self.save_snapshot(session_id, turn_id, code_map, package_json)
+            except Exception as e:
+                self.snapshot_errors += 1
+                print(f"Error saving snapshot for session {session_id}: {e}")
+            finally:
+                if self.snapshot_tasks.get(session_id) is task:
+                    del self.snapshot_tasks[session_id]
+
+        task = asyncio.create_task(run())
+        self.snapshot_tasks[session_id] = task
+
+    async def drain(self):
+        """Wait for background snapshot saves to finish."""
+        await asyncio.gather(*self.snapshot_tasks.values(), return_exceptions=True)
+
+    async def get_blobs(self, hashes: list[str]) -> dict[str, str]:
+        """Get blob contents by hash, from the cache where possible."""
+        found: dict[str, str] = {}
+        missing: list[str] = []
+        for blob_hash in dict.fromkeys(hashes):
+            content = self.cache.get(blob_hash)
+            if content is not None:
+                self.cache.move_to_end(blob_hash)
+                self.cache_hits += 1
+                found[blob_hash] = content
+            else:
+                self.cache_misses += 1
+                missing.append(blob_hash)
+
+        if missing:
+            fetched = await db.get_blobs(missing)
+            for blob_hash, content in fetched.items():
+                self._mark_known(blob_hash)
+                self._cache_put(blob_hash, content)
+            found.update(fetched)
+        return found
+
+    async def load_snapshot(self, snapshot: dict) -> tuple[dict[str, str], Optional[str]]:
+        """Resolve a snapshot's manifest into its files and package.json."""
+        manifest: dict[str, str] = snapshot["manifest"]
+        package_json_hash: Optional[str] = snapshot.get("package_json_hash")
+        hashes = list(manifest.values())
+        if package_json_hash:
+            hashes.append(package_json_hash)
+
+        blobs = await self.get_blobs(hashes)
+        missing = [path for path, blob_hash in manifest.items() if blob_hash not in blobs]
+        if missing:
+            raise ValueError(f"Snapshot {snapshot['id']} references missing blobs: {missing}")
+
+        code_map = {path: blobs[blob_hash] for path, blob_hash in manifest.items()}
+        package_json = blobs.get(package_json_hash) if package_json_hash else None
+        return code_map, package_json
+
+    def get_metrics(self) -> list[Sample]:
+        """Metrics samples for /metrics."""
+        return [
+            ("blob_cache_hits_total", {}, self.cache_hits),
+            ("blob_cache_misses_total", {}, self.cache_misses),
+            ("blob_cache_entries", {}, len(self.cache)),
+            ("blob_cache_bytes", {}, self.cache_bytes),
+            ("blobs_uploaded_total", {}, self.blobs_uploaded),
+            ("blobs_deduplicated_total", {}, self.blobs_deduplicated),
+            ("blob_bytes_uploaded_total", {}, self.bytes_uploaded),
+            ("snapshots_saved_total", {}, self.snapshots_saved),
+            ("snapshot_errors_total", {}, self.snapshot_errors),
+            ("snapshots_pending", {}, len(self.snapshot_tasks)),
+        ]
+
+
+# Global blob store instance
+blob_store = BlobStore()
+metrics_registry.register(blob_store.get_metrics)
@@ -1,7 +1,10 @@
 """Build service for compiling React/Vite projects."""
 
 import asyncio
+import hashlib
 import json
+import os
+import shutil
 import subprocess
 import time
 import uuid
@@ -9,8 +12,10 @@ from enum import Enum
 from pathlib import Path
 from typing import Optional, Callable, AsyncGenerator
 
+from .blob_store import content_hash
 from .config import config
 from .code_executor import code_executor
+from .project_cache import project_cache
 
 # Import websocket manager (avoid circular import)
 def get_websocket_manager():
@@ -18,6 +23,15 @@ def get_websocket_manager():
     return websocket_manager
 
 
+def build_key(code_map: dict[str, str], package_json: str) -> str:
+    """Identify a build by its inputs (src files and package.json)."""
+    digest = hashlib.sha256()
+    for path in sorted(code_map):
+        digest.update(f"{path}\0{content_hash(code_map[path])}\n".encode("utf-8"))
+    digest.update(content_hash(package_json).encode("utf-8"))
+    return digest.hexdigest()
+
+
 class BuildStatus(Enum):
     """Build status enumeration."""
     PENDING = "pending"
@@ -38,6 +52,13 @@ class BuildService:
         self.build_tasks: dict[str, asyncio.Task] = {}
         self.build_queue: asyncio.Queue = asyncio.Queue()
         self._queue_processor_task: Optional[asyncio.Task] = None
+        # Build outputs archived by build key (hardlinked), so identical inputs never rebuild
+        self.builds_dir = Path(config.PROJECTS_DIR) / ".builds"
+        self.build_keys: dict[str, str] = {}
+        # package.json hash of each session's last successful npm install
+        self.installed_deps: dict[str, str] = {}
+        # Sessions whose files changed during a build: built again once it finishes
+        self.rebuild_requested: set[str] = set()
     
     def _add_log(self, session_id: str, message: str):
         """Add a log message for a session."""
@@ -152,11 +173,12 @@ class BuildService:
         
         Returns immediately with status, build runs in background.
         """
-        # Check if already building
+        # Check if already building: the running build may predate these changes
         if self.build_status.get(session_id) == BuildStatus.BUILDING:
+            self.rebuild_requested.add(session_id)
             return {
                 "status": BuildStatus.BUILDING.value,
-                "message": "Build already in progress",
+                "message": "Build already in progress, rebuilding after it",
             }
         
         # Check if build is up to date
@@ -243,37 +265,64 @@ class BuildService:
                         "message": "Build is up to date",
                     }
         
-        # Start build
+        # Claim the build before the first await, so a concurrent call sees it in progress
         start_time = time.time()
         self.build_status[session_id] = BuildStatus.BUILDING
-        self._add_log(session_id, "Build started")
         
         try:
-            # Step 1: Install dependencies
-            self._add_log(session_id, "Installing dependencies...")
-            install_result = await asyncio.to_thread(
-                subprocess.run,
-                ["npm", "install"],
-                cwd=project_path,
-                capture_output=True,
-                text=True,
-                timeout=300,
-            )
-            
-            if install_result.returncode != 0:
-                error_msg = install_result.stderr or install_result.stdout
-                self.build_status[session_id] = BuildStatus.ERROR
-                self.build_errors[session_id] = f"npm install failed: {error_msg}"
-                self._add_log(session_id, f"Error: npm install failed")
+            # Identical inputs were built before: reuse that output instead of rebuilding
+            project = await project_cache.load(session_id)
+            key = build_key(project.code_map, project.package_json)
+            if await self.restore_build(session_id, key):
+                self._add_log(session_id, "Restored matching build output")
+                asyncio.create_task(self._broadcast_build_completion(session_id, 0.0))
                 return {
-                    "status": BuildStatus.ERROR.value,
-                    "error": f"npm install failed: {error_msg[:500]}",
+                    "status": BuildStatus.SUCCESS.value,
+                    "message": "Build restored from cache",
+                    "build_time": 0.0,
                 }
             
-            self._add_log(session_id, "Dependencies installed successfully")
+            # Start build
+            self._add_log(session_id, "Build started")
+            
+            # Step 1: Install dependencies (only when package.json changed since the last install)
+            deps_key = content_hash(project.package_json)
+            installed_key = self.installed_deps.get(session_id) or code_executor.template_deps_key(session_id)
+            if (project_path / "node_modules").exists() and installed_key == deps_key:
+                self._add_log(session_id, "Dependencies unchanged, skipping install")
+            else:
+                self._add_log(session_id, "Installing dependencies...")
+                # node_modules shared with the template is copied up first
+                await asyncio.to_thread(code_executor.own_node_modules, session_id)
+                install_result = await asyncio.to_thread(
+                    subprocess.run,
+                    ["npm", "install"],
+                    cwd=project_path,
+                    capture_output=True,
+                    text=True,
+                    timeout=300,
+                )
+                
+                if install_result.returncode != 0:
+                    error_msg = install_result.stderr or install_result.stdout
+                    self.build_status[session_id] = BuildStatus.ERROR
+                    self.build_errors[session_id] = f"npm install failed: {error_msg}"
+                    self._add_log(session_id, f"Error: npm install failed")
+                    return {
+                        "status": BuildStatus.ERROR.value,
+                        "error": f"npm install failed: {error_msg[:500]}",
+                    }
+                
+                self.installed_deps[session_id] = deps_key
+                self._add_log(session_id, "Dependencies installed successfully")
             
             # Step 2: Build the project
             self._add_log(session_id, "Building project...")
+            archived = self.build_keys.pop(session_id, None) is not None
+            if archived or code_executor.shares_template_dist(session_id):
+                # dist shares its files with an archived build or the template; never write into them
+                await asyncio.to_thread(shutil.rmtree, dist_path, True)
+                code_executor.forget_template_dist(session_id)
             build_result = await asyncio.to_thread(
                 subprocess.run,
                 ["npm", "run", "build"],
@@ -302,6 +351,7 @@ class BuildService:
             build_time = time.time() - start_time
             self.build_status[session_id] = BuildStatus.SUCCESS
             self.build_times[session_id] = build_time
+            await self._archive_if_unchanged(session_id, key)
             self._add_log(session_id, f"Build completed successfully in {build_time:.2f}s")
             
             # Broadcast build completion (real-time update!)
@@ -339,7 +389,102 @@ class BuildService:
         finally:
             # Clear callback after build completes
             self.clear_progress_callback(session_id)
+            if session_id in self.rebuild_requested:
+                self.rebuild_requested.discard(session_id)
+                asyncio.create_task(self.queue_build(session_id, force_rebuild=True))
     
+    async def _archive_if_unchanged(self, session_id: str, key: str):
+        """Archive the build output, unless the inputs changed while building."""
+        try:
+            project = await project_cache.load(session_id)
+            if build_key(project.code_map, project.package_json) != key:
+                self.build_keys.pop(session_id, None)
+                return
+            self.build_keys[session_id] = key
+            await asyncio.to_thread(self.archive_build, session_id, key)
+        except Exception as e:
+            print(f"Error archiving build for session {session_id}: {e}")
+
+    def archive_build(self, session_id: str, key: str):
+        """Keep a hardlinked copy of a session's build output under its build key."""
+        archive_path = self.builds_dir / key
+        dist_path = code_executor.get_project_path(session_id) / "dist"
+        if archive_path.exists() or not dist_path.exists():
+            return
+        self.builds_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.builds_dir / f".{key}.{uuid.uuid4().hex}"
+        code_executor.link_tree(dist_path, tmp_path)
+        try:
+            tmp_path.rename(archive_path)
+        except OSError:
+            # Archived concurrently by another session with the same inputs
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        self._prune_archives()
+
+    def _prune_archives(self):
+        """Drop the least recently used archived builds beyond the limit."""
+        archives = sorted(
+            (path for path in self.builds_dir.iterdir() if not path.name.startswith(".")),
+            key=lambda path: path.stat().st_mtime,
+        )
+        for path in archives[: max(0, len(archives) - config.BUILD_CACHE_MAX_ENTRIES)]:
+            shutil.rmtree(path, ignore_errors=True)
+
+    async def restore_build(self, session_id: str, key: str) -> bool:
+        """Point a session's dist at the archived build for a key; False if there is none."""
+        if self.build_keys.get(session_id) == key and self.is_built(session_id):
+            self.build_status[session_id] = BuildStatus.SUCCESS
+            return True
+        archive_path = self.builds_dir / key
+        if not archive_path.exists():
+            return False
+
+        await asyncio.to_thread(self._link_build, session_id, archive_path)
+        self.build_status[session_id] = BuildStatus.SUCCESS
+        self.build_errors.pop(session_id, None)
+        self.build_keys[session_id] = key
+        asyncio.create_task(self._broadcast_preview_ready(session_id))
+        return True
+
+    def _link_build(self, session_id: str, archive_path: Path):
+        """Swap a session's dist for hardlinks to an archived build."""
+        project_path = code_executor.get_project_path(session_id)
+        dist_path = project_path / "dist"
+        tmp_path = project_path / f".dist.{uuid.uuid4().hex}"
+        code_executor.link_tree(archive_path, tmp_path)
+        old_path = None
+        if dist_path.exists():
+            old_path = project_path / f".dist-old.{uuid.uuid4().hex}"
+            dist_path.rename(old_path)
+        tmp_path.rename(dist_path)
+        code_executor.forget_template_dist(session_id)
+        if old_path is not None:
+            shutil.rmtree(old_path, ignore_errors=True)
+        # Mark the archive as recently used
+        os.utime(archive_path)
+
+    def is_busy(self, session_id: str) -> bool:
+        """Whether a build of the session is queued or running."""
+        return (
+            self.build_status.get(session_id) in (BuildStatus.PENDING, BuildStatus.BUILDING)
+            or session_id in self.rebuild_requested
+        )
+
+    def forget_session(self, session_id: str):
+        """Drop a session's in-memory build state (its project is being hibernated)."""
+        for state in (
+            self.build_status,
+            self.build_errors,
+            self.build_times,
+            self.build_logs,
+            self.build_progress_callbacks,
+            self.build_tasks,
+            self.build_keys,
+            self.installed_deps,
+        ):
+            state.pop(session_id, None)
+        self.rebuild_requested.discard(session_id)
+
     def get_build_status(self, session_id: str) -> dict:
         """Get the current build status for a session."""
         status = self.build_status.get(session_id, BuildStatus.PENDING)
@@ -4,11 +4,43 @@ import json
 import os
 import shutil
 import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from enum import Enum
 from pathlib import Path
 from typing import Optional
 
+from .blob_store import content_hash
 from .config import config
 
+# File marking a golden template version as completely prepared
+TEMPLATE_READY_MARKER = ".ready"
+
+# File in a cloned project whose dist still holds hardlinks to the template's
+# prebuilt output (names the template it came from)
+TEMPLATE_DIST_MARKER = ".template-dist"
+
+# Seconds a write made by the server is remembered, long enough for the
+# file watcher to see the events it causes
+TAGGED_WRITE_TTL_SECONDS = 60.0
+
+
+class WriteOrigin(Enum):
+    """Who wrote a project file."""
+    AGENT = "agent"  # Code generated or edited during a turn
+    RESTORE = "restore"  # Project recreated from the database or a snapshot (restore, rollback, fork)
+
+
+@dataclass
+class TaggedWrite:
+    """A write the server made to a source file, recognisable by its resulting content."""
+    origin: WriteOrigin
+    content_hash: Optional[str]  # None for a deletion
+    expires: float
+
 
 class CodeExecutor:
     """Manages code execution environments using local file system."""
@@ -19,6 +51,10 @@ class CodeExecutor:
     def __init__(self):
         self.projects_dir = Path(config.PROJECTS_DIR)
         self.projects_dir.mkdir(parents=True, exist_ok=True)
+        # session_id -> resolved file path -> last write the server made to it;
+        # read by the file watcher thread
+        self.tagged_writes: dict[str, dict[str, TaggedWrite]] = {}
+        self.tagged_writes_lock = threading.Lock()
 
     def get_project_path(self, session_id: str) -> Path:
         """Get the file system path for a session's project."""
@@ -38,17 +74,122 @@ class CodeExecutor:
                 "exists": True,
             }
 
-        # Create project directory
+        template_path = self.get_template_path()
+        if template_path is not None:
+            self.clone_template(template_path, project_path)
+        else:
+            self.write_starter_files(project_path, f"project-{session_id}")
+
+        return {
+            "url": None,  # Will be set when code is generated and served
+            "session_id": session_id,
+            "exists": False,
+        }
+
+    def get_template_path(self) -> Optional[Path]:
+        """Directory of the current golden template version, if it has been prepared."""
+        template_path = Path(config.PROJECT_TEMPLATE_DIR) / config.PROJECT_TEMPLATE_VERSION
+        if (template_path / TEMPLATE_READY_MARKER).exists():
+            return template_path.resolve()
+        return None
+
+    def clone_template(self, template_path: Path, project_path: Path):
+        """
+        Create a project from the golden template in constant time.
+
+        Only the template's own files (sources, configs) are copied.
+        node_modules is a symlink to the template's installed tree, copied
+        up by own_node_modules before anything installs into it, and the
+        prebuilt dist is hardlinked, recorded by TEMPLATE_DIST_MARKER so
+        the first build removes it rather than writing into its files.
+        """
+        tmp_path = project_path.parent / f".{project_path.name}.{uuid.uuid4().hex}"
+        tmp_path.mkdir(parents=True)
+        try:
+            for entry in template_path.iterdir():
+                if entry.name.startswith("."):
+                    continue
+                target = tmp_path / entry.name
+                if entry.name == "node_modules":
+                    target.symlink_to(entry, target_is_directory=True)
+                elif entry.name == "dist":
+                    self.link_tree(entry, target)
+                    (tmp_path / TEMPLATE_DIST_MARKER).write_text(str(template_path), encoding="utf-8")
+                elif entry.is_dir():
+                    shutil.copytree(entry, target, symlinks=True)
+                else:
+                    shutil.copy2(entry, target)
+            tmp_path.rename(project_path)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if not project_path.exists():
+                raise
+            # Created concurrently by another request for the same session
+
+    def shares_template_dist(self, session_id: str) -> bool:
+        """Whether a project's dist is still the template's (hardlinked) build output."""
+        return (self.get_project_path(session_id) / TEMPLATE_DIST_MARKER).exists()
+
+    def forget_template_dist(self, session_id: str):
+        """Record that a project's dist no longer comes from the template."""
+        (self.get_project_path(session_id) / TEMPLATE_DIST_MARKER).unlink(missing_ok=True)
+
+    def template_deps_key(self, session_id: str) -> Optional[str]:
+        """package.json hash of the template whose node_modules a project still shares, if any."""
+        modules_path = self.get_project_path(session_id) / "node_modules"
+        if not modules_path.is_symlink():
+            return None
+        package_json_path = modules_path.resolve().parent / "package.json"
+        try:
+            return content_hash(package_json_path.read_text(encoding="utf-8"))
+        except OSError:
+            return None
+
+    def own_node_modules(self, session_id: str):
+        """
+        Copy up a shared node_modules before installing into it.
+
+        The symlink is replaced by hardlinks to the shared tree (npm replaces
+        package files rather than editing them); the few files npm rewrites
+        in place at its top level are copied outright.
+        """
+        modules_path = self.get_project_path(session_id) / "node_modules"
+        if not modules_path.is_symlink():
+            return
+        shared_path = modules_path.resolve()
+        modules_path.unlink()
+        if not shared_path.is_dir():
+            return
+        self.link_tree(shared_path, modules_path)
+        for entry in shared_path.iterdir():
+            if entry.is_file() and not entry.is_symlink():
+                target = modules_path / entry.name
+                target.unlink()
+                shutil.copy2(entry, target)
+
+    def share_node_modules(self, source: Path, target: Path):
+        """Give a project another project's node_modules (the same shared tree, or hardlinks to it)."""
+        if target.is_symlink():
+            target.unlink()
+        elif target.exists():
+            shutil.rmtree(target)
+        if source.is_symlink():
+            target.symlink_to(source.resolve(), target_is_directory=True)
+        else:
+            self.link_tree(source, target)
+
+    def write_starter_files(self, project_path: Path, name: str):
+        """Write the built-in starter project (React + Vite + Tailwind) file by file."""
         project_path.mkdir(parents=True, exist_ok=True)
 
         # Initialize a basic React + Vite project structure
-        # For production, you might want to use a template or clone a starter
+        # (also the default source of the golden template, see project_template)
         src_path = project_path / self.DEFAULT_CODE_PATH
         src_path.mkdir(parents=True, exist_ok=True)
 
         # Create basic package.json
         package_json = {
-            "name": f"project-{session_id}",
+            "name": name,
             "version": "0.1.0",
             "type": "module",
             "scripts": {
@@ -140,6 +281,29 @@ export default defineConfig({
         }
         with open(project_path / "tsconfig.json", "w") as f:
             json.dump(tsconfig, f, indent=2)
+
+        # Create Tailwind and PostCSS configs
+        tailwind_config = """/** @type {import('tailwindcss').Config} */
+export default {
+  content: ["./index.html", "./src/**/*.{js,ts,jsx,tsx}"],
+  theme: {
+    extend: {},
+  },
+  plugins: [],
+};
+"""
+        with open(project_path / "tailwind.config.js", "w") as f:
+            f.write(tailwind_config)
+
+        postcss_config = """export default {
+  plugins: {
+    tailwindcss: {},
+    autoprefixer: {},
+  },
+};
+"""
+        with open(project_path / "postcss.config.js", "w") as f:
+            f.write(postcss_config)
         
         # Create basic main.tsx if it doesn't exist
         main_tsx_path = src_path / "main.tsx"
@@ -176,7 +340,11 @@ ReactDOM.createRoot(document.getElementById('root')!).render(
         # Create basic index.css
         index_css_path = src_path / "index.css"
         if not index_css_path.exists():
-            index_css = """* {
+            index_css = """@tailwind base;
+@tailwind components;
+@tailwind utilities;
+
+* {
   margin: 0;
   padding: 0;
   box-sizing: border-box;
@@ -191,12 +359,6 @@ body {
             with open(index_css_path, "w") as f:
                 f.write(index_css)
 
-        return {
-            "url": None,  # Will be set when code is generated and served
-            "session_id": session_id,
-            "exists": False,
-        }
-
     def load_code(self, session_id: str) -> tuple[dict[str, bytes], str]:
         """Load code files from the project directory."""
         project_path = self.get_project_path(session_id)
@@ -220,20 +382,204 @@ body {
 
         return file_map, package_json
 
-    def save_code(self, session_id: str, code_map: dict[str, str]) -> dict:
-        """Save code files to the project directory."""
+    def resolve_code_path(self, session_id: str, file_path_str: str) -> Optional[Path]:
+        """Resolve a model-provided path inside the project's src directory (None if it escapes)."""
+        code_path = (self.get_project_path(session_id) / self.DEFAULT_CODE_PATH).resolve()
+        file_path = (code_path / file_path_str.lstrip("/")).resolve()
+        if not file_path.is_relative_to(code_path):
+            print(f"Ignoring path outside of project src for session {session_id}: {file_path_str}")
+            return None
+        return file_path
+
+    def normalize_code_path(self, session_id: str, file_path_str: str) -> Optional[str]:
+        """
+        The code map key of a model-provided path: relative to src/, as
+        load_code reads it back (e.g. "/App.tsx" and "./App.tsx" are
+        "App.tsx"). None if the path escapes src.
+        """
+        file_path = self.resolve_code_path(session_id, file_path_str)
+        if file_path is None:
+            return None
+        code_path = (self.get_project_path(session_id) / self.DEFAULT_CODE_PATH).resolve()
+        return file_path.relative_to(code_path).as_posix()
+
+    def normalize_changes(
+        self, session_id: str, code_map: dict[str, str], deleted: Optional[list[str]] = None
+    ) -> tuple[dict[str, str], list[str]]:
+        """A model's change set keyed the way the project cache and the database key files."""
+        normalized_map = {}
+        for file_path_str, content in code_map.items():
+            path = self.normalize_code_path(session_id, file_path_str)
+            if path is not None:
+                normalized_map[path] = content
+        normalized_deleted = []
+        for file_path_str in deleted or []:
+            path = self.normalize_code_path(session_id, file_path_str)
+            if path is not None and path not in normalized_map and path not in normalized_deleted:
+                normalized_deleted.append(path)
+        return normalized_map, normalized_deleted
+
+    def save_code(
+        self, session_id: str, code_map: dict[str, str], origin: WriteOrigin = WriteOrigin.AGENT
+    ) -> dict:
+        """
+        Save code files to the project directory.
+
+        Each write is tagged with its origin and content hash before it
+        happens, so the file watcher can tell it from an external edit.
+        """
         project_path = self.get_project_path(session_id)
         code_path = project_path / self.DEFAULT_CODE_PATH
         code_path.mkdir(parents=True, exist_ok=True)
 
         for file_path_str, content in code_map.items():
-            file_path = code_path / file_path_str
+            file_path = self.resolve_code_path(session_id, file_path_str)
+            if file_path is None:
+                continue
             file_path.parent.mkdir(parents=True, exist_ok=True)
+            self.tag_write(session_id, file_path, content_hash(content), origin)
+            self.write_file(file_path, content)
 
-            with open(file_path, "w", encoding="utf-8") as f:
+        return {"session_id": session_id}
+
+    def tag_write(
+        self, session_id: str, file_path: Path, file_hash: Optional[str], origin: WriteOrigin
+    ):
+        """Remember a write (file_hash None for a deletion) the server is about to make."""
+        now = time.monotonic()
+        with self.tagged_writes_lock:
+            writes = self.tagged_writes.setdefault(session_id, {})
+            for path in [path for path, write in writes.items() if write.expires <= now]:
+                del writes[path]
+            writes[str(file_path)] = TaggedWrite(origin, file_hash, now + TAGGED_WRITE_TTL_SECONDS)
+
+    def match_tagged_write(self, session_id: str, file_path_str: str) -> Optional[WriteOrigin]:
+        """
+        Origin of the server's last write to a file, if the file still holds what it wrote.
+
+        A file whose content no longer matches was edited since, so its tag
+        is dropped: reverting that edit later is an external change too.
+        """
+        file_path = self.resolve_code_path(session_id, file_path_str)
+        if file_path is None:
+            return None
+        with self.tagged_writes_lock:
+            write = self.tagged_writes.get(session_id, {}).get(str(file_path))
+        if write is None or write.expires <= time.monotonic():
+            return None
+
+        try:
+            current = content_hash(file_path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            current = None
+        except (OSError, UnicodeDecodeError):
+            current = ""
+        if current == write.content_hash:
+            return write.origin
+
+        with self.tagged_writes_lock:
+            writes = self.tagged_writes.get(session_id, {})
+            if writes.get(str(file_path)) is write:
+                del writes[str(file_path)]
+        return None
+
+    def forget_tagged_writes(self, session_id: str):
+        """Drop a session's tagged writes (its files are no longer watched)."""
+        with self.tagged_writes_lock:
+            self.tagged_writes.pop(session_id, None)
+
+    def write_file(self, file_path: Path, content: str):
+        """
+        Write a file atomically (temp file + rename).
+
+        Readers never see a half-written file, and a file hardlinked into
+        another project is replaced rather than modified in place.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=file_path.parent, prefix=f".{file_path.name}.")
+        try:
+            os.fchmod(fd, 0o644)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
                 f.write(content)
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def write_project(
+        self, session_id: str, code_map: dict[str, str], origin: WriteOrigin = WriteOrigin.RESTORE
+    ) -> tuple[dict[str, str], list[str]]:
+        """
+        Make a project's src directory hold exactly the given files.
+
+        Only files whose content differs are written. Returns the changed
+        files and the removed paths.
+        """
+        current, _ = self.load_code(session_id)
+        changed = {
+            path: content
+            for path, content in code_map.items()
+            if current.get(path) != content.encode("utf-8")
+        }
+        removed = [path for path in current if path not in code_map]
+        self.save_code(session_id, changed, origin)
+        self.delete_files(session_id, removed, origin)
+        return changed, removed
 
-        return {"session_id": session_id}
+    def link_tree(self, source: Path, target: Path):
+        """
+        Recreate a directory tree with hardlinks (copying where linking isn't possible).
+
+        Linked files share storage with the source, which is safe for trees
+        that are replaced rather than edited in place (node_modules, build output).
+        """
+
+        def link_or_copy(src: str, dst: str):
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copy2(src, dst)
+
+        shutil.copytree(source, target, symlinks=True, copy_function=link_or_copy, dirs_exist_ok=True)
+
+    def save_package_json(self, session_id: str, package_json: str):
+        """Overwrite the project's package.json."""
+        project_path = self.get_project_path(session_id)
+        project_path.mkdir(parents=True, exist_ok=True)
+        self.write_file(project_path / "package.json", package_json)
+
+    def delete_files(
+        self, session_id: str, file_paths: list[str], origin: WriteOrigin = WriteOrigin.AGENT
+    ) -> list[str]:
+        """Delete code files from the project directory; returns the paths removed."""
+        deleted = []
+        for file_path_str in file_paths:
+            file_path = self.resolve_code_path(session_id, file_path_str)
+            if file_path is not None and file_path.is_file():
+                self.tag_write(session_id, file_path, None, origin)
+                file_path.unlink()
+                deleted.append(file_path_str)
+        return deleted
+
+    def fork_project(
+        self,
+        source_session_id: str,
+        session_id: str,
+        code_map: dict[str, str],
+        package_json: Optional[str],
+    ):
+        """Create a session's project from another one's files, linking its node_modules."""
+        self.create_project(session_id)
+        self.write_project(session_id, code_map)
+        if package_json is not None:
+            self.save_package_json(session_id, package_json)
+
+        # Dependencies can be shared as long as package.json is the same
+        source_path = self.get_project_path(source_session_id)
+        source_modules = source_path / "node_modules"
+        source_package_json = source_path / "package.json"
+        if source_modules.is_dir() and source_package_json.exists():
+            if package_json is None or source_package_json.read_text(encoding="utf-8") == package_json:
+                self.share_node_modules(source_modules, self.get_project_path(session_id) / "node_modules")
 
     def start_dev_server(self, session_id: str) -> Optional[subprocess.Popen]:
         """Start a development server for the project (optional - for local preview)."""
@@ -14,32 +14,147 @@ class Config:
     ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY", "")
     GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY", "")  # For future Gemini support
 
+    # Storage backend: "supabase" or "sqlite" (local file, WAL mode)
+    DATABASE_BACKEND = os.getenv("DATABASE_BACKEND", "supabase")
+    SQLITE_PATH = os.getenv("SQLITE_PATH", "./data/app.db")
+
     # Supabase
     SUPABASE_URL = os.getenv("SUPABASE_URL", "")
     SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY", "")
     SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
 
+    # Database access (bounded pool, per-call timeout, jittered retries)
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_TIMEOUT_SECONDS = float(os.getenv("DB_TIMEOUT_SECONDS", "10"))
+    DB_MAX_RETRIES = int(os.getenv("DB_MAX_RETRIES", "3"))
+    DB_RETRY_BASE_DELAY = float(os.getenv("DB_RETRY_BASE_DELAY", "0.1"))
+    DB_RETRY_MAX_DELAY = float(os.getenv("DB_RETRY_MAX_DELAY", "2.0"))
+
+    # Write-behind persistence of code files (max staleness ~ one flush interval)
+    PERSIST_FLUSH_INTERVAL_MS = int(os.getenv("PERSIST_FLUSH_INTERVAL_MS", "500"))
+    PERSIST_MAX_BATCH_FILES = int(os.getenv("PERSIST_MAX_BATCH_FILES", "200"))
+    # Failed flushes back off exponentially per session; after the last attempt the
+    # writes are also saved to a dead-letter file and retried at the longest delay
+    PERSIST_MAX_ATTEMPTS = int(os.getenv("PERSIST_MAX_ATTEMPTS", "8"))
+    PERSIST_RETRY_BASE_DELAY = float(os.getenv("PERSIST_RETRY_BASE_DELAY", "1.0"))
+    PERSIST_RETRY_MAX_DELAY = float(os.getenv("PERSIST_RETRY_MAX_DELAY", "60.0"))
+    PERSIST_DEAD_LETTER_DIR = os.getenv("PERSIST_DEAD_LETTER_DIR", "./data/dead_letter")
+
+    # In-memory LRU cache of project files
+    PROJECT_CACHE_MAX_BYTES = int(os.getenv("PROJECT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+    # Content-addressed blobs: in-memory content cache and number of hashes remembered as stored
+    BLOB_CACHE_MAX_BYTES = int(os.getenv("BLOB_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+    BLOB_KNOWN_HASHES_MAX = int(os.getenv("BLOB_KNOWN_HASHES_MAX", "100000"))
+
+    # Archived build outputs kept for instant rollback/fork previews
+    BUILD_CACHE_MAX_ENTRIES = int(os.getenv("BUILD_CACHE_MAX_ENTRIES", "50"))
+
     # Server
     HOST = os.getenv("HOST", "0.0.0.0")
     PORT = int(os.getenv("PORT", "8000"))
     DEBUG = os.getenv("DEBUG", "false").lower() == "true"
 
+    # WebSocket fan-out: per-connection outbound queue and slow-consumer policy ("drop" or "disconnect")
+    WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+    WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "drop")
+    WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "10"))
+    # Per-message compression (permessage-deflate, negotiated by the client) and
+    # the largest frame sent to clients that reassemble chunked transfers
+    WS_PER_MESSAGE_DEFLATE = os.getenv("WS_PER_MESSAGE_DEFLATE", "true").lower() == "true"
+    WS_MAX_FRAME_BYTES = int(os.getenv("WS_MAX_FRAME_BYTES", str(1024 * 1024)))
+    # Requests a single WebSocket may have in flight at once
+    WS_MAX_CONCURRENT_REQUESTS = int(os.getenv("WS_MAX_CONCURRENT_REQUESTS", "8"))
+    # Session events kept for replay to reconnecting clients, and how long a
+    # session's stream is kept after its last client disconnects
+    WS_REPLAY_BUFFER_SIZE = int(os.getenv("WS_REPLAY_BUFFER_SIZE", "256"))
+    WS_REPLAY_RETENTION_SECONDS = float(os.getenv("WS_REPLAY_RETENTION_SECONDS", "120"))
+
+    # Pub/sub backplane for session broadcasts: "local" (single process) or
+    # "socket" (broker shared by all workers: python -m src.pubsub)
+    PUBSUB_BACKEND = os.getenv("PUBSUB_BACKEND", "local")
+    PUBSUB_SOCKET_PATH = os.getenv("PUBSUB_SOCKET_PATH", "./data/pubsub.sock")
+
+    # File watcher: quiet window before a session's changes are delivered as one
+    # change set, and the longest a change set is held under constant activity
+    FILE_WATCH_DEBOUNCE_MS = int(os.getenv("FILE_WATCH_DEBOUNCE_MS", "300"))
+    FILE_WATCH_MAX_DELAY_MS = int(os.getenv("FILE_WATCH_MAX_DELAY_MS", "2000"))
+
     # Code execution (local file system path)
     PROJECTS_DIR = os.getenv("PROJECTS_DIR", "./projects")
+
+    # Golden project template every new project is cloned from (installed
+    # dependencies and prebuilt output included). Versions are immutable:
+    # bump the version to change the template. The source is a git URL or a
+    # directory to start from instead of the built-in starter.
+    PROJECT_TEMPLATE_DIR = os.getenv("PROJECT_TEMPLATE_DIR", os.path.join(PROJECTS_DIR, ".templates"))
+    PROJECT_TEMPLATE_VERSION = os.getenv("PROJECT_TEMPLATE_VERSION", "v1")
+    PROJECT_TEMPLATE_SOURCE = os.getenv("PROJECT_TEMPLATE_SOURCE", "")
+
+    # Idle session hibernation: a session untouched this long (with no connected
+    # client, turn or build) is archived and woken on its next access; 0 disables
+    SESSION_IDLE_SECONDS = float(os.getenv("SESSION_IDLE_SECONDS", "1800"))
+    SESSION_SWEEP_INTERVAL_SECONDS = float(os.getenv("SESSION_SWEEP_INTERVAL_SECONDS", "60"))
+    # Installed node_modules trees kept by package.json hash for hibernated sessions
+    DEPS_STORE_MAX_ENTRIES = int(os.getenv("DEPS_STORE_MAX_ENTRIES", "20"))
     
     # Backend URL for preview links (set this to your Railway/public URL)
     BACKEND_URL = os.getenv("BACKEND_URL", "https://website-ai-2-production.up.railway.app")
 
+    # Turn scheduling when a new message arrives during a turn ("cancel" or "queue")
+    TURN_POLICY = os.getenv("TURN_POLICY", "cancel").lower()
+
+    # Frame interval for coalescing streamed partial updates
+    STREAM_FRAME_INTERVAL_MS = int(os.getenv("STREAM_FRAME_INTERVAL_MS", "50"))
+
+    # Conversation memory (approximate tokens)
+    HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "4000"))
+    HISTORY_MAX_MESSAGE_TOKENS = int(os.getenv("HISTORY_MAX_MESSAGE_TOKENS", "800"))
+    HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "800"))
+
+    # Model routing and hedged requests
+    LLM_ROUTER_CLIENTS = os.getenv("LLM_ROUTER_CLIENTS", "FastCodingClient,OpenAIClient,ClaudeClient")
+    LLM_ROUTER_PRIOR_TTFT_MS = float(os.getenv("LLM_ROUTER_PRIOR_TTFT_MS", "1500"))
+    LLM_ROUTER_PRIOR_TOKENS_PER_SEC = float(os.getenv("LLM_ROUTER_PRIOR_TOKENS_PER_SEC", "60"))
+    LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "true").lower() == "true"
+    LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+    LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "10"))
+    LLM_HEDGE_DEFAULT_MS = float(os.getenv("LLM_HEDGE_DEFAULT_MS", "4000"))
+    LLM_HEDGE_MIN_MS = float(os.getenv("LLM_HEDGE_MIN_MS", "1000"))
+    LLM_HEDGE_MAX_MS = float(os.getenv("LLM_HEDGE_MAX_MS", "10000"))
+
+    # LLM record/replay ("off", "record" or "replay")
+    LLM_REPLAY_MODE = os.getenv("LLM_REPLAY_MODE", "off").lower()
+    LLM_REPLAY_DIR = os.getenv("LLM_REPLAY_DIR", "./llm_recordings")
+    # Replay speed factor: 1.0 keeps recorded timing, 10.0 is 10x faster, 0 disables delays
+    LLM_REPLAY_SPEED = float(os.getenv("LLM_REPLAY_SPEED", "1.0"))
+
+    # Offline mock model server (OpenAI streaming protocol)
+    LLM_MOCK_BASE_URL = os.getenv("LLM_MOCK_BASE_URL", "")
+    MOCK_LLM_PORT = int(os.getenv("MOCK_LLM_PORT", "8100"))
+    MOCK_LLM_TTFT_MS = int(os.getenv("MOCK_LLM_TTFT_MS", "300"))
+    MOCK_LLM_TOKENS_PER_SEC = float(os.getenv("MOCK_LLM_TOKENS_PER_SEC", "200"))
+    MOCK_LLM_RESPONSE_FILE = os.getenv("MOCK_LLM_RESPONSE_FILE", "")
+
     @classmethod
     def validate(cls):
         """Validate required configuration."""
         errors = []
-        if not cls.OPENAI_API_KEY:
-            errors.append("OPENAI_API_KEY is required")
-        if not cls.SUPABASE_URL:
-            errors.append("SUPABASE_URL is required")
-        if not cls.SUPABASE_ANON_KEY and not cls.SUPABASE_SERVICE_ROLE_KEY:
-            errors.append("SUPABASE_ANON_KEY or SUPABASE_SERVICE_ROLE_KEY is required")
+        if cls.LLM_REPLAY_MODE not in ("off", "record", "replay"):
+            errors.append("LLM_REPLAY_MODE must be 'off', 'record' or 'replay'")
+        # Offline runs (mock model server, replayed recordings) make no live model calls
+        offline = bool(cls.LLM_MOCK_BASE_URL) or cls.LLM_REPLAY_MODE == "replay"
+        if not cls.OPENAI_API_KEY and not offline:
+            errors.append("OPENAI_API_KEY is required (unless LLM_MOCK_BASE_URL is set or LLM_REPLAY_MODE is 'replay')")
+        if cls.DATABASE_BACKEND not in ("supabase", "sqlite"):
+            errors.append("DATABASE_BACKEND must be 'supabase' or 'sqlite'")
+        if cls.PUBSUB_BACKEND not in ("local", "socket"):
+            errors.append("PUBSUB_BACKEND must be 'local' or 'socket'")
+        if cls.DATABASE_BACKEND == "supabase":
+            if not cls.SUPABASE_URL:
+                errors.append("SUPABASE_URL is required")
+            if not cls.SUPABASE_ANON_KEY and not cls.SUPABASE_SERVICE_ROLE_KEY:
+                errors.append("SUPABASE_ANON_KEY or SUPABASE_SERVICE_ROLE_KEY is required")
         if errors:
             raise ValueError(f"Configuration errors: {', '.join(errors)}")
 
@@ -0,0 +1,172 @@
+"""Token-budgeted conversation memory with a rolling summary of older turns."""
+
+import asyncio
+from dataclasses import dataclass
+from typing import Optional
+
+from .config import config
+from .database import db
+
+# Rough character-per-token ratio (good enough for budgeting prompts)
+CHARS_PER_TOKEN = 4
+
+# Messages fetched per turn; anything older is covered by the summary
+RECENT_FETCH_LIMIT = 50
+
+# Messages read per page while folding older turns into the summary
+SUMMARY_FETCH_LIMIT = 500
+
+# Characters kept per message when compacting it into the summary
+SUMMARY_LINE_CHARS = 200
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate the token count of a text."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Truncate a text to roughly max_tokens, marking the cut."""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rstrip() + " ...[truncated]"
+
+
+def compact_message(role: str, content: str) -> str:
+    """Compact a message into a single summary line."""
+    text = " ".join(content.split())
+    if role == "assistant":
+        # The first sentence of a plan usually states what was done
+        end = text.find(". ")
+        if 0 < end < SUMMARY_LINE_CHARS:
+            text = text[: end + 1]
+        prefix = "Assistant"
+    else:
+        prefix = "User" if role == "user" else role.capitalize()
+    if len(text) > SUMMARY_LINE_CHARS:
+        text = text[:SUMMARY_LINE_CHARS].rstrip() + "..."
+    return f"- {prefix}: {text}"
+
+
+@dataclass
+class PromptHistory:
+    """Conversation context for a prompt."""
+    # Rolling summary of older turns ("" if none), for the system prompt
+    summary: str
+    # Recent turns verbatim, oldest first
+    messages: list[dict]
+
+
+class ConversationMemory:
+    """
+    Builds bounded conversation history for prompts.
+
+    The most recent turns are kept verbatim (each capped at a per-message
+    budget) within a total token budget; older turns are folded into a rolling
+    summary stored in conversation_summaries. The summary is updated in a
+    background task, never on the turn's critical path, and is returned
+    separately from the turns: it belongs in the system prompt, not in the
+    middle of the conversation.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = config.HISTORY_TOKEN_BUDGET,
+        max_message_tokens: int = config.HISTORY_MAX_MESSAGE_TOKENS,
+        summary_tokens: int = config.HISTORY_SUMMARY_TOKENS,
+    ):
+        self.token_budget = token_budget
+        self.max_message_tokens = max_message_tokens
+        self.summary_tokens = summary_tokens
+        self.summary_tasks: dict[str, asyncio.Task] = {}
+
+    async def get_history(self, session_id: str) -> PromptHistory:
+        """Get the prompt history for a session: its summary and recent turns."""
+        summary = await db.get_conversation_summary(session_id)
+        watermark = summary["summarized_through"] if summary else None
+        # One message more than needed tells whether older unsummarized ones exist
+        messages = await db.get_conversation_history(
+            session_id, limit=RECENT_FETCH_LIMIT + 1, after=watermark
+        )
+        truncated = len(messages) > RECENT_FETCH_LIMIT
+        messages = messages[-RECENT_FETCH_LIMIT:]
+
+        summary_text = summary["summary"] if summary else ""
+        used_tokens = estimate_tokens(summary_text) if summary_text else 0
+
+        # Walk back from the newest message until the budget is spent
+        recent: list[dict] = []
+        for msg in reversed(messages):
+            content = truncate_to_tokens(msg["content"], self.max_message_tokens)
+            tokens = estimate_tokens(content)
+            if recent and used_tokens + tokens > self.token_budget:
+                break
+            used_tokens += tokens
+            recent.append({"role": msg["role"], "content": content})
+        recent.reverse()
+
+        if recent and (truncated or len(recent) < len(messages)):
+            # Everything older than the oldest verbatim message gets summarized,
+            # whether it was left out for the budget or not even fetched
+            self.schedule_summary(
+                session_id, before=messages[len(messages) - len(recent)]["created_at"]
+            )
+
+        return PromptHistory(summary=summary_text, messages=recent)
+
+    def schedule_summary(self, session_id: str, before: str):
+        """Update the rolling summary in the background (one task per session)."""
+        task = self.summary_tasks.get(session_id)
+        if task and not task.done():
+            return
+        self.summary_tasks[session_id] = asyncio.create_task(
+            self._update_summary(session_id, before)
+        )
+
+    async def _update_summary(self, session_id: str, before: str):
+        """Fold messages older than `before` into the session's rolling summary."""
+        try:
+            summary = await db.get_conversation_summary(session_id)
+            # Page forward from the watermark, which only ever moves past messages read
+            while True:
+                watermark = summary["summarized_through"] if summary else None
+                messages = await db.get_conversation_history(
+                    session_id, limit=SUMMARY_FETCH_LIMIT, after=watermark, before=before, earliest=True
+                )
+                if not messages:
+                    return
+
+                lines = summary["summary"].splitlines() if summary and summary["summary"] else []
+                lines.extend(compact_message(msg["role"], msg["content"]) for msg in messages)
+                summary = {
+                    "summary": self.compact(lines),
+                    "summarized_through": messages[-1]["created_at"],
+                    "message_count": (summary["message_count"] if summary else 0) + len(messages),
+                }
+                await db.save_conversation_summary(
+                    session_id, summary["summary"], summary["summarized_through"], summary["message_count"]
+                )
+                if len(messages) < SUMMARY_FETCH_LIMIT:
+                    return
+        except Exception as e:
+            print(f"Error updating conversation summary for session {session_id}: {e}")
+        finally:
+            self.summary_tasks.pop(session_id, None)
+
+    def compact(self, lines: list[str]) -> str:
+        """Keep the newest summary lines that fit the summary budget."""
+        kept: list[str] = []
+        used_tokens = 0
+        for line in reversed(lines):
+            tokens = estimate_tokens(line)
+            if kept and used_tokens + tokens > self.summary_tokens:
+                break
+            used_tokens += tokens
+            kept.append(line)
+        kept.reverse()
+        return "\n".join(kept)
+
+
+# Global conversation memory instance
+conversation_memory = ConversationMemory()
@@ -1,28 +1,104 @@
 """Supabase database integration for session and code storage."""
 
+import asyncio
 import os
-from typing import Optional
-from supabase import create_client, Client
+import random
+from typing import Any, Awaitable, Callable, Optional
+
+import httpx
 from dotenv import load_dotenv
+from postgrest.exceptions import APIError
+from supabase import AsyncClient, AsyncClientOptions, acreate_client
+
+from .config import config
 
 load_dotenv()
 
+# Errors raised before a request reached the server - always safe to retry
+CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+# Blob hashes per lookup query
+BLOB_FETCH_CHUNK = 100
+
 
 class Database:
-    """Database interface for Supabase operations."""
+    """
+    Async database interface for Supabase operations.
+
+    Every call goes through a bounded pool (at most DB_POOL_SIZE requests in
+    flight), a per-call timeout and retries with full jitter on transient
+    errors. Non-idempotent inserts are only retried when the connection
+    itself failed, so a retry can never duplicate a row.
+    """
 
     def __init__(self):
-        supabase_url = os.getenv("SUPABASE_URL")
-        supabase_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_ANON_KEY")
+        self.supabase_url = os.getenv("SUPABASE_URL")
+        self.supabase_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_ANON_KEY")
 
-        if not supabase_url or not supabase_key:
+        if not self.supabase_url or not self.supabase_key:
             raise ValueError(
                 "SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY (or SUPABASE_ANON_KEY) must be set"
             )
 
-        self.supabase: Client = create_client(supabase_url, supabase_key)
+        self.supabase: Optional[AsyncClient] = None
+        self.timeout = config.DB_TIMEOUT_SECONDS
+        self.max_retries = config.DB_MAX_RETRIES
+        self._pool = asyncio.Semaphore(config.DB_POOL_SIZE)
+        self._client_lock = asyncio.Lock()
+
+    async def _get_client(self) -> AsyncClient:
+        """Create the async Supabase client on first use."""
+        if self.supabase is None:
+            async with self._client_lock:
+                if self.supabase is None:
+                    self.supabase = await acreate_client(
+                        self.supabase_url,
+                        self.supabase_key,
+                        options=AsyncClientOptions(postgrest_client_timeout=self.timeout),
+                    )
+        return self.supabase
+
+    def _is_retryable(self, error: Exception, idempotent: bool) -> bool:
+        """Whether a failed call may be retried."""
+        if isinstance(error, CONNECT_ERRORS):
+            return True
+        if not idempotent:
+            return False
+        if isinstance(error, (TimeoutError, httpx.TransportError)):
+            return True
+        if isinstance(error, APIError):
+            # Server-side/transient failures; client errors (4xx, constraint violations) are final
+            return str(error.code or "").startswith(("5", "08", "57P"))
+        return False
+
+    async def _execute(
+        self, build: Callable[[AsyncClient], Awaitable[Any]], idempotent: bool = True
+    ) -> Any:
+        """Run a query within the pool, with a timeout and jittered retries."""
+        client = await self._get_client()
+        attempt = 0
+        while True:
+            try:
+                async with self._pool:
+                    return await asyncio.wait_for(build(client), self.timeout)
+            except Exception as e:
+                if attempt >= self.max_retries or not self._is_retryable(e, idempotent):
+                    raise
+                # Full jitter: uniform in [0, min(cap, base * 2^attempt)]
+                delay = random.uniform(
+                    0, min(config.DB_RETRY_MAX_DELAY, config.DB_RETRY_BASE_DELAY * 2**attempt)
+                )
+                attempt += 1
+                print(f"Database call failed ({e!r}), retry {attempt}/{self.max_retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def close(self):
+        """Close the underlying HTTP connections."""
+        if self.supabase is not None:
+            await self.supabase.postgrest.aclose()
+            self.supabase = None
 
-    def create_session(
+    async def create_session(
         self, session_id: str, project_url: Optional[str] = None, metadata: Optional[dict] = None
     ) -> dict:
         """Create a new session."""
@@ -31,68 +107,239 @@ class Database:
             "project_url": project_url,
             "metadata": metadata or {},
         }
-        result = self.supabase.table("sessions").insert(data).execute()
+        result = await self._execute(
+            lambda c: c.table("sessions").insert(data).execute(), idempotent=False
+        )
         return result.data[0] if result.data else {}
 
-    def get_session(self, session_id: str) -> Optional[dict]:
+    async def bootstrap_session(self, session_id: str, history_limit: int = 50) -> dict:
+        """
+        Get or create a session in one round trip (see bootstrap_session in supabase_schema.sql).
+
+        Returns a dict with the session row, whether it was created, the
+        latest snapshot (or None) and recent history, oldest first.
+        """
+        params = {"p_session_id": session_id, "p_history_limit": history_limit}
+        result = await self._execute(lambda c: c.rpc("bootstrap_session", params).execute())
+        return result.data
+
+    async def get_session(self, session_id: str) -> Optional[dict]:
         """Get session by session_id."""
-        result = (
-            self.supabase.table("sessions").select("*").eq("session_id", session_id).execute()
+        result = await self._execute(
+            lambda c: c.table("sessions").select("*").eq("session_id", session_id).execute()
         )
         return result.data[0] if result.data else None
 
-    def update_session(self, session_id: str, **kwargs) -> dict:
+    async def update_session(self, session_id: str, **kwargs) -> dict:
         """Update session."""
-        result = (
-            self.supabase.table("sessions")
-            .update(kwargs)
+        result = await self._execute(
+            lambda c: c.table("sessions").update(kwargs).eq("session_id", session_id).execute()
+        )
+        return result.data[0] if result.data else {}
+
+    async def save_code_file(self, session_id: str, file_path: str, content: str) -> dict:
+        """Save or update a code file (as a one-file change set)."""
+        await self.save_code_files(session_id, {file_path: content})
+        result = await self._execute(
+            lambda c: c.table("code_files")
+            .select("*")
             .eq("session_id", session_id)
+            .eq("file_path", file_path)
             .execute()
         )
         return result.data[0] if result.data else {}
 
-    def save_code_file(self, session_id: str, file_path: str, content: str) -> dict:
-        """Save or update a code file."""
-        data = {
-            "session_id": session_id,
-            "file_path": file_path,
-            "content": content,
+    async def save_code_files(
+        self, session_id: str, files: dict[str, str], deleted: Optional[list[str]] = None
+    ) -> int:
+        """
+        Save a change set in one round trip and one transaction.
+
+        Stores the contents as blobs, points the files at them, deletes the
+        removed files and returns the new project version (see
+        apply_code_changes in supabase_schema.sql).
+        """
+        params = {
+            "p_session_id": session_id,
+            "p_files": [
+                {"file_path": file_path, "content": content}
+                for file_path, content in files.items()
+            ],
+            "p_deleted": list(deleted or []),
         }
-        # Use upsert to handle both insert and update
-        result = (
-            self.supabase.table("code_files")
-            .upsert(data, on_conflict="session_id,file_path")
-            .execute()
+        # Not idempotent: every applied change set bumps the project version
+        result = await self._execute(
+            lambda c: c.rpc("apply_code_changes", params).execute(), idempotent=False
         )
-        return result.data[0] if result.data else {}
+        return int(result.data)
 
-    def get_code_files(self, session_id: str) -> dict[str, str]:
+    async def get_code_files(self, session_id: str) -> dict[str, str]:
         """Get all code files for a session."""
-        result = (
-            self.supabase.table("code_files")
-            .select("file_path, content")
+        result = await self._execute(
+            lambda c: c.table("code_files")
+            .select("file_path, blobs(content)")
+            .eq("session_id", session_id)
+            .execute()
+        )
+        return {file["file_path"]: file["blobs"]["content"] for file in result.data}
+
+    async def get_missing_blobs(self, hashes: list[str]) -> set[str]:
+        """Get the hashes that have no stored blob yet."""
+        result = await self._execute(
+            lambda c: c.rpc("missing_blobs", {"p_hashes": hashes}).execute()
+        )
+        return set(result.data or [])
+
+    async def get_blobs(self, hashes: list[str]) -> dict[str, str]:
+        """Get blob contents by hash."""
+        blobs: dict[str, str] = {}
+        # Hashes go into the query string, so fetch in chunks
+        for start in range(0, len(hashes), BLOB_FETCH_CHUNK):
+            chunk = hashes[start : start + BLOB_FETCH_CHUNK]
+            result = await self._execute(
+                lambda c: c.table("blobs").select("hash, content").in_("hash", chunk).execute()
+            )
+            blobs.update({blob["hash"]: blob["content"] for blob in result.data})
+        return blobs
+
+    async def save_snapshot(
+        self,
+        session_id: str,
+        turn_id: Optional[str],
+        manifest: dict[str, str],
+        package_json_hash: Optional[str],
+        blobs: dict[str, str],
+    ) -> dict:
+        """Store new blobs and a snapshot manifest in one transaction (see save_snapshot in supabase_schema.sql)."""
+        params = {
+            "p_session_id": session_id,
+            "p_turn_id": turn_id,
+            "p_manifest": manifest,
+            "p_package_json_hash": package_json_hash,
+            "p_blobs": [{"hash": blob_hash, "content": content} for blob_hash, content in blobs.items()],
+        }
+        result = await self._execute(
+            lambda c: c.rpc("save_snapshot", params).execute(), idempotent=False
+        )
+        return result.data or {}
+
+    async def get_snapshot(self, snapshot_id: str) -> Optional[dict]:
+        """Get a snapshot, including its manifest."""
+        result = await self._execute(
+            lambda c: c.table("snapshots").select("*").eq("id", snapshot_id).execute()
+        )
+        return result.data[0] if result.data else None
+
+    async def get_latest_snapshot(self, session_id: str) -> Optional[dict]:
+        """Get a session's most recent snapshot, including its manifest."""
+        result = await self._execute(
+            lambda c: c.table("snapshots")
+            .select("*")
             .eq("session_id", session_id)
+            .order("created_at", desc=True)
+            .limit(1)
             .execute()
         )
-        return {file["file_path"]: file["content"] for file in result.data}
+        return result.data[0] if result.data else None
 
-    def save_conversation(self, session_id: str, role: str, content: str) -> dict:
+    async def list_snapshots(self, session_id: str, limit: int = 50) -> list[dict]:
+        """List a session's most recent snapshots (without manifests)."""
+        result = await self._execute(
+            lambda c: c.table("snapshots")
+            .select("id, session_id, turn_id, parent_id, package_json_hash, created_at")
+            .eq("session_id", session_id)
+            .order("created_at", desc=True)
+            .limit(limit)
+            .execute()
+        )
+        return result.data
+
+    async def save_conversation(self, session_id: str, role: str, content: str) -> dict:
         """Save a conversation message."""
         data = {
             "session_id": session_id,
             "role": role,
             "content": content,
         }
-        result = self.supabase.table("conversations").insert(data).execute()
+        result = await self._execute(
+            lambda c: c.table("conversations").insert(data).execute(), idempotent=False
+        )
+        return result.data[0] if result.data else {}
+
+    async def get_conversation_history(
+        self,
+        session_id: str,
+        limit: int = 50,
+        after: Optional[str] = None,
+        before: Optional[str] = None,
+        earliest: bool = False,
+    ) -> list[dict]:
+        """
+        Get the most recent conversation messages for a session, oldest first.
+
+        Args:
+            after: Only messages created after this timestamp (exclusive)
+            before: Only messages created before this timestamp (exclusive)
+            earliest: Get the earliest `limit` matching messages instead (for paging forward)
+        """
+
+        def build(c: AsyncClient):
+            query = (
+                c.table("conversations")
+                .select("role, content, created_at")
+                .eq("session_id", session_id)
+            )
+            if after:
+                query = query.gt("created_at", after)
+            if before:
+                query = query.lt("created_at", before)
+            return query.order("created_at", desc=not earliest).limit(limit).execute()
+
+        result = await self._execute(build)
+        return result.data if earliest else list(reversed(result.data))
+
+    async def get_conversation_summary(self, session_id: str) -> Optional[dict]:
+        """Get the rolling summary of older conversation turns."""
+        result = await self._execute(
+            lambda c: c.table("conversation_summaries")
+            .select("summary, summarized_through, message_count")
+            .eq("session_id", session_id)
+            .execute()
+        )
+        return result.data[0] if result.data else None
+
+    async def save_conversation_summary(
+        self, session_id: str, summary: str, summarized_through: str, message_count: int
+    ) -> dict:
+        """Save the rolling summary covering messages up to summarized_through."""
+        data = {
+            "session_id": session_id,
+            "summary": summary,
+            "summarized_through": summarized_through,
+            "message_count": message_count,
+        }
+        result = await self._execute(
+            lambda c: c.table("conversation_summaries")
+            .upsert(data, on_conflict="session_id")
+            .execute()
+        )
+        return result.data[0] if result.data else {}
+
+    async def save_llm_call(self, call: dict) -> dict:
+        """Save the metrics of a single LLM call."""
+        data = {key: value for key, value in call.items() if key != "started_at"}
+        result = await self._execute(
+            lambda c: c.table("llm_calls").insert(data).execute(), idempotent=False
+        )
         return result.data[0] if result.data else {}
 
-    def get_conversation_history(self, session_id: str, limit: int = 50) -> list[dict]:
-        """Get conversation history for a session."""
-        result = (
-            self.supabase.table("conversations")
-            .select("role, content")
+    async def get_llm_calls(self, session_id: str, limit: int = 50) -> list[dict]:
+        """Get the most recent LLM call metrics for a session."""
+        result = await self._execute(
+            lambda c: c.table("llm_calls")
+            .select("*")
             .eq("session_id", session_id)
-            .order("created_at", desc=False)
+            .order("created_at", desc=True)
             .limit(limit)
             .execute()
         )
@@ -100,5 +347,9 @@ class Database:
 
 
 # Global database instance
-db = Database()
+if config.DATABASE_BACKEND == "sqlite":
+    from .sqlite_database import SQLiteDatabase
 
+    db = SQLiteDatabase(config.SQLITE_PATH)
+else:
+    db = Database()
@@ -1,94 +1,579 @@
 """File watcher for hot reloading - watches code changes and triggers rebuilds."""
 
 import asyncio
-import time
+import ctypes
+import os
+import select
+import threading
+from dataclasses import dataclass
+from enum import Enum
 from pathlib import Path
-from typing import Callable, Optional
+from typing import Awaitable, Callable, Optional
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler, FileSystemEvent
+from watchdog.events import (
+    EVENT_TYPE_CREATED,
+    EVENT_TYPE_DELETED,
+    EVENT_TYPE_MODIFIED,
+    EVENT_TYPE_MOVED,
+    DirCreatedEvent,
+    DirDeletedEvent,
+    DirMovedEvent,
+    FileCreatedEvent,
+    FileDeletedEvent,
+    FileModifiedEvent,
+    FileMovedEvent,
+    FileSystemEventHandler,
+    FileSystemEvent,
+)
+from watchdog.utils import UnsupportedLibc
+from watchdog.version import VERSION_MAJOR, VERSION_MINOR, VERSION_STRING
 
 from .config import config
-from .code_executor import code_executor
+from .code_executor import WriteOrigin, code_executor
+from .metrics import Sample, metrics_registry
+from .project_cache import project_cache
+
+# Events that change a project's contents (open/close events don't)
+CONTENT_EVENT_TYPES = {EVENT_TYPE_CREATED, EVENT_TYPE_DELETED, EVENT_TYPE_MODIFIED, EVENT_TYPE_MOVED}
+
+# Directories never watched (build outputs, dependencies)
+IGNORED_DIRS = {"node_modules", "dist", ".git", "__pycache__"}
+
+# Files whose changes matter to builds
+SOURCE_SUFFIXES = {".tsx", ".ts", ".jsx", ".js", ".css", ".json"}
+
+# watchdog versions whose inotify internals SharedInotify was verified against.
+# It uses private parts of watchdog.observers.inotify_c (the ctypes bindings and
+# Inotify._parse_event_buffer), which may change in any release: other versions
+# get the shared watchdog observer instead, and the watchdog pin in
+# requirements.txt should only move along with this list.
+SUPPORTED_WATCHDOG_VERSIONS = {(4, 0)}
+
+# Private names of watchdog.observers.inotify_c that SharedInotify uses
+INOTIFY_C_NAMES = ("Inotify", "InotifyConstants", "inotify_add_watch", "inotify_init", "inotify_rm_watch")
+
+
+def load_inotify_c(version: tuple[int, int] = (VERSION_MAJOR, VERSION_MINOR)):
+    """watchdog's inotify internals, or None where SharedInotify can't rely on them."""
+    try:
+        from watchdog.observers import inotify_c
+    except UnsupportedLibc:  # Not Linux
+        return None
+    if version not in SUPPORTED_WATCHDOG_VERSIONS:
+        print(f"watchdog {version[0]}.{version[1]} is not verified with the shared inotify watcher, using an observer")
+        return None
+    missing = [name for name in INOTIFY_C_NAMES if not hasattr(inotify_c, name)]
+    if not callable(getattr(getattr(inotify_c, "Inotify", None), "_parse_event_buffer", None)):
+        missing.append("Inotify._parse_event_buffer")
+    if missing:
+        print(f"watchdog {VERSION_STRING} lacks {', '.join(missing)}, using an observer for file watching")
+        return None
+    return inotify_c
+
+
+inotify_c = load_inotify_c()
+if inotify_c is not None:
+    Inotify = inotify_c.Inotify
+    InotifyConstants = inotify_c.InotifyConstants
+    inotify_add_watch = inotify_c.inotify_add_watch
+    inotify_init = inotify_c.inotify_init
+    inotify_rm_watch = inotify_c.inotify_rm_watch
+else:  # Fall back to a shared watchdog observer
+    Inotify = None
+
+# Receives (session_id, event) on the watcher thread
+Dispatch = Callable[[str, FileSystemEvent], None]
+
+# Receives a session_id whose events were lost, on the watcher thread
+Rescan = Callable[[str], None]
+
+
+class ChangeKind(Enum):
+    """How a file changed."""
+    CREATED = "created"
+    MODIFIED = "modified"
+    DELETED = "deleted"
+    MOVED = "moved"
+
+
+@dataclass
+class FileChange:
+    """One file's net change within a change set (paths relative to src/)."""
+    path: str
+    kind: ChangeKind
+    old_path: Optional[str] = None  # Where a moved file came from
+
+    def to_dict(self) -> dict:
+        data = {"path": self.path, "kind": self.kind.value}
+        if self.old_path is not None:
+            data["old_path"] = self.old_path
+        return data
+
+
+@dataclass
+class ChangeSet:
+    """The files of a session that changed during one quiet window."""
+    session_id: str
+    changes: list[FileChange]
+    # Events were lost (inotify queue overflow): anything may have changed
+    rescan: bool = False
+
+    @property
+    def paths(self) -> list[str]:
+        return [change.path for change in self.changes]
+
+    def to_dict(self) -> dict:
+        data = {"session_id": self.session_id, "changes": [change.to_dict() for change in self.changes]}
+        if self.rescan:
+            data["rescan"] = True
+        return data
+
+
+def should_process_path(path: str) -> bool:
+    """Check if a path is a source file we care about."""
+    # Only watch source files, not build outputs or node_modules
+    parts = Path(path).parts
+    if any(part in IGNORED_DIRS for part in parts):
+        return False
+    
+    # Only watch source files
+    return Path(path).suffix in SOURCE_SUFFIXES
 
 
 class CodeChangeHandler(FileSystemEventHandler):
-    """Handles file system events for code changes."""
+    """
+    Bridges a session's file events from the watcher thread to the event loop.
+
+    Events are handed to the loop with call_soon_threadsafe and collected
+    into one change set per session. The set is delivered once no event
+    arrived for a quiet window (or after max_delay_seconds of constant
+    activity), so saving 15 files triggers one rebuild rather than 15.
+    Within a set, changes to the same path are merged into their net
+    effect (created then modified is created, created then deleted is
+    nothing).
+
+    Events caused by the server's own writes (CodeExecutor.save_code tags
+    each write with its origin and content hash) are dropped when the file
+    still holds what the server wrote: whoever wrote it already queued the
+    build and updated the project cache, so only external edits rebuild.
+
+    When the watcher lost events, rescan() marks the next set as a rescan:
+    the project cache is dropped and the set is delivered even if no
+    individual change is known, so the session is rebuilt from disk.
+    """
     
-    def __init__(self, session_id: str, on_change: Callable[[str], None], debounce_seconds: float = 1.0):
+    def __init__(
+        self,
+        session_id: str,
+        root: Path,
+        on_change: Callable[[ChangeSet], Awaitable[None]],
+        loop: asyncio.AbstractEventLoop,
+        debounce_seconds: float = config.FILE_WATCH_DEBOUNCE_MS / 1000,
+        max_delay_seconds: float = config.FILE_WATCH_MAX_DELAY_MS / 1000,
+    ):
         self.session_id = session_id
+        self.root = root
         self.on_change = on_change
+        # Events arrive on the watcher thread; everything else runs on the server's loop
+        self.loop = loop
         self.debounce_seconds = debounce_seconds
-        self.last_change_time: dict[str, float] = {}
-        self.pending_tasks: dict[str, asyncio.Task] = {}
-    
-    def should_process_event(self, event_path: str) -> bool:
-        """Check if we should process this event."""
-        # Only watch source files, not build outputs or node_modules
-        path = Path(event_path)
-        if any(part in path.parts for part in ['node_modules', 'dist', '.git', '__pycache__']):
-            return False
-        
-        # Only watch source files
-        if path.suffix not in ['.tsx', '.ts', '.jsx', '.js', '.css', '.json']:
-            return False
-        
-        return True
+        self.max_delay_seconds = max_delay_seconds
+        self.pending: dict[str, FileChange] = {}
+        self.batch_started: Optional[float] = None
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+        self.rescan_pending = False
+        self.change_sets_delivered = 0
+        self.self_writes_ignored: dict[WriteOrigin, int] = {}
     
-    def on_modified(self, event: FileSystemEvent):
-        """Handle file modification events."""
-        if event.is_directory:
+    def _relative(self, path: str) -> Optional[str]:
+        """Path relative to the session's src/, or None if it isn't a source file."""
+        if not should_process_path(path):
+            return None
+        try:
+            return Path(path).relative_to(self.root).as_posix()
+        except ValueError:
+            return None
+    
+    def on_any_event(self, event: FileSystemEvent):
+        """Forward a content change to the event loop (runs on the watcher thread)."""
+        if event.is_directory or event.event_type not in CONTENT_EVENT_TYPES:
             return
         
-        event_path = event.src_path
-        if not self.should_process_event(event_path):
-            return
+        path = self._relative(event.src_path)
+        if event.event_type == EVENT_TYPE_MOVED:
+            dest = self._relative(event.dest_path)
+            if path is None and dest is None:
+                return
+            if dest is None:
+                change = FileChange(path, ChangeKind.DELETED)
+            elif path is None:
+                # e.g. an atomic write renaming a temp file over the real one
+                change = FileChange(dest, ChangeKind.MODIFIED)
+            else:
+                change = FileChange(dest, ChangeKind.MOVED, old_path=path)
+        else:
+            if path is None:
+                return
+            change = FileChange(path, ChangeKind(event.event_type))
         
-        # Debounce: only process if enough time has passed since last change
-        current_time = time.time()
-        last_time = self.last_change_time.get(event_path, 0)
+        if change.kind != ChangeKind.MOVED:
+            origin = code_executor.match_tagged_write(self.session_id, change.path)
+            if origin is not None:
+                self.self_writes_ignored[origin] = self.self_writes_ignored.get(origin, 0) + 1
+                return
         
-        if current_time - last_time < self.debounce_seconds:
-            # Cancel previous pending task
-            if event_path in self.pending_tasks:
-                self.pending_tasks[event_path].cancel()
-            
-            # Schedule new task
-            task = asyncio.create_task(self._debounced_change(event_path, current_time))
-            self.pending_tasks[event_path] = task
-        else:
-            # Process immediately
-            self.last_change_time[event_path] = current_time
-            asyncio.create_task(self._handle_change(event_path))
+        self.loop.call_soon_threadsafe(self._record, change)
     
-    async def _debounced_change(self, event_path: str, change_time: float):
-        """Handle debounced file change."""
-        await asyncio.sleep(self.debounce_seconds)
+    def _record(self, change: FileChange):
+        """Merge a change into the pending set and restart the quiet window (runs on the loop)."""
+        # Anything cached from before this change is stale
+        project_cache.invalidate(self.session_id)
+        
+        if change.kind == ChangeKind.MOVED:
+            source = self.pending.pop(change.old_path, None)
+            if source is not None and source.kind == ChangeKind.CREATED:
+                # Created and moved within the window: it is simply new at its destination
+                change = FileChange(change.path, ChangeKind.CREATED)
         
-        # Only process if this is still the latest change
-        if self.last_change_time.get(event_path, 0) <= change_time:
-            self.last_change_time[event_path] = change_time
-            await self._handle_change(event_path)
+        previous = self.pending.get(change.path)
+        if previous is not None:
+            if previous.kind == ChangeKind.CREATED and change.kind == ChangeKind.DELETED:
+                del self.pending[change.path]
+                change = None
+            elif previous.kind == ChangeKind.CREATED and change.kind == ChangeKind.MODIFIED:
+                change = previous
+            elif previous.kind == ChangeKind.DELETED and change.kind == ChangeKind.CREATED:
+                change = FileChange(change.path, ChangeKind.MODIFIED)
+        if change is not None:
+            self.pending[change.path] = change
+        self._schedule_flush()
+    
+    def rescan(self):
+        """Events for this session were lost (runs on the watcher thread)."""
+        self.loop.call_soon_threadsafe(self._record_rescan)
+    
+    def _record_rescan(self):
+        project_cache.invalidate(self.session_id)
+        self.rescan_pending = True
+        self._schedule_flush()
+    
+    def _schedule_flush(self):
+        """Restart the quiet window before delivering the pending set."""
+        now = self.loop.time()
+        if self.batch_started is None:
+            self.batch_started = now
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+        # Quiet window, but never hold a batch longer than max_delay_seconds
+        delay = min(self.debounce_seconds, self.batch_started + self.max_delay_seconds - now)
+        self.flush_handle = self.loop.call_later(max(delay, 0), self._flush)
     
-    async def _handle_change(self, event_path: str):
-        """Handle a file change event."""
+    def _flush(self):
+        """Deliver the pending change set."""
+        self.flush_handle = None
+        self.batch_started = None
+        if not self.pending and not self.rescan_pending:
+            return
+        change_set = ChangeSet(self.session_id, list(self.pending.values()), rescan=self.rescan_pending)
+        self.pending = {}
+        self.rescan_pending = False
+        self.change_sets_delivered += 1
+        asyncio.create_task(self._handle_change(change_set))
+    
+    def cancel(self):
+        """Drop pending changes (the session is no longer watched)."""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        self.pending = {}
+        self.rescan_pending = False
+    
+    async def _handle_change(self, change_set: ChangeSet):
+        """Handle a change set."""
         try:
-            print(f"File changed: {event_path} for session {self.session_id}")
-            await self.on_change(self.session_id)
+            if change_set.rescan:
+                print(f"File events lost for session {self.session_id}, rescanning")
+            else:
+                print(f"Files changed for session {self.session_id}: {change_set.paths}")
+            await self.on_change(change_set)
         except Exception as e:
             print(f"Error handling file change: {e}")
 
 
+class SessionIndex:
+    """Path-prefix index mapping any path under a watched root to its session."""
+
+    def __init__(self):
+        self.roots: dict[str, str] = {}
+
+    def add(self, session_id: str, root: str):
+        self.roots[root] = session_id
+
+    def remove(self, root: str):
+        self.roots.pop(root, None)
+
+    def lookup(self, path: str) -> Optional[str]:
+        """Session whose root contains `path` (walks up the path's parents)."""
+        while True:
+            session_id = self.roots.get(path)
+            if session_id is not None:
+                return session_id
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+
+
+class SharedInotify:
+    """
+    A single inotify instance and reader thread watching every session.
+
+    Each directory of a session's source tree gets one watch descriptor on
+    the shared instance, so a session costs a few kernel watches instead of
+    an observer thread and an inotify instance of its own. Events are
+    routed to sessions through the path-prefix index.
+    """
+
+    WATCH_MASK = (
+        InotifyConstants.IN_CREATE
+        | InotifyConstants.IN_DELETE
+        | InotifyConstants.IN_CLOSE_WRITE
+        | InotifyConstants.IN_MOVED_FROM
+        | InotifyConstants.IN_MOVED_TO
+        | InotifyConstants.IN_ONLYDIR
+        | InotifyConstants.IN_DONT_FOLLOW
+        | InotifyConstants.IN_EXCL_UNLINK
+    ) if Inotify is not None else 0
+
+    def __init__(self, dispatch: Dispatch, rescan: Rescan):
+        self.dispatch = dispatch
+        self.rescan = rescan
+        self.index = SessionIndex()
+        self.lock = threading.Lock()
+        self.fd: Optional[int] = None
+        self.thread: Optional[threading.Thread] = None
+        self._wakeup_r, self._wakeup_w = -1, -1
+        self.directories: dict[int, str] = {}  # watch descriptor -> directory
+        self.descriptors: dict[str, int] = {}  # directory -> watch descriptor
+        self.overflows = 0
+
+    def _start(self):
+        """Open the inotify instance and start the reader thread (lock held)."""
+        fd = inotify_init()
+        if fd == -1:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+        self.fd = fd
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        self.thread = threading.Thread(target=self._read_loop, name="file-watcher", daemon=True)
+        self.thread.start()
+
+    def add(self, session_id: str, root: Path):
+        """Watch a session's source tree."""
+        with self.lock:
+            if self.fd is None:
+                self._start()
+            self.index.add(session_id, str(root))
+            self._add_tree(str(root))
+
+    def remove(self, root: Path):
+        """Stop watching a session's source tree."""
+        prefix = str(root)
+        with self.lock:
+            self.index.remove(prefix)
+            for directory in [d for d in self.descriptors if d == prefix or d.startswith(prefix + os.sep)]:
+                wd = self.descriptors.pop(directory)
+                self.directories.pop(wd, None)
+                inotify_rm_watch(self.fd, wd)
+
+    def _add_tree(self, root: str):
+        """Add a watch for a directory and every directory under it (lock held)."""
+        for directory, subdirectories, _ in os.walk(root):
+            subdirectories[:] = [d for d in subdirectories if d not in IGNORED_DIRS]
+            if directory in self.descriptors:
+                continue
+            wd = inotify_add_watch(self.fd, directory.encode(), self.WATCH_MASK)
+            if wd == -1:
+                print(f"Could not watch {directory}: {os.strerror(ctypes.get_errno())}")
+                continue
+            self.directories[wd] = directory
+            self.descriptors[directory] = wd
+
+    def stop(self):
+        """Close the inotify instance and stop the reader thread."""
+        with self.lock:
+            if self.fd is None:
+                return
+            os.write(self._wakeup_w, b"x")
+        self.thread.join()
+        with self.lock:
+            os.close(self.fd)
+            os.close(self._wakeup_r)
+            os.close(self._wakeup_w)
+            self.fd = None
+            self.thread = None
+            self.directories.clear()
+            self.descriptors.clear()
+
+    def _read_loop(self):
+        while True:
+            readable, _, _ = select.select([self.fd, self._wakeup_r], [], [])
+            if self._wakeup_r in readable:
+                return
+            try:
+                buffer = os.read(self.fd, 64 * 1024)
+            except OSError as e:
+                print(f"File watcher read error: {e}")
+                return
+            try:
+                self._handle_events(buffer)
+            except Exception as e:
+                print(f"Error handling file events: {e}")
+
+    def _handle_events(self, buffer: bytes):
+        """Translate raw inotify events into watchdog events for their sessions."""
+        moved_from: dict[int, tuple[str, bool]] = {}
+        for wd, mask, cookie, name in Inotify._parse_event_buffer(buffer):
+            if mask & InotifyConstants.IN_Q_OVERFLOW:
+                # Events were lost, including directories created since: watch
+                # every tree again and have every session rescanned
+                self.overflows += 1
+                with self.lock:
+                    roots = list(self.index.roots.items())
+                    for root, _ in roots:
+                        self._add_tree(root)
+                for _, session_id in roots:
+                    self.rescan(session_id)
+                continue
+
+            with self.lock:
+                if mask & InotifyConstants.IN_IGNORED:
+                    directory = self.directories.pop(wd, None)
+                    if directory is not None and self.descriptors.get(directory) == wd:
+                        del self.descriptors[directory]
+                    continue
+                directory = self.directories.get(wd)
+            if directory is None:
+                continue
+
+            path = os.path.join(directory, os.fsdecode(name)) if name else directory
+            is_dir = bool(mask & InotifyConstants.IN_ISDIR)
+            session_id = self.index.lookup(path)
+            if session_id is None:
+                continue
+
+            if mask & InotifyConstants.IN_MOVED_FROM:
+                moved_from[cookie] = (path, is_dir)
+                continue
+            if mask & InotifyConstants.IN_MOVED_TO:
+                source = moved_from.pop(cookie, None)
+                if is_dir and os.path.basename(path) not in IGNORED_DIRS:
+                    with self.lock:
+                        self._add_tree(path)
+                if source is None:
+                    event = DirCreatedEvent(path) if is_dir else FileCreatedEvent(path)
+                else:
+                    event = DirMovedEvent(source[0], path) if is_dir else FileMovedEvent(source[0], path)
+            elif mask & InotifyConstants.IN_CREATE:
+                if is_dir and os.path.basename(path) not in IGNORED_DIRS:
+                    with self.lock:
+                        self._add_tree(path)
+                event = DirCreatedEvent(path) if is_dir else FileCreatedEvent(path)
+            elif mask & InotifyConstants.IN_DELETE:
+                event = DirDeletedEvent(path) if is_dir else FileDeletedEvent(path)
+            elif mask & InotifyConstants.IN_CLOSE_WRITE:
+                event = FileModifiedEvent(path)
+            else:
+                continue
+            self.dispatch(session_id, event)
+
+        # Moved out of every watched tree
+        for path, is_dir in moved_from.values():
+            session_id = self.index.lookup(path)
+            if session_id is not None:
+                self.dispatch(session_id, DirDeletedEvent(path) if is_dir else FileDeletedEvent(path))
+
+    def watch_count(self) -> int:
+        return len(self.descriptors)
+
+
+class _RoutingHandler(FileSystemEventHandler):
+    """Forwards a watchdog observer's events for one session."""
+
+    def __init__(self, session_id: str, dispatch: Dispatch):
+        self.session_id = session_id
+        self.dispatch_event = dispatch
+
+    def on_any_event(self, event: FileSystemEvent):
+        self.dispatch_event(self.session_id, event)
+
+
+class SharedObserver:
+    """Fallback where inotify isn't available: one watchdog observer scheduling every session."""
+
+    def __init__(self, dispatch: Dispatch):
+        self.dispatch = dispatch
+        self.observer: Optional[Observer] = None
+        self.watches: dict[str, object] = {}
+
+    def add(self, session_id: str, root: Path):
+        if self.observer is None:
+            self.observer = Observer()
+            self.observer.start()
+        self.watches[str(root)] = self.observer.schedule(
+            _RoutingHandler(session_id, self.dispatch), str(root), recursive=True
+        )
+
+    def remove(self, root: Path):
+        watch = self.watches.pop(str(root), None)
+        if watch is not None and self.observer is not None:
+            self.observer.unschedule(watch)
+
+    def stop(self):
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+            self.observer = None
+        self.watches.clear()
+
+    def watch_count(self) -> int:
+        return len(self.watches)
+
+
 class FileWatcher:
-    """Watches file changes and triggers rebuilds (hot reloading)."""
+    """
+    Watches file changes and triggers rebuilds (hot reloading).
+
+    All sessions share one watcher backend (a single inotify instance and
+    thread on Linux), so watching costs no thread per session and sessions
+    are added and removed as they come and go.
+    """
     
     def __init__(self):
-        self.observers: dict[str, Observer] = {}
         self.handlers: dict[str, CodeChangeHandler] = {}
-        self.is_watching: dict[str, bool] = {}
+        self.roots: dict[str, Path] = {}
+        self.backend = (
+            SharedInotify(self._dispatch, self._rescan) if Inotify is not None else SharedObserver(self._dispatch)
+        )
+        self.events_dispatched = 0
+    
+    def _dispatch(self, session_id: str, event: FileSystemEvent):
+        """Hand an event to its session's handler (runs on the watcher thread)."""
+        handler = self.handlers.get(session_id)
+        if handler is not None:
+            self.events_dispatched += 1
+            handler.dispatch(event)
+    
+    def _rescan(self, session_id: str):
+        """Have a session's handler rescan it (runs on the watcher thread)."""
+        handler = self.handlers.get(session_id)
+        if handler is not None:
+            handler.rescan()
     
-    async def watch_session(self, session_id: str, on_change: Callable[[str], None]):
-        """Start watching a session's code files for changes."""
-        if session_id in self.observers:
+    async def watch_session(
+        self, session_id: str, on_change: Callable[[ChangeSet], Awaitable[None]]
+    ):
+        """Start watching a session's code files; on_change gets batched change sets."""
+        if session_id in self.handlers:
             # Already watching
             return
         
@@ -99,42 +584,55 @@ class FileWatcher:
             return
         
         # Create handler
-        handler = CodeChangeHandler(session_id, on_change, debounce_seconds=1.0)
-        self.handlers[session_id] = handler
-        
-        # Create observer
-        observer = Observer()
-        observer.schedule(handler, str(src_path), recursive=True)
-        observer.start()
-        
-        self.observers[session_id] = observer
-        self.is_watching[session_id] = True
+        self.handlers[session_id] = CodeChangeHandler(
+            session_id, src_path, on_change, asyncio.get_running_loop()
+        )
+        self.roots[session_id] = src_path
+        self.backend.add(session_id, src_path)
         
         print(f"Started watching files for session {session_id}")
     
     def stop_watching(self, session_id: str):
         """Stop watching a session's files."""
-        if session_id in self.observers:
-            observer = self.observers[session_id]
-            observer.stop()
-            observer.join()
-            
-            del self.observers[session_id]
-            self.handlers.pop(session_id, None)
-            self.is_watching.pop(session_id, None)
+        if session_id in self.handlers:
+            self.backend.remove(self.roots.pop(session_id))
+            self.handlers.pop(session_id).cancel()
+            code_executor.forget_tagged_writes(session_id)
             
             print(f"Stopped watching files for session {session_id}")
     
     def is_watching_session(self, session_id: str) -> bool:
         """Check if we're watching a session."""
-        return self.is_watching.get(session_id, False)
+        return session_id in self.handlers
     
     def stop_all(self):
         """Stop watching all sessions."""
-        for session_id in list(self.observers.keys()):
+        for session_id in list(self.handlers.keys()):
             self.stop_watching(session_id)
+        self.backend.stop()
+
+    def get_metrics(self) -> list[Sample]:
+        """Metrics samples for /metrics."""
+        return [
+            ("file_watcher_sessions", {}, len(self.handlers)),
+            ("file_watcher_watches", {}, self.backend.watch_count()),
+            ("file_watcher_events_total", {}, self.events_dispatched),
+            (
+                "file_watcher_change_sets_total",
+                {},
+                sum(handler.change_sets_delivered for handler in self.handlers.values()),
+            ),
+            ("file_watcher_overflows_total", {}, getattr(self.backend, "overflows", 0)),
+        ] + [
+            (
+                "file_watcher_self_writes_ignored_total",
+                {"origin": origin.value},
+                sum(handler.self_writes_ignored.get(origin, 0) for handler in self.handlers.values()),
+            )
+            for origin in WriteOrigin
+        ]
 
 
 # Global file watcher instance
 file_watcher = FileWatcher()
-
+metrics_registry.register(file_watcher.get_metrics)
@@ -0,0 +1,239 @@
+"""Per-call LLM latency instrumentation (TTFT, plan/file timings, tokens/sec)."""
+
+import asyncio
+import json
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from typing import Any, AsyncGenerator, AsyncIterator, Optional
+
+from baml_py import Collector
+
+from .database import db
+from .llm_replay import to_jsonable
+from .metrics import Sample, metrics_registry
+
+# Rough character-per-token ratio used when the provider reports no usage
+CHARS_PER_TOKEN = 4
+
+# USD per 1M (input, output) tokens of the clients in baml_src/build.baml
+CLIENT_PRICING: dict[str, tuple[float, float]] = {
+    "FastCodingClient": (0.15, 0.60),  # gpt-4o-mini
+    "OpenAIClient": (2.50, 10.00),  # gpt-4o
+    "ClaudeClient": (3.00, 15.00),  # claude-3-5-sonnet
+}
+
+
+@dataclass
+class LLMCallMetrics:
+    """Timings and token usage of a single streamed LLM call."""
+    session_id: str
+    turn_id: str
+    function_name: str
+    client_name: str
+    started_at: float
+    status: str = "ok"
+    ttft_ms: Optional[float] = None
+    plan_complete_ms: Optional[float] = None
+    total_ms: Optional[float] = None
+    file_done_ms: dict[str, float] = field(default_factory=dict)
+    input_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+    tokens_estimated: bool = False
+    tokens_per_sec: Optional[float] = None
+    cost_usd: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _quantile(values: list[float], q: float) -> Optional[float]:
+    """Nearest-rank quantile of a list of samples."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(int(q * len(ordered)), len(ordered) - 1)
+    return ordered[index]
+
+
+class LLMMetrics:
+    """Tracks LLM call latencies per session/turn and aggregates them per client."""
+
+    def __init__(self, window: int = 200, session_history: int = 50):
+        self.session_calls: dict[str, deque[LLMCallMetrics]] = {}
+        self.session_history = session_history
+        # Rolling per-client samples (used for SLOs and routing)
+        self.ttft_samples: dict[str, deque[float]] = {}
+        self.throughput_samples: dict[str, deque[float]] = {}
+        self.window = window
+        self.call_counts: dict[tuple[str, str, str], int] = {}
+        self.token_totals: dict[tuple[str, str, str], int] = {}
+        self.cost_totals: dict[tuple[str, str], float] = {}
+        self._persist_tasks: set[asyncio.Task] = set()
+
+    def new_collector(self, name: str) -> Collector:
+        """Create a BAML collector for a single call."""
+        return Collector(name=name)
+
+    async def track(
+        self,
+        stream: AsyncIterator,
+        *,
+        session_id: str,
+        turn_id: str,
+        function_name: str,
+        client_name: str,
+        collector: Optional[Collector] = None,
+    ) -> AsyncGenerator[Any, None]:
+        """Pass a stream of partials through while recording its timings."""
+        call = LLMCallMetrics(
+            session_id=session_id,
+            turn_id=turn_id,
+            function_name=function_name,
+            client_name=client_name,
+            started_at=time.time(),
+        )
+        start = time.monotonic()
+        last_partial = None
+
+        try:
+            async for partial in stream:
+                elapsed_ms = (time.monotonic() - start) * 1000
+                if call.ttft_ms is None:
+                    call.ttft_ms = elapsed_ms
+
+                plan = getattr(partial, "plan", None)
+                if call.plan_complete_ms is None and getattr(plan, "state", None) == "Complete":
+                    call.plan_complete_ms = elapsed_ms
+
+                for file in getattr(partial, "files", None) or []:
+                    if file.path and file.path not in call.file_done_ms:
+                        call.file_done_ms[file.path] = elapsed_ms
+
+                last_partial = partial
+                yield partial
+        except (asyncio.CancelledError, GeneratorExit):
+            # Superseded turn or losing hedged request
+            call.status = "cancelled"
+            raise
+        except Exception:
+            call.status = "error"
+            raise
+        finally:
+            call.total_ms = (time.monotonic() - start) * 1000
+            # Closing the tracked stream ends the live call
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            self._apply_usage(call, collector, last_partial)
+            self.record(call)
+
+    def _apply_usage(self, call: LLMCallMetrics, collector: Optional[Collector], last_partial: Any):
+        """Fill token usage from the collector, estimating it if the provider reported none."""
+        log = collector.last if collector is not None else None
+        if log is not None and log.usage is not None:
+            call.input_tokens = log.usage.input_tokens
+            call.output_tokens = log.usage.output_tokens
+
+        if call.output_tokens is None and last_partial is not None:
+            output_chars = len(json.dumps(to_jsonable(last_partial), default=str))
+            call.output_tokens = output_chars // CHARS_PER_TOKEN
+            call.tokens_estimated = True
+
+        if call.output_tokens and call.ttft_ms is not None:
+            generation_seconds = (call.total_ms - call.ttft_ms) / 1000
+            if generation_seconds > 0:
+                call.tokens_per_sec = call.output_tokens / generation_seconds
+
+        pricing = CLIENT_PRICING.get(call.client_name)
+        if pricing is not None:
+            input_price, output_price = pricing
+            call.cost_usd = (
+                (call.input_tokens or 0) * input_price + (call.output_tokens or 0) * output_price
+            ) / 1_000_000
+
+    def record(self, call: LLMCallMetrics):
+        """Store a finished call in memory and persist it in the background."""
+        if call.session_id not in self.session_calls:
+            self.session_calls[call.session_id] = deque(maxlen=self.session_history)
+        self.session_calls[call.session_id].append(call)
+
+        key = (call.function_name, call.client_name, call.status)
+        self.call_counts[key] = self.call_counts.get(key, 0) + 1
+
+        if call.status == "ok":
+            if call.ttft_ms is not None:
+                self.ttft_samples.setdefault(call.client_name, deque(maxlen=self.window)).append(call.ttft_ms)
+            if call.tokens_per_sec is not None:
+                self.throughput_samples.setdefault(call.client_name, deque(maxlen=self.window)).append(call.tokens_per_sec)
+
+        # Cancelled calls (e.g. hedge losers) still cost tokens
+        for direction, tokens in (("input", call.input_tokens), ("output", call.output_tokens)):
+            if tokens:
+                token_key = (call.client_name, direction, call.status)
+                self.token_totals[token_key] = self.token_totals.get(token_key, 0) + tokens
+        if call.cost_usd:
+            cost_key = (call.client_name, call.status)
+            self.cost_totals[cost_key] = self.cost_totals.get(cost_key, 0.0) + call.cost_usd
+
+        try:
+            task = asyncio.create_task(self._persist(call))
+            self._persist_tasks.add(task)
+            task.add_done_callback(self._persist_tasks.discard)
+        except RuntimeError:
+            # No running event loop (e.g. scripts) - skip persistence
+            pass
+
+    async def _persist(self, call: LLMCallMetrics):
+        """Persist a call's metrics without failing the turn."""
+        try:
+            await db.save_llm_call(call.to_dict())
+        except Exception as e:
+            print(f"Error saving LLM call metrics for session {call.session_id}: {e}")
+
+    def get_session_calls(self, session_id: str) -> list[dict]:
+        """Get the recent calls of a session (newest last)."""
+        return [call.to_dict() for call in self.session_calls.get(session_id, [])]
+
+    def get_client_stats(self, client_name: str) -> dict:
+        """Get rolling TTFT quantiles and throughput for a client."""
+        ttft = list(self.ttft_samples.get(client_name, []))
+        throughput = list(self.throughput_samples.get(client_name, []))
+        return {
+            "samples": len(ttft),
+            "ttft_p50_ms": _quantile(ttft, 0.5),
+            "ttft_p95_ms": _quantile(ttft, 0.95),
+            "tokens_per_sec": sum(throughput) / len(throughput) if throughput else None,
+        }
+
+    def get_metrics(self) -> list[Sample]:
+        """Metrics samples for /metrics."""
+        samples: list[Sample] = []
+        for (function_name, client_name, status), count in self.call_counts.items():
+            samples.append((
+                "llm_calls_total",
+                {"function": function_name, "client": client_name, "status": status},
+                count,
+            ))
+        for (client_name, direction, status), tokens in self.token_totals.items():
+            samples.append((
+                "llm_tokens_total",
+                {"client": client_name, "direction": direction, "status": status},
+                tokens,
+            ))
+        for (client_name, status), cost in self.cost_totals.items():
+            samples.append(("llm_cost_usd_total", {"client": client_name, "status": status}, cost))
+        for client_name in self.ttft_samples:
+            stats = self.get_client_stats(client_name)
+            for q in ("p50", "p95"):
+                value = stats[f"ttft_{q}_ms"]
+                if value is not None:
+                    samples.append(("llm_ttft_ms", {"client": client_name, "quantile": q}, value))
+            if stats["tokens_per_sec"] is not None:
+                samples.append(("llm_tokens_per_sec", {"client": client_name}, stats["tokens_per_sec"]))
+        return samples
+
+
+# Global LLM metrics instance
+llm_metrics = LLMMetrics()
+metrics_registry.register(llm_metrics.get_metrics)
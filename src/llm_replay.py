@@ -0,0 +1,259 @@
+"""Record/replay layer for streamed BAML calls (deterministic, offline runs)."""
+
+import asyncio
+import hashlib
+import json
+import time
+from contextlib import aclosing
+from enum import Enum
+from importlib.metadata import version as package_version
+from pathlib import Path
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Iterable, Iterator
+
+from baml_py import BamlStream, ClientRegistry
+from pydantic import BaseModel
+
+from baml_client import partial_types
+
+from .config import config
+
+MOCK_CLIENT_NAME = "MockClient"
+
+_STREAM_END = object()
+
+# baml-py versions whose BamlStream internals aiter_baml_stream was verified
+# against. It drives the stream's private FFI future (_BamlStream__ffi_stream,
+# __ctx_manager, __partial_coerce) on the event loop, so that cancelling the
+# consumer drops the future and aborts the provider request. Other versions
+# fall back to BamlStream's own iterator, which runs the call on a thread
+# that outlives a cancelled consumer.
+SUPPORTED_BAML_VERSIONS = {(0, 90)}
+
+
+def _baml_version() -> tuple[int, ...]:
+    """Major and minor version of the installed baml-py."""
+    return tuple(int(part) for part in package_version("baml-py").split(".")[:2])
+
+
+BAML_STREAM_INTERNALS = _baml_version() in SUPPORTED_BAML_VERSIONS
+if not BAML_STREAM_INTERNALS:
+    print(f"baml-py {package_version('baml-py')} is not verified for cancellable streams; cancelled calls run to completion")
+
+
+class ReplayMode(Enum):
+    """Record/replay mode."""
+    OFF = "off"
+    RECORD = "record"
+    REPLAY = "replay"
+
+
+def to_jsonable(value: Any) -> Any:
+    """Convert BAML/pydantic arguments into plain JSON-serializable values."""
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    if isinstance(value, dict):
+        return {str(k): to_jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(v) for v in value]
+    return value
+
+
+async def aiter_baml_stream(stream: BamlStream) -> AsyncGenerator[Any, None]:
+    """
+    Iterate an async BamlStream on the event loop, aborting the call when closed.
+
+    BamlStream.__aiter__ runs the call on a thread of its own that nothing
+    can stop, and joins it (blocking the loop) when the iterator is closed
+    early. Here the call's FFI future runs as a task on the loop instead,
+    and is cancelled if the consumer stops before the stream ends.
+    """
+    if not BAML_STREAM_INTERNALS:
+        async for partial in stream:
+            yield partial
+        return
+
+    ffi_stream = stream._BamlStream__ffi_stream
+    partial_coerce = stream._BamlStream__partial_coerce
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+    # Events arrive on the runtime's threads
+    ffi_stream.on_event(lambda event: loop.call_soon_threadsafe(events.put_nowait, event))
+    done = asyncio.ensure_future(ffi_stream.done(stream._BamlStream__ctx_manager))
+    done.add_done_callback(lambda _: events.put_nowait(_STREAM_END))
+    last = None
+    try:
+        while (event := await events.get()) is not _STREAM_END:
+            if event.is_ok():
+                last = partial_coerce(event)
+                yield last
+        # Raises the call's error; its result is the complete output, which
+        # the last event may predate
+        final = partial_coerce(done.result())
+        if final != last:
+            yield final
+    finally:
+        if not done.done():
+            done.cancel()
+        # Break the stream <-> callback reference cycle
+        ffi_stream.on_event(None)
+
+
+async def aiter_stream(stream: Iterable | AsyncIterator) -> AsyncGenerator[Any, None]:
+    """
+    Iterate a BAML stream (or a recorded one) without blocking the event loop.
+
+    Live calls are async BamlStreams, cancelled with the consumer. Other
+    async streams are iterated directly; sync iterators pull each chunk in
+    a worker thread.
+    """
+    if isinstance(stream, BamlStream):
+        stream = aiter_baml_stream(stream)
+    if hasattr(stream, "__aiter__"):
+        if hasattr(stream, "aclose"):
+            async with aclosing(stream):
+                async for chunk in stream:
+                    yield chunk
+        else:
+            async for chunk in stream:
+                yield chunk
+        return
+
+    iterator: Iterator = iter(stream)
+    while True:
+        chunk = await asyncio.to_thread(next, iterator, _STREAM_END)
+        if chunk is _STREAM_END:
+            return
+        yield chunk
+
+
+def mock_client_registry(base_url: str) -> ClientRegistry:
+    """Build a ClientRegistry that routes every function to the mock model server."""
+    registry = ClientRegistry()
+    registry.add_llm_client(
+        MOCK_CLIENT_NAME,
+        "openai",
+        {
+            "model": "mock-model",
+            "base_url": base_url,
+            "api_key": "mock",
+        },
+    )
+    registry.set_primary(MOCK_CLIENT_NAME)
+    return registry
+
+
+class LLMReplay:
+    """Records streamed BAML responses to disk and replays them with original timing."""
+
+    def __init__(self):
+        self.mode = ReplayMode(config.LLM_REPLAY_MODE)
+        self.recordings_dir = Path(config.LLM_REPLAY_DIR)
+        self.speed = config.LLM_REPLAY_SPEED
+        if self.mode != ReplayMode.OFF:
+            self.recordings_dir.mkdir(parents=True, exist_ok=True)
+
+    def recording_key(self, function_name: str, client_name: str, args: dict) -> str:
+        """Hash of function, arguments and client that identifies a recording."""
+        payload = json.dumps(
+            {
+                "function": function_name,
+                "client": client_name,
+                "args": to_jsonable(args),
+            },
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get_recording_path(self, key: str) -> Path:
+        """Get the file system path for a recording."""
+        return self.recordings_dir / f"{key}.json"
+
+    async def stream(
+        self,
+        function_name: str,
+        client_name: str,
+        args: dict,
+        open_stream: Callable[[], BamlStream | Iterable | AsyncIterator],
+    ) -> AsyncGenerator[Any, None]:
+        """
+        Stream partials for a BAML call, recording or replaying them per the mode.
+
+        Args:
+            open_stream: Starts the live call; not invoked in replay mode.
+        """
+        key = self.recording_key(function_name, client_name, args)
+
+        if self.mode == ReplayMode.REPLAY:
+            async with aclosing(self._replay(key, function_name)) as partials:
+                async for partial in partials:
+                    yield partial
+            return
+
+        if self.mode == ReplayMode.OFF:
+            # Closing this stream closes the live call
+            async with aclosing(aiter_stream(open_stream())) as partials:
+                async for partial in partials:
+                    yield partial
+            return
+
+        chunks = []
+        start_time = time.monotonic()
+        async with aclosing(aiter_stream(open_stream())) as partials:
+            async for partial in partials:
+                chunks.append(
+                    {
+                        "t": time.monotonic() - start_time,
+                        "type": type(partial).__name__,
+                        "data": to_jsonable(partial),
+                    }
+                )
+                yield partial
+
+        # Only complete streams are recorded
+        self._write_recording(key, function_name, client_name, chunks)
+
+    def _write_recording(
+        self, key: str, function_name: str, client_name: str, chunks: list[dict]
+    ):
+        """Atomically write a recording to disk."""
+        path = self.get_recording_path(key)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "key": key,
+                    "function": function_name,
+                    "client": client_name,
+                    "recorded_at": time.time(),
+                    "chunks": chunks,
+                },
+                f,
+            )
+        tmp_path.replace(path)
+        print(f"Recorded {function_name} ({len(chunks)} chunks) to {path}")
+
+    async def _replay(self, key: str, function_name: str) -> AsyncGenerator[Any, None]:
+        """Replay a recording, compressing inter-chunk delays by the replay speed."""
+        path = self.get_recording_path(key)
+        if not path.exists():
+            raise FileNotFoundError(f"No recording for {function_name} (key {key}) in {self.recordings_dir}")
+
+        with open(path, "r", encoding="utf-8") as f:
+            recording = json.load(f)
+
+        last_t = 0.0
+        for chunk in recording["chunks"]:
+            if self.speed > 0:
+                await asyncio.sleep(max(chunk["t"] - last_t, 0.0) / self.speed)
+            last_t = chunk["t"]
+
+            partial_type = getattr(partial_types, chunk["type"], None)
+            if partial_type is None:
+                yield chunk["data"]
+            else:
+                yield partial_type.model_validate(chunk["data"])
+
+
+# Global LLM replay instance
+llm_replay = LLMReplay()
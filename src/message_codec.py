@@ -0,0 +1,234 @@
+"""Encoding of WebSocket messages: JSON by default, msgpack when negotiated."""
+
+import uuid
+from enum import Enum
+from typing import Any, Optional, Union
+
+import msgpack
+import orjson
+from fastapi import WebSocket, WebSocketDisconnect
+
+from .config import config
+from .metrics import Sample, metrics_registry
+
+# Query parameter a client uses to pick its encoding: /ws?encoding=msgpack
+ENCODING_PARAM = "encoding"
+
+# Query parameter a client that reassembles chunked transfers uses to cap
+# frame sizes: /ws?max_frame=262144 (bytes)
+MAX_FRAME_PARAM = "max_frame"
+
+# Smallest frame size a client may ask for
+MIN_MAX_FRAME_BYTES = 4096
+
+# Type of the header frame announcing a chunked transfer
+CHUNKED_TYPE = "chunked"
+
+
+class Encoding(Enum):
+    """Wire format of a connection."""
+    JSON = "json"  # Text frames
+    MSGPACK = "msgpack"  # Binary frames
+
+
+def _to_wire(obj: Any) -> Any:
+    """Fallback for values neither encoder handles natively (enums, message objects)."""
+    if isinstance(obj, Enum):
+        return obj.value
+    to_dict = getattr(obj, "to_dict", None)
+    if to_dict is not None:
+        return to_dict()
+    raise TypeError(f"Type is not serializable: {type(obj).__name__}")
+
+
+def message_type(message: Any) -> str | None:
+    """Type of an outbound message, whether a dict or a message object."""
+    if isinstance(message, dict):
+        return message.get("type")
+    value = getattr(message, "type", None)
+    return value.value if isinstance(value, Enum) else value
+
+
+def split_frame(frame: Union[str, bytes], max_bytes: int) -> list[Union[str, bytes]]:
+    """Split an encoded frame into pieces of at most max_bytes (text on UTF-8 character boundaries)."""
+    if isinstance(frame, bytes):
+        return [frame[start:start + max_bytes] for start in range(0, len(frame), max_bytes)]
+
+    data = frame.encode("utf-8")
+    pieces = []
+    start = 0
+    while start < len(data):
+        end = min(start + max_bytes, len(data))
+        # Never cut a multi-byte character: back up over continuation bytes
+        while end < len(data) and data[end] & 0xC0 == 0x80:
+            end -= 1
+        pieces.append(data[start:end].decode("utf-8"))
+        start = end
+    return pieces
+
+
+def request_id(message: Any) -> str | None:
+    """Id of the client request a message answers, if any."""
+    if isinstance(message, dict):
+        return message.get("request_id")
+    return getattr(message, "request_id", None)
+
+
+def tag_request(message: Any, request_id: str):
+    """Tag an outbound message with the id of the client request it answers."""
+    if isinstance(message, dict):
+        message["request_id"] = request_id
+    else:
+        message.request_id = request_id
+
+
+class OutboundMessage:
+    """
+    A message on its way to one or more connections.
+
+    The message is encoded at most once per encoding, the first time a
+    connection using that encoding sends it; every other recipient sends
+    the same frame.
+    """
+
+    __slots__ = ("message", "type", "_json", "_msgpack")
+
+    def __init__(self, message: Any):
+        self.message = message
+        self.type = message_type(message)
+        self._json: str | None = None
+        self._msgpack: bytes | None = None
+
+    @classmethod
+    def from_json(cls, frame: str) -> "OutboundMessage":
+        """A message received already JSON-encoded (JSON clients reuse the frame as is)."""
+        message = cls(orjson.loads(frame))
+        message._json = frame
+        return message
+
+    def sequence(self, seq: int):
+        """Stamp the message with its position in its session's event stream."""
+        if isinstance(self.message, dict):
+            self.message["seq"] = seq
+        else:
+            self.message.seq = seq
+        # Frames encoded before (e.g. received from another worker) carry another seq
+        self._json = None
+        self._msgpack = None
+
+    def frame(self, encoding: Encoding) -> Union[str, bytes]:
+        """The encoded frame for a connection using `encoding`."""
+        if encoding == Encoding.MSGPACK:
+            if self._msgpack is None:
+                self._msgpack = message_codec.encode(self.message, encoding)
+            return self._msgpack
+        if self._json is None:
+            self._json = message_codec.encode(self.message, encoding)
+        return self._json
+
+
+class MessageCodec:
+    """Encodes outbound and decodes inbound WebSocket messages."""
+
+    def __init__(self):
+        self.frames_encoded: dict[Encoding, int] = {encoding: 0 for encoding in Encoding}
+        self.bytes_encoded: dict[Encoding, int] = {encoding: 0 for encoding in Encoding}
+        self.chunked_transfers = 0
+
+    def negotiate(self, websocket: WebSocket) -> Encoding:
+        """The encoding a client asked for on connect (JSON unless it asked for msgpack)."""
+        requested = websocket.query_params.get(ENCODING_PARAM, Encoding.JSON.value)
+        try:
+            return Encoding(requested.lower())
+        except ValueError:
+            return Encoding.JSON
+
+    def negotiate_max_frame(self, websocket: WebSocket) -> Optional[int]:
+        """
+        Largest frame a client wants, if it can reassemble chunked transfers.
+
+        Clients that don't ask get whole messages in one frame, as before;
+        the server's WS_MAX_FRAME_BYTES caps what a client may ask for.
+        """
+        requested = websocket.query_params.get(MAX_FRAME_PARAM)
+        if not requested:
+            return None
+        try:
+            max_frame = int(requested)
+        except ValueError:
+            return None
+        return max(MIN_MAX_FRAME_BYTES, min(max_frame, config.WS_MAX_FRAME_BYTES))
+
+    def chunk(
+        self, message: "OutboundMessage", encoding: Encoding, max_bytes: int
+    ) -> list[Union[str, bytes]]:
+        """
+        Frames carrying a message, split if its frame exceeds max_bytes.
+
+        A split message is sent as a header frame announcing the transfer,
+        {"type": "chunked", "data": {"transfer_id", "chunks", "message_type"}, "request_id"},
+        followed by exactly that many raw frames whose concatenation is the
+        encoded message.
+        """
+        frame = message.frame(encoding)
+        if isinstance(frame, str) and not frame.isascii():
+            size = len(frame.encode("utf-8"))
+        else:
+            size = len(frame)
+        if size <= max_bytes:
+            return [frame]
+        pieces = split_frame(frame, max_bytes)
+        header = self.encode(
+            {
+                "type": CHUNKED_TYPE,
+                "data": {
+                    "transfer_id": uuid.uuid4().hex[:12],
+                    "chunks": len(pieces),
+                    "message_type": message.type,
+                },
+                "request_id": request_id(message.message),
+            },
+            encoding,
+        )
+        self.chunked_transfers += 1
+        return [header, *pieces]
+
+    def encode(self, message: Any, encoding: Encoding) -> Union[str, bytes]:
+        """Encode a message: a str for JSON text frames, bytes for msgpack binary frames."""
+        if encoding == Encoding.MSGPACK:
+            frame = msgpack.packb(message, default=_to_wire)
+            size = len(frame)
+        else:
+            encoded = orjson.dumps(message, default=_to_wire)
+            size = len(encoded)
+            frame = encoded.decode("utf-8")
+        self.frames_encoded[encoding] += 1
+        self.bytes_encoded[encoding] += size
+        return frame
+
+    def decode(self, frame: dict) -> dict:
+        """Decode a received ASGI websocket frame (text is JSON, binary is msgpack)."""
+        if frame.get("text") is not None:
+            return orjson.loads(frame["text"])
+        return msgpack.unpackb(frame["bytes"])
+
+    async def receive(self, websocket: WebSocket) -> dict:
+        """Receive and decode the next message from a client."""
+        frame = await websocket.receive()
+        if frame["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(frame.get("code", 1000), frame.get("reason"))
+        return self.decode(frame)
+
+    def get_metrics(self) -> list[Sample]:
+        """Metrics samples for /metrics."""
+        samples: list[Sample] = [("ws_chunked_transfers_total", {}, self.chunked_transfers)]
+        for encoding in Encoding:
+            labels = {"encoding": encoding.value}
+            samples.append(("ws_frames_encoded_total", labels, self.frames_encoded[encoding]))
+            samples.append(("ws_bytes_encoded_total", labels, self.bytes_encoded[encoding]))
+        return samples
+
+
+# Global message codec instance
+message_codec = MessageCodec()
+metrics_registry.register(message_codec.get_metrics)
@@ -0,0 +1,45 @@
+"""Metrics registry rendered in Prometheus text format on /metrics."""
+
+from typing import Callable, Iterable
+
+# (metric name, labels, value)
+Sample = tuple[str, dict[str, str], float]
+
+
+class MetricsRegistry:
+    """Collects samples from registered providers on every scrape."""
+
+    def __init__(self):
+        self.providers: list[Callable[[], Iterable[Sample]]] = []
+
+    def register(self, provider: Callable[[], Iterable[Sample]]):
+        """Register a callable returning the current samples of a component."""
+        self.providers.append(provider)
+
+    def collect(self) -> list[Sample]:
+        """Collect samples from all providers."""
+        samples: list[Sample] = []
+        for provider in self.providers:
+            try:
+                samples.extend(provider())
+            except Exception as e:
+                print(f"Error collecting metrics from {provider}: {e}")
+        return samples
+
+    def render(self) -> str:
+        """Render all samples in Prometheus text exposition format."""
+        lines = []
+        for name, labels, value in self.collect():
+            if labels:
+                label_str = ",".join(
+                    f'{key}="{str(val).replace(chr(34), chr(39))}"'
+                    for key, val in sorted(labels.items())
+                )
+                lines.append(f"{name}{{{label_str}}} {value}")
+            else:
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# Global metrics registry instance
+metrics_registry = MetricsRegistry()
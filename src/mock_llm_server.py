@@ -0,0 +1,143 @@
+"""Local mock model server speaking the OpenAI chat completions streaming protocol.
+
+Point the agent at it with LLM_MOCK_BASE_URL=http://localhost:8100/v1 to run the
+full pipeline offline (load tests, benchmarks) without live model calls.
+
+    python -m src.mock_llm_server
+"""
+
+import asyncio
+import json
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+from .config import config
+
+# Roughly how many characters make up one token
+CHARS_PER_TOKEN = 4
+
+DEFAULT_RESPONSE = {
+    "plan": (
+        "I'll update App.tsx to render a simple landing page with a heading, "
+        "a short description and a call-to-action button."
+    ),
+    "files": [
+        {
+            "path": "App.tsx",
+            "content": """export default function App() {
+  return (
+    <div className="min-h-screen flex flex-col items-center justify-center gap-4 p-8">
+      <h1 className="text-4xl font-bold">Hello from the mock model</h1>
+      <p className="text-muted-foreground">This response was served offline.</p>
+      <button className="rounded-md bg-black px-4 py-2 text-white">Get started</button>
+    </div>
+  );
+}
+""",
+        }
+    ],
+    "package_json": "{}",
+}
+
+
+def load_response_text() -> str:
+    """Get the canned completion text served for every request."""
+    if config.MOCK_LLM_RESPONSE_FILE:
+        with open(config.MOCK_LLM_RESPONSE_FILE, "r", encoding="utf-8") as f:
+            return f.read()
+    return json.dumps(DEFAULT_RESPONSE, indent=2)
+
+
+def _completion_chunk(completion_id: str, model: str, delta: dict, finish_reason: str | None = None) -> str:
+    """Format one server-sent event of a streamed chat completion."""
+    payload = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def _usage(prompt_chars: int, completion_text: str) -> dict:
+    """Approximate token usage for a request."""
+    prompt_tokens = prompt_chars // CHARS_PER_TOKEN
+    completion_tokens = len(completion_text) // CHARS_PER_TOKEN
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+app = FastAPI(title="Mock LLM Server")
+
+
+@app.get("/health")
+async def health_check():
+    """Health check endpoint."""
+    return {"status": "ok"}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    """OpenAI-compatible chat completions (streaming and non-streaming)."""
+    body = await request.json()
+    model = body.get("model", "mock-model")
+    prompt_chars = sum(len(json.dumps(m.get("content", ""))) for m in body.get("messages", []))
+    text = load_response_text()
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+    if not body.get("stream"):
+        await asyncio.sleep(config.MOCK_LLM_TTFT_MS / 1000)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": _usage(prompt_chars, text),
+        }
+
+    include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+    async def event_stream():
+        await asyncio.sleep(config.MOCK_LLM_TTFT_MS / 1000)
+        yield _completion_chunk(completion_id, model, {"role": "assistant", "content": ""})
+
+        token_delay = 1 / config.MOCK_LLM_TOKENS_PER_SEC if config.MOCK_LLM_TOKENS_PER_SEC > 0 else 0
+        for i in range(0, len(text), CHARS_PER_TOKEN):
+            yield _completion_chunk(completion_id, model, {"content": text[i : i + CHARS_PER_TOKEN]})
+            if token_delay:
+                await asyncio.sleep(token_delay)
+
+        yield _completion_chunk(completion_id, model, {}, finish_reason="stop")
+        if include_usage:
+            usage_chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [],
+                "usage": _usage(prompt_chars, text),
+            }
+            yield f"data: {json.dumps(usage_chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=config.HOST, port=config.MOCK_LLM_PORT)
@@ -0,0 +1,241 @@
+"""Latency-aware model routing with hedged requests across BAML clients."""
+
+import asyncio
+import re
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Optional
+
+from baml_py import ClientRegistry
+
+from baml_client.inlinedbaml import get_baml_files
+
+from .config import config
+from .llm_metrics import CHARS_PER_TOKEN, llm_metrics
+from .metrics import Sample, metrics_registry
+
+# Opens a (tracked) stream of partials for a client name
+StreamFactory = Callable[[str], AsyncIterator]
+
+
+class StreamReset:
+    """Marks a switch to another client's stream: everything streamed before it is void."""
+
+
+# Yielded by ModelRouter.stream before the partials of a client taking over
+STREAM_RESET = StreamReset()
+
+
+def generated_client_names() -> set[str]:
+    """Clients defined in the BAML sources baml_client was generated from."""
+    return {
+        name
+        for source in get_baml_files().values()
+        for name in re.findall(r"^\s*client<llm>\s+(\w+)", source, re.MULTILINE)
+    }
+
+
+def client_registry_for(client_name: str) -> ClientRegistry:
+    """Build a ClientRegistry that makes a BAML-defined client the primary one."""
+    registry = ClientRegistry()
+    registry.set_primary(client_name)
+    return registry
+
+
+class ModelRouter:
+    """
+    Picks a client per request from recent TTFT/throughput and request size.
+
+    If the chosen client's first token has not arrived within a
+    percentile-based deadline, a hedged request is fired at the next best
+    client; whichever stream produces a valid plan first wins and the other
+    one is cancelled (its token usage is still recorded by llm_metrics).
+    """
+
+    def __init__(self):
+        self.clients = self._known_clients(
+            [name.strip() for name in config.LLM_ROUTER_CLIENTS.split(",") if name.strip()]
+        )
+        self.hedge_enabled = config.LLM_HEDGE_ENABLED
+        self.hedge_quantile = config.LLM_HEDGE_QUANTILE
+        self.routed: dict[str, int] = {}
+        self.hedges_fired = 0
+        self.hedge_wins: dict[str, int] = {}
+        self.failovers = 0
+
+    @staticmethod
+    def _known_clients(configured: list[str]) -> list[str]:
+        """Configured clients that exist in the generated client (a call to any other always fails)."""
+        known = generated_client_names()
+        unknown = [name for name in configured if name not in known]
+        if unknown:
+            print(f"Ignoring LLM_ROUTER_CLIENTS not defined in baml_client: {', '.join(unknown)}")
+        clients = [name for name in configured if name in known]
+        if not clients:
+            clients = sorted(known)
+            print(f"No usable LLM_ROUTER_CLIENTS, routing across all generated clients: {', '.join(clients)}")
+        return clients
+
+    def estimate_latency_ms(self, client_name: str, input_chars: int) -> float:
+        """Estimate the total latency of a request on a client."""
+        stats = llm_metrics.get_client_stats(client_name)
+        ttft = stats["ttft_p50_ms"] or config.LLM_ROUTER_PRIOR_TTFT_MS
+        tokens_per_sec = stats["tokens_per_sec"] or config.LLM_ROUTER_PRIOR_TOKENS_PER_SEC
+        # Edits rewrite a share of the input files, so output grows with input
+        expected_output_tokens = max(500, input_chars // CHARS_PER_TOKEN // 2)
+        return ttft + expected_output_tokens / tokens_per_sec * 1000
+
+    def rank_clients(self, input_chars: int, clients: Optional[list[str]] = None) -> list[str]:
+        """Rank clients from fastest to slowest expected latency."""
+        candidates = clients or self.clients
+        return sorted(candidates, key=lambda name: self.estimate_latency_ms(name, input_chars))
+
+    def hedge_deadline_ms(self, client_name: str) -> float:
+        """Time to wait for a first token before hedging, from the client's TTFT distribution."""
+        samples = sorted(llm_metrics.ttft_samples.get(client_name, []))
+        if len(samples) < config.LLM_HEDGE_MIN_SAMPLES:
+            deadline = config.LLM_HEDGE_DEFAULT_MS
+        else:
+            index = min(int(self.hedge_quantile * len(samples)), len(samples) - 1)
+            deadline = samples[index]
+        return min(max(deadline, config.LLM_HEDGE_MIN_MS), config.LLM_HEDGE_MAX_MS)
+
+    async def stream(
+        self,
+        open_stream: StreamFactory,
+        *,
+        input_chars: int,
+        is_complete: Callable[[Any], bool],
+        clients: Optional[list[str]] = None,
+    ) -> AsyncGenerator[Any, None]:
+        """
+        Stream partials from the best client, hedging to the next one on a slow first token.
+
+        Partials come from one client at a time. When another client takes
+        over (the hedge wins, or the streaming client fails), STREAM_RESET
+        is yielded first: the partials before it came from a different
+        model and must be discarded.
+
+        Args:
+            open_stream: Opens the stream for a client name
+            input_chars: Size of the request, used to estimate generation time
+            is_complete: Whether a partial carries a complete, valid plan
+            clients: Candidate clients (defaults to LLM_ROUTER_CLIENTS)
+        """
+        ranked = self.rank_clients(input_chars, clients)
+        primary = ranked[0]
+        self.routed[primary] = self.routed.get(primary, 0) + 1
+
+        if not self.hedge_enabled or len(ranked) < 2:
+            async for partial in open_stream(primary):
+                yield partial
+            return
+
+        queue: asyncio.Queue = asyncio.Queue()
+        pumps: dict[str, asyncio.Task] = {}
+        backups = list(ranked[1:])
+
+        def start(client_name: str):
+            pumps[client_name] = asyncio.create_task(
+                self._pump(client_name, open_stream(client_name), queue)
+            )
+
+        start(primary)
+        deadline = self.hedge_deadline_ms(primary) / 1000
+        leader: Optional[str] = None
+        winner: Optional[str] = None
+        finished: set[str] = set()
+        # Client whose partials were yielded, and each client's latest partial
+        forwarded: Optional[str] = None
+        latest: dict[str, Any] = {}
+
+        try:
+            while True:
+                timeout = deadline if leader is None and len(pumps) == 1 and backups else None
+                try:
+                    client_name, kind, item = await asyncio.wait_for(queue.get(), timeout)
+                except TimeoutError:
+                    # First token is late: fire a hedged request
+                    self.hedges_fired += 1
+                    start(backups.pop(0))
+                    continue
+
+                if kind == "error":
+                    finished.add(client_name)
+                    alive = [name for name in pumps if name not in finished]
+                    if client_name == winner or (not alive and not backups):
+                        raise item
+                    print(f"Model client {client_name} failed, failing over: {item}")
+                    if not alive:
+                        self.failovers += 1
+                        start(backups.pop(0))
+                    if leader == client_name:
+                        leader = alive[0] if alive else None
+                    continue
+
+                if kind == "done":
+                    finished.add(client_name)
+                    if winner is None:
+                        winner = client_name
+                        self._cancel_losers(pumps, winner)
+                    if client_name == winner:
+                        if forwarded != winner and winner in latest:
+                            # Finished without ever leading: its final partial replaces the rest
+                            yield STREAM_RESET
+                            yield latest[winner]
+                        return
+                    continue
+
+                # kind == "chunk"
+                latest[client_name] = item
+                if leader is None:
+                    leader = client_name
+                if winner is None and is_complete(item):
+                    winner = client_name
+                    if len(pumps) > 1:
+                        self.hedge_wins[winner] = self.hedge_wins.get(winner, 0) + 1
+                    self._cancel_losers(pumps, winner)
+                if client_name == (winner or leader):
+                    if forwarded is not None and forwarded != client_name:
+                        yield STREAM_RESET
+                    forwarded = client_name
+                    yield item
+        finally:
+            for task in pumps.values():
+                task.cancel()
+
+    def _cancel_losers(self, pumps: dict[str, asyncio.Task], winner: str):
+        """Cancel every stream except the winner's."""
+        for client_name, task in pumps.items():
+            if client_name != winner:
+                task.cancel()
+
+    async def _pump(self, client_name: str, stream: AsyncIterator, queue: asyncio.Queue):
+        """Forward a client's partials into the shared race queue."""
+        try:
+            async for partial in stream:
+                await queue.put((client_name, "chunk", partial))
+            await queue.put((client_name, "done", None))
+        except asyncio.CancelledError:
+            # Closing the tracked stream records the loser's usage as cancelled
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            raise
+        except Exception as e:
+            await queue.put((client_name, "error", e))
+
+    def get_metrics(self) -> list[Sample]:
+        """Metrics samples for /metrics."""
+        samples: list[Sample] = [
+            ("llm_hedges_fired_total", {}, self.hedges_fired),
+            ("llm_failovers_total", {}, self.failovers),
+        ]
+        for client_name, count in self.routed.items():
+            samples.append(("llm_routed_total", {"client": client_name}, count))
+        for client_name, count in self.hedge_wins.items():
+            samples.append(("llm_hedge_wins_total", {"client": client_name}, count))
+        return samples
+
+
+# Global model router instance
+model_router = ModelRouter()
+metrics_registry.register(model_router.get_metrics)
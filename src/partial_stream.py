@@ -0,0 +1,160 @@
+"""Throttled, delta-encoded streaming of partial agent output."""
+
+import asyncio
+import hashlib
+import time
+from typing import Any, AsyncGenerator, AsyncIterable, Callable, Optional
+
+# Yielded by with_frame_ticks when held updates are due before the next item
+FRAME_DUE = object()
+
+
+def utf16_length(text: str) -> int:
+    """Length of a string in UTF-16 code units (what JavaScript string offsets count)."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def text_checksum(text: str) -> str:
+    """Checksum a client can use to verify the text it reassembled."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class PlanDeltaEncoder:
+    """
+    Turns successive snapshots of a growing text into appended deltas.
+
+    Updates are coalesced over a frame interval, so a stream of per-token
+    snapshots becomes at most one message per frame carrying only the new
+    characters. Offsets are in UTF-16 code units so clients can apply them
+    with String.slice.
+    """
+
+    def __init__(self, frame_interval: float):
+        self.frame_interval = frame_interval
+        self.sent_text = ""
+        self.latest_text = ""
+        self.last_emit = 0.0
+        self.restarted = False
+
+    def restart(self):
+        """Discard the text so far: the next delta replaces everything sent."""
+        self.latest_text = ""
+        self.restarted = True
+
+    def due_in(self) -> Optional[float]:
+        """Seconds until the held text is due to be flushed (None if nothing is held)."""
+        if self.latest_text == self.sent_text and not self.restarted:
+            return None
+        return max(self.last_emit + self.frame_interval - time.monotonic(), 0.0)
+
+    def update(self, text: str) -> Optional[dict]:
+        """Record the latest text; returns a delta if a frame is due."""
+        self.latest_text = text
+        if time.monotonic() - self.last_emit < self.frame_interval:
+            return None
+        return self.flush()
+
+    def flush(self) -> Optional[dict]:
+        """Emit whatever hasn't been sent yet."""
+        text = self.latest_text
+        if text == self.sent_text and not self.restarted:
+            return None
+
+        if text.startswith(self.sent_text) and not self.restarted:
+            data = {"offset": utf16_length(self.sent_text), "delta": text[len(self.sent_text):]}
+        else:
+            # Text was rewritten (e.g. a hedged stream took over) - replace it
+            data = {"offset": 0, "delta": text, "reset": True}
+
+        self.sent_text = text
+        self.restarted = False
+        self.last_emit = time.monotonic()
+        return data
+
+    def finish(self, text: str) -> dict:
+        """Final delta plus the checksum and length of the full text."""
+        self.latest_text = text
+        data = self.flush() or {"offset": utf16_length(text), "delta": ""}
+        data["length"] = utf16_length(text)
+        data["checksum"] = text_checksum(text)
+        return data
+
+
+class FileProgressThrottle:
+    """Coalesces per-file progress events into at most one message per frame."""
+
+    def __init__(self, frame_interval: float):
+        self.frame_interval = frame_interval
+        self.pending: list[str] = []
+        self.total = 0
+        self.last_emit = 0.0
+
+    def due_in(self) -> Optional[float]:
+        """Seconds until the held files are due to be flushed (None if nothing is held)."""
+        if not self.pending:
+            return None
+        return max(self.last_emit + self.frame_interval - time.monotonic(), 0.0)
+
+    def add(self, path: str) -> Optional[dict]:
+        """Record a file the model is working on; returns progress data if a frame is due."""
+        self.pending.append(path)
+        self.total += 1
+        if time.monotonic() - self.last_emit < self.frame_interval:
+            return None
+        return self.flush()
+
+    def flush(self) -> Optional[dict]:
+        """Emit the files recorded since the last frame."""
+        if not self.pending:
+            return None
+        data = {
+            "text": f"Working on {self.pending[-1]}",
+            "files": self.pending,
+            "count": self.total,
+        }
+        self.pending = []
+        self.last_emit = time.monotonic()
+        return data
+
+
+def earliest_due(*throttles: PlanDeltaEncoder | FileProgressThrottle) -> Optional[float]:
+    """Seconds until the first of the throttles has held updates due (None if none hold any)."""
+    return min((due for due in (t.due_in() for t in throttles) if due is not None), default=None)
+
+
+async def with_frame_ticks(
+    stream: AsyncIterable, next_due: Callable[[], Optional[float]]
+) -> AsyncGenerator[Any, None]:
+    """
+    Pass a stream through, yielding FRAME_DUE whenever held updates come due
+    before its next item (the trailing edge of the throttles).
+
+    The throttles only emit when an update arrives, so without this the last
+    update of a frame waits for the next chunk, however long the model takes.
+    """
+    iterator = aiter(stream)
+    pending: Optional[asyncio.Future] = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(anext(iterator))
+            done, _ = await asyncio.wait({pending}, timeout=next_due())
+            if not done:
+                yield FRAME_DUE
+                continue
+            next_item, pending = pending, None
+            try:
+                item = next_item.result()
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+            try:
+                await pending
+            except (asyncio.CancelledError, StopAsyncIteration):
+                pass
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
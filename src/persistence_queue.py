@@ -0,0 +1,267 @@
+"""Write-behind persistence of code files from the local file system to the database."""
+
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from .config import config
+from .database import db
+from .metrics import Sample, metrics_registry
+
+
+@dataclass
+class PendingWrite:
+    """Latest not-yet-persisted state of one file (content None means deleted)."""
+    content: Optional[str]
+    enqueued_at: float
+
+
+class WriteBehindQueue:
+    """
+    Takes database writes off the critical path of a turn.
+
+    Files are committed to the local file system first (that's what builds
+    use); their database copies are queued here. Repeated writes to the same
+    file coalesce, and a background flusher persists each session's change
+    set in one transactional call (Database.save_code_files) at least every
+    flush interval, which bounds how stale the database can get. The queue is
+    drained on shutdown.
+
+    A session whose flush fails is retried with exponential backoff. After
+    max_attempts failed flushes in a row its queued writes are also written
+    to a dead-letter file (and counted in the metrics) so they survive a
+    restart; they stay queued and keep being retried at the longest delay.
+    Writes that are still unpersisted when the queue is stopped are
+    dead-lettered too. A session's dead-letter file is removed once it
+    flushes successfully.
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = config.PERSIST_FLUSH_INTERVAL_MS / 1000,
+        max_batch_files: int = config.PERSIST_MAX_BATCH_FILES,
+        max_attempts: int = config.PERSIST_MAX_ATTEMPTS,
+        retry_base_delay: float = config.PERSIST_RETRY_BASE_DELAY,
+        retry_max_delay: float = config.PERSIST_RETRY_MAX_DELAY,
+        dead_letter_dir: str = config.PERSIST_DEAD_LETTER_DIR,
+    ):
+        self.flush_interval = flush_interval
+        self.max_batch_files = max_batch_files
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.dead_letter_dir = Path(dead_letter_dir)
+        self.pending: dict[str, dict[str, PendingWrite]] = {}
+        self.versions: dict[str, int] = {}
+        # Consecutive failed flushes per session, and when it may be flushed again (monotonic)
+        self.failures: dict[str, int] = {}
+        self.retry_at: dict[str, float] = {}
+        # Sessions whose queued writes currently have a dead-letter file
+        self.dead_lettered: set[str] = set()
+        self._wakeup = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+        self.writes_enqueued = 0
+        self.writes_coalesced = 0
+        self.files_flushed = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.writes_dead_lettered = 0
+
+    def start(self):
+        """Start the background flusher."""
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and persist everything still queued."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush_all(ignore_backoff=True)
+        if self.pending:
+            print(f"Write-behind queue stopped with {self.get_queue_depth()} unpersisted files")
+            for session_id in list(self.pending):
+                self._dead_letter(session_id)
+
+    def enqueue(self, session_id: str, files: dict[str, str], deleted: Optional[list[str]] = None):
+        """Queue a change set that has already been written to the file system."""
+        now = time.time()
+        session_pending = self.pending.setdefault(session_id, {})
+        changes: list[tuple[str, Optional[str]]] = list(files.items())
+        changes.extend((path, None) for path in deleted or [])
+
+        for path, content in changes:
+            self.writes_enqueued += 1
+            existing = session_pending.get(path)
+            if existing is not None:
+                # Coalesce: only the latest content is persisted, staleness counts from the first write
+                self.writes_coalesced += 1
+                existing.content = content
+            else:
+                session_pending[path] = PendingWrite(content=content, enqueued_at=now)
+
+        if len(session_pending) >= self.max_batch_files:
+            self._wakeup.set()
+
+    def apply_pending(self, session_id: str, files: dict[str, str]) -> dict[str, str]:
+        """Overlay not-yet-persisted writes onto files read from the database."""
+        session_pending = self.pending.get(session_id)
+        if not session_pending:
+            return files
+        merged = dict(files)
+        for path, write in session_pending.items():
+            if write.content is None:
+                merged.pop(path, None)
+            else:
+                merged[path] = write.content
+        return merged
+
+    async def _run(self):
+        """Background flusher loop."""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush_all()
+
+    async def flush_all(self, ignore_backoff: bool = False):
+        """Flush the pending change sets of all sessions (except those backing off)."""
+        now = time.monotonic()
+        for session_id in list(self.pending.keys()):
+            if ignore_backoff or self.retry_at.get(session_id, 0.0) <= now:
+                await self.flush_session(session_id)
+
+    async def flush_session(self, session_id: str) -> bool:
+        """
+        Persist a session's pending change set in one call.
+
+        Returns whether the database is now up to date with what was
+        queued; False if the flush failed (the writes are requeued).
+        """
+        batch = self.pending.pop(session_id, None)
+        if not batch:
+            return True
+
+        files = {path: w.content for path, w in batch.items() if w.content is not None}
+        deleted = [path for path, w in batch.items() if w.content is None]
+        try:
+            self.versions[session_id] = await db.save_code_files(session_id, files, deleted)
+        except Exception as e:
+            self.flush_errors += 1
+            print(f"Error persisting {len(batch)} files for session {session_id}: {e}")
+            self._requeue(session_id, batch)
+            self._record_failure(session_id)
+            return False
+        except BaseException:
+            # Cancelled mid-flush (e.g. by stop()): the batch must not be lost
+            self._requeue(session_id, batch)
+            raise
+
+        self.flushes += 1
+        self.files_flushed += len(batch)
+        self.failures.pop(session_id, None)
+        self.retry_at.pop(session_id, None)
+        if session_id in self.dead_lettered and session_id not in self.pending:
+            self._clear_dead_letter(session_id)
+        return True
+
+    def _requeue(self, session_id: str, batch: dict[str, PendingWrite]):
+        """Put a batch back, keeping any newer write queued while its flush was in flight."""
+        session_pending = self.pending.setdefault(session_id, {})
+        for path, write in batch.items():
+            session_pending.setdefault(path, write)
+
+    def _record_failure(self, session_id: str):
+        """Back off a failed session; past max_attempts, dead-letter its writes."""
+        failures = self.failures.get(session_id, 0) + 1
+        self.failures[session_id] = failures
+        delay = min(self.retry_base_delay * 2 ** (failures - 1), self.retry_max_delay)
+        if failures >= self.max_attempts:
+            delay = self.retry_max_delay
+            self._dead_letter(session_id)
+        self.retry_at[session_id] = time.monotonic() + delay
+
+    def _dead_letter_path(self, session_id: str) -> Path:
+        """Where a session's dead-lettered writes are kept."""
+        return self.dead_letter_dir / f"{session_id}.json"
+
+    def _dead_letter(self, session_id: str):
+        """Write a session's queued writes to its dead-letter file (replacing an older one)."""
+        session_pending = self.pending.get(session_id)
+        if not session_pending:
+            return
+        path = self._dead_letter_path(session_id)
+        record = {
+            "session_id": session_id,
+            "written_at": time.time(),
+            "attempts": self.failures.get(session_id, 0),
+            "files": {file_path: w.content for file_path, w in session_pending.items()},
+        }
+        try:
+            self.dead_letter_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(".json.tmp")
+            tmp_path.write_text(json.dumps(record), encoding="utf-8")
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error dead-lettering {len(session_pending)} files for session {session_id}: {e}")
+            return
+        if session_id not in self.dead_lettered:
+            self.dead_lettered.add(session_id)
+            self.writes_dead_lettered += len(session_pending)
+            print(
+                f"Dead-lettered {len(session_pending)} unpersisted files for session {session_id} "
+                f"to {path}: {sorted(session_pending)}"
+            )
+
+    def _clear_dead_letter(self, session_id: str):
+        """Remove a session's dead-letter file once its writes are persisted."""
+        self.dead_lettered.discard(session_id)
+        try:
+            self._dead_letter_path(session_id).unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Error removing dead-letter file for session {session_id}: {e}")
+
+    def get_queue_depth(self) -> int:
+        """Number of files waiting to be persisted."""
+        return sum(len(session_pending) for session_pending in self.pending.values())
+
+    def get_lag_seconds(self) -> float:
+        """Age of the oldest unpersisted write."""
+        oldest = min(
+            (w.enqueued_at for session_pending in self.pending.values() for w in session_pending.values()),
+            default=None,
+        )
+        return time.time() - oldest if oldest is not None else 0.0
+
+    def get_metrics(self) -> list[Sample]:
+        """Metrics samples for /metrics."""
+        return [
+            ("persist_queue_depth", {}, self.get_queue_depth()),
+            ("persist_queue_sessions", {}, len(self.pending)),
+            ("persist_lag_seconds", {}, self.get_lag_seconds()),
+            ("persist_writes_enqueued_total", {}, self.writes_enqueued),
+            ("persist_writes_coalesced_total", {}, self.writes_coalesced),
+            ("persist_files_flushed_total", {}, self.files_flushed),
+            ("persist_flushes_total", {}, self.flushes),
+            ("persist_flush_errors_total", {}, self.flush_errors),
+            ("persist_sessions_backing_off", {}, len(self.retry_at)),
+            ("persist_sessions_dead_lettered", {}, len(self.dead_lettered)),
+            ("persist_writes_dead_lettered_total", {}, self.writes_dead_lettered),
+        ]
+
+
+# Global write-behind persistence queue
+persistence_queue = WriteBehindQueue()
+metrics_registry.register(persistence_queue.get_metrics)
@@ -0,0 +1,156 @@
+"""Versioned, size-bounded LRU cache of project files."""
+
+import asyncio
+import itertools
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+from .blob_store import content_hash
+from .code_executor import code_executor
+from .config import config
+from .metrics import Sample, metrics_registry
+
+
+@dataclass
+class CachedProject:
+    """Decoded files and package.json of a session's project at one version."""
+    code_map: dict[str, str]
+    package_json: str
+    version: int
+    size_bytes: int
+    # Content hash per path, computed on first use (delta sync)
+    hashes: Optional[dict[str, str]] = field(default=None, repr=False)
+
+    def file_hashes(self) -> dict[str, str]:
+        """Content hash of every file, computed once per version."""
+        if self.hashes is None:
+            self.hashes = {path: content_hash(content) for path, content in self.code_map.items()}
+        return self.hashes
+
+
+def project_size(code_map: dict[str, str], package_json: str) -> int:
+    """Approximate memory footprint of a project's contents."""
+    return len(package_json) + sum(len(path) + len(content) for path, content in code_map.items())
+
+
+class ProjectCache:
+    """
+    Read-through cache in front of CodeExecutor.load_code.
+
+    Every change gets a new version from a process-wide monotonic counter, so
+    a version identifies one exact state of a project. Writes made through
+    the agent update the cached entry in place; anything else that changes
+    the project on disk (reported by the file watcher) invalidates it. Entries
+    are evicted least recently used once the cache exceeds its byte budget.
+    """
+
+    def __init__(self, max_bytes: int = config.PROJECT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[str, CachedProject] = OrderedDict()
+        self.size_bytes = 0
+        self._versions = itertools.count(1)
+        # Bumped on every invalidation so a load racing with a change never caches stale files
+        self._epochs: dict[str, int] = {}
+        # The file watcher invalidates from its own thread
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    async def load(self, session_id: str) -> CachedProject:
+        """Get a session's project, reading it from disk on a miss."""
+        with self._lock:
+            entry = self.entries.get(session_id)
+            if entry is not None:
+                self.entries.move_to_end(session_id)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            epoch = self._epochs.get(session_id, 0)
+
+        file_map, package_json = await asyncio.to_thread(code_executor.load_code, session_id)
+        code_map = {path: content.decode("utf-8") for path, content in file_map.items()}
+
+        with self._lock:
+            entry = CachedProject(
+                code_map=code_map,
+                package_json=package_json,
+                version=next(self._versions),
+                size_bytes=project_size(code_map, package_json),
+            )
+            if self._epochs.get(session_id, 0) == epoch:
+                self._store(session_id, entry)
+            return entry
+
+    def update(
+        self, session_id: str, code_map: dict[str, str], deleted: Optional[list[str]] = None
+    ) -> Optional[int]:
+        """Apply a change set written to disk to the cached project; returns the new version."""
+        with self._lock:
+            entry = self.entries.get(session_id)
+            if entry is None:
+                # Nothing cached, but a load in flight must not cache the old files
+                self._epochs[session_id] = self._epochs.get(session_id, 0) + 1
+                return None
+            files = dict(entry.code_map)
+            files.update(code_map)
+            for path in deleted or []:
+                files.pop(path, None)
+            hashes = None
+            if entry.hashes is not None:
+                # Only the changed files need hashing again
+                hashes = dict(entry.hashes)
+                hashes.update((path, content_hash(content)) for path, content in code_map.items())
+                for path in deleted or []:
+                    hashes.pop(path, None)
+            updated = CachedProject(
+                code_map=files,
+                package_json=entry.package_json,
+                version=next(self._versions),
+                size_bytes=project_size(files, entry.package_json),
+                hashes=hashes,
+            )
+            self._store(session_id, updated)
+            return updated.version
+
+    def invalidate(self, session_id: str):
+        """Drop a session's cached project (safe to call from any thread)."""
+        with self._lock:
+            self._epochs[session_id] = self._epochs.get(session_id, 0) + 1
+            entry = self.entries.pop(session_id, None)
+            if entry is not None:
+                self.size_bytes -= entry.size_bytes
+                self.invalidations += 1
+
+    def _store(self, session_id: str, entry: CachedProject):
+        """Insert or replace an entry and evict down to the byte budget (lock held)."""
+        previous = self.entries.pop(session_id, None)
+        if previous is not None:
+            self.size_bytes -= previous.size_bytes
+        self.entries[session_id] = entry
+        self.size_bytes += entry.size_bytes
+        while self.size_bytes > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.size_bytes -= evicted.size_bytes
+            self.evictions += 1
+
+    def get_metrics(self) -> list[Sample]:
+        """Metrics samples for /metrics."""
+        lookups = self.hits + self.misses
+        return [
+            ("project_cache_hits_total", {}, self.hits),
+            ("project_cache_misses_total", {}, self.misses),
+            ("project_cache_hit_ratio", {}, self.hits / lookups if lookups else 0.0),
+            ("project_cache_evictions_total", {}, self.evictions),
+            ("project_cache_invalidations_total", {}, self.invalidations),
+            ("project_cache_entries", {}, len(self.entries)),
+            ("project_cache_bytes", {}, self.size_bytes),
+        ]
+
+
+# Global project cache instance
+project_cache = ProjectCache()
+metrics_registry.register(project_cache.get_metrics)
@@ -0,0 +1,156 @@
+"""Golden project template: prepared once per version, cloned into every new project.
+
+The server prepares the configured version in the background at startup
+when it doesn't exist yet; until it is ready, projects are created from
+the built-in starter files as before. To prepare it ahead of time (e.g.
+in a deploy step):
+
+    python -m src.project_template
+"""
+
+import asyncio
+import json
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+from .code_executor import TEMPLATE_READY_MARKER, code_executor
+from .config import config
+from .metrics import Sample, metrics_registry
+
+# Longest a single preparation command (git clone, npm install, npm run build) may take
+COMMAND_TIMEOUT_SECONDS = 600
+
+
+async def run_command(args: list[str], cwd: Path):
+    """Run a command, raising with the tail of its output if it fails."""
+    # A subprocess rather than a thread, so shutdown can cancel a long install
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        cwd=cwd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+    )
+    try:
+        output, _ = await asyncio.wait_for(process.communicate(), COMMAND_TIMEOUT_SECONDS)
+    except BaseException:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+    if process.returncode != 0:
+        raise RuntimeError(f"{' '.join(args)} failed: {output.decode('utf-8', 'replace')[-500:]}")
+
+
+class ProjectTemplate:
+    """
+    One version of the golden template: the starter project with its
+    dependencies installed and its build output prebuilt.
+
+    A version is prepared in a temporary directory and renamed into place
+    once complete, then never modified, since every project cloned from it
+    shares its node_modules and dist (see CodeExecutor.clone_template).
+    """
+
+    def __init__(self):
+        self.root = Path(config.PROJECT_TEMPLATE_DIR)
+        self.version = config.PROJECT_TEMPLATE_VERSION
+        self.source = config.PROJECT_TEMPLATE_SOURCE
+        self.task: Optional[asyncio.Task] = None
+        self.prepare_seconds: Optional[float] = None
+        self.failures = 0
+
+    @property
+    def path(self) -> Path:
+        return self.root / self.version
+
+    def is_ready(self) -> bool:
+        return (self.path / TEMPLATE_READY_MARKER).exists()
+
+    def start(self):
+        """Prepare the template in the background if this version doesn't exist yet."""
+        if not self.is_ready():
+            self.task = asyncio.create_task(self._prepare_in_background())
+
+    async def stop(self):
+        """Abandon a preparation still running."""
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _prepare_in_background(self):
+        try:
+            await self.prepare()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failures += 1
+            print(f"Could not prepare project template {self.version}, using the built-in starter: {e}")
+
+    async def prepare(self) -> Path:
+        """Prepare this version of the template (a no-op once it is ready)."""
+        if self.is_ready():
+            return self.path
+
+        started = time.monotonic()
+        print(f"Preparing project template {self.version}...")
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.root / f".{self.version}.{uuid.uuid4().hex}"
+        try:
+            await self._populate(tmp_path)
+            await run_command(["npm", "install"], tmp_path)
+            await run_command(["npm", "run", "build"], tmp_path)
+            (tmp_path / TEMPLATE_READY_MARKER).write_text(
+                json.dumps({"version": self.version, "source": self.source or None, "prepared_at": time.time()}),
+                encoding="utf-8",
+            )
+            if not self.is_ready():
+                if self.path.exists():
+                    # Left by something other than a preparation (those rename complete trees only)
+                    await asyncio.to_thread(shutil.rmtree, self.path)
+                tmp_path.rename(self.path)
+            # Otherwise another worker prepared it first: ours is discarded below
+        finally:
+            await asyncio.to_thread(shutil.rmtree, tmp_path, True)
+
+        self.prepare_seconds = time.monotonic() - started
+        print(f"Project template {self.version} ready in {self.prepare_seconds:.1f}s")
+        return self.path
+
+    async def _populate(self, target: Path):
+        """Write the template's own files: the configured source, or the built-in starter."""
+        if not self.source:
+            await asyncio.to_thread(code_executor.write_starter_files, target, "project")
+        elif Path(self.source).is_dir():
+            await asyncio.to_thread(
+                shutil.copytree,
+                self.source,
+                target,
+                ignore=shutil.ignore_patterns("node_modules", "dist", ".git"),
+            )
+        else:
+            await run_command(["git", "clone", "--depth", "1", self.source, str(target)], self.root)
+            await asyncio.to_thread(shutil.rmtree, target / ".git", True)
+
+    def get_metrics(self) -> list[Sample]:
+        """Metrics samples for /metrics."""
+        labels = {"version": self.version}
+        samples: list[Sample] = [
+            ("project_template_ready", labels, 1 if self.is_ready() else 0),
+            ("project_template_prepare_failures_total", labels, self.failures),
+        ]
+        if self.prepare_seconds is not None:
+            samples.append(("project_template_prepare_seconds", labels, self.prepare_seconds))
+        return samples
+
+
+# Global project template instance
+project_template = ProjectTemplate()
+metrics_registry.register(project_template.get_metrics)
+
+
+if __name__ == "__main__":
+    asyncio.run(project_template.prepare())
@@ -0,0 +1,276 @@
+"""Pub/sub backplane carrying session broadcasts between processes.
+
+With the default "local" backplane broadcasts stay in the process. With
+PUBSUB_BACKEND=socket every worker (and any other process, e.g. a build
+runner) connects to a small broker over a unix socket, so a message
+published to a session channel reaches the sockets of every worker:
+
+    python -m src.pubsub
+"""
+
+import asyncio
+import os
+from typing import Awaitable, Callable, Optional
+
+from .config import config
+from .message_codec import Encoding, OutboundMessage
+from .metrics import Sample
+
+# Delivers a message published on a channel to the local sockets subscribed to it
+Deliver = Callable[[str, OutboundMessage], Awaitable[None]]
+
+# Seconds between attempts to reach the broker
+RECONNECT_DELAY_SECONDS = 1.0
+
+# Bytes a broker client may have unsent before it is dropped as too slow
+BROKER_MAX_CLIENT_BUFFER = 16 * 1024 * 1024
+
+# Longest line (one published message) the protocol accepts
+MAX_LINE_BYTES = 64 * 1024 * 1024
+
+
+class Backplane:
+    """
+    Publishes session messages and delivers those published elsewhere.
+
+    Subscriptions are refcounted per channel: the backplane only
+    subscribes when the first local socket joins a session and
+    unsubscribes when the last one leaves.
+    """
+
+    name = "local"
+
+    def __init__(self, deliver: Deliver):
+        self.deliver = deliver
+        self.subscriptions: dict[str, int] = {}
+        self.published = 0
+        self.received = 0
+
+    async def start(self):
+        """Start receiving messages published by other processes."""
+
+    async def stop(self):
+        """Stop receiving messages published by other processes."""
+
+    def subscribe(self, channel: str):
+        """Add a reference to a channel, subscribing on the first one."""
+        count = self.subscriptions.get(channel, 0)
+        self.subscriptions[channel] = count + 1
+        if count == 0:
+            self._on_subscribe(channel)
+
+    def unsubscribe(self, channel: str):
+        """Drop a reference to a channel, unsubscribing with the last one."""
+        count = self.subscriptions.get(channel, 0)
+        if count <= 1:
+            self.subscriptions.pop(channel, None)
+            if count == 1:
+                self._on_unsubscribe(channel)
+        else:
+            self.subscriptions[channel] = count - 1
+
+    def _on_subscribe(self, channel: str):
+        pass
+
+    def _on_unsubscribe(self, channel: str):
+        pass
+
+    async def publish(self, channel: str, message: OutboundMessage):
+        """Publish a message to a channel, delivering it locally first."""
+        self.published += 1
+        if channel in self.subscriptions:
+            await self.deliver(channel, message)
+
+    def get_metrics(self) -> list[Sample]:
+        """Metrics samples for /metrics."""
+        labels = {"backend": self.name}
+        return [
+            ("pubsub_channels", labels, len(self.subscriptions)),
+            ("pubsub_published_total", labels, self.published),
+            ("pubsub_received_total", labels, self.received),
+        ]
+
+
+class SocketBackplane(Backplane):
+    """
+    Backplane speaking a line protocol to the local broker.
+
+        SUB <channel>\\n / UNSUB <channel>\\n   (client -> broker)
+        PUB <channel> <json>\\n                 (client -> broker)
+        MSG <channel> <json>\\n                 (broker -> subscribers)
+
+    Messages travel as their JSON frame, so a message is encoded once by
+    its publisher and JSON clients of other workers get the same bytes.
+    The broker doesn't echo a message back to its publisher, which has
+    already delivered it to its own sockets.
+    """
+
+    name = "socket"
+
+    def __init__(self, deliver: Deliver, path: str):
+        super().__init__(deliver)
+        self.path = path
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.task: Optional[asyncio.Task] = None
+        self.connected = asyncio.Event()
+        self.reconnects = 0
+
+    async def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        self._close_writer()
+
+    def _close_writer(self):
+        """Forget the broker connection."""
+        self.connected.clear()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def _send(self, line: str):
+        """Write a control line if the broker is reachable (resubscribed on reconnect)."""
+        if self.writer is not None:
+            self.writer.write(line.encode("utf-8"))
+
+    def _on_subscribe(self, channel: str):
+        self._send(f"SUB {channel}\n")
+
+    def _on_unsubscribe(self, channel: str):
+        self._send(f"UNSUB {channel}\n")
+
+    async def publish(self, channel: str, message: OutboundMessage):
+        await super().publish(channel, message)
+        writer = self.writer
+        if writer is None:
+            print(f"Pub/sub broker unreachable, message for {channel} delivered locally only")
+            return
+        try:
+            writer.write(f"PUB {channel} {message.frame(Encoding.JSON)}\n".encode("utf-8"))
+            await writer.drain()
+        except ConnectionError as e:
+            print(f"Error publishing to pub/sub broker: {e!r}")
+            self._close_writer()
+
+    async def _run(self):
+        """Stay connected to the broker, delivering what it sends."""
+        while True:
+            try:
+                reader, self.writer = await asyncio.open_unix_connection(
+                    self.path, limit=MAX_LINE_BYTES
+                )
+                for channel in self.subscriptions:
+                    self._send(f"SUB {channel}\n")
+                self.connected.set()
+                print(f"Connected to pub/sub broker at {self.path}")
+                while line := await reader.readline():
+                    await self._handle_line(line)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Pub/sub broker connection error: {e!r}")
+            self._close_writer()
+            self.reconnects += 1
+            await asyncio.sleep(RECONNECT_DELAY_SECONDS)
+
+    async def _handle_line(self, line: bytes):
+        """Deliver a message the broker forwarded."""
+        command, _, rest = line.decode("utf-8").rstrip("\n").partition(" ")
+        if command != "MSG":
+            return
+        channel, _, frame = rest.partition(" ")
+        self.received += 1
+        if channel in self.subscriptions:
+            try:
+                await self.deliver(channel, OutboundMessage.from_json(frame))
+            except Exception as e:
+                print(f"Error delivering pub/sub message for {channel}: {e!r}")
+
+    def get_metrics(self) -> list[Sample]:
+        labels = {"backend": self.name}
+        return super().get_metrics() + [
+            ("pubsub_connected", labels, 1 if self.connected.is_set() else 0),
+            ("pubsub_reconnects_total", labels, self.reconnects),
+        ]
+
+
+class PubSubBroker:
+    """Forwards published lines to every other client subscribed to the channel."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.channels: dict[str, set[asyncio.StreamWriter]] = {}
+        self.clients: set[asyncio.StreamWriter] = set()
+
+    async def serve(self):
+        """Accept clients on the unix socket until cancelled."""
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        server = await asyncio.start_unix_server(self._handle_client, self.path, limit=MAX_LINE_BYTES)
+        print(f"Pub/sub broker listening on {self.path}")
+        try:
+            # Not serve_forever(): on cancel it waits for clients that only close below
+            await asyncio.get_running_loop().create_future()
+        finally:
+            server.close()
+            for writer in list(self.clients):
+                writer.close()
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        subscribed: set[str] = set()
+        self.clients.add(writer)
+        try:
+            while line := await reader.readline():
+                command, _, rest = line.partition(b" ")
+                if command == b"PUB":
+                    channel = rest.partition(b" ")[0].decode("utf-8")
+                    self._forward(channel, b"MSG " + rest, writer)
+                elif command == b"SUB":
+                    channel = rest.decode("utf-8").rstrip("\n")
+                    subscribed.add(channel)
+                    self.channels.setdefault(channel, set()).add(writer)
+                elif command == b"UNSUB":
+                    channel = rest.decode("utf-8").rstrip("\n")
+                    subscribed.discard(channel)
+                    self._remove(channel, writer)
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError) as e:
+            print(f"Pub/sub client error: {e!r}")
+        finally:
+            for channel in subscribed:
+                self._remove(channel, writer)
+            self.clients.discard(writer)
+            writer.close()
+
+    def _forward(self, channel: str, line: bytes, sender: asyncio.StreamWriter):
+        for writer in list(self.channels.get(channel, ())):
+            if writer is sender:
+                continue
+            if writer.transport.get_write_buffer_size() > BROKER_MAX_CLIENT_BUFFER:
+                print("Dropping pub/sub client that stopped reading")
+                writer.close()
+                self._remove(channel, writer)
+                continue
+            writer.write(line)
+
+    def _remove(self, channel: str, writer: asyncio.StreamWriter):
+        writers = self.channels.get(channel)
+        if writers is not None:
+            writers.discard(writer)
+            if not writers:
+                del self.channels[channel]
+
+
+def create_backplane(deliver: Deliver) -> Backplane:
+    """Backplane selected by PUBSUB_BACKEND."""
+    if config.PUBSUB_BACKEND == "socket":
+        return SocketBackplane(deliver, config.PUBSUB_SOCKET_PATH)
+    return Backplane(deliver)
+
+
+if __name__ == "__main__":
+    asyncio.run(PubSubBroker(config.PUBSUB_SOCKET_PATH).serve())
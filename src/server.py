@@ -1,21 +1,33 @@
 """FastAPI server with WebSocket support to replace Beam realtime."""
 
-import json
+import asyncio
 import time
 import uuid
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse, FileResponse, PlainTextResponse
 from pathlib import Path
+from typing import Optional
+from pydantic import BaseModel
 
 from .agent_v2 import Agent, MessageType
 from .config import config, Config
+from .blob_store import blob_store
+from .database import db
 from .code_executor import code_executor
 from .build_service import build_service
+from .turn_scheduler import Turn, TurnStatus, turn_scheduler
 from .websocket_manager import websocket_manager
-from .file_watcher import file_watcher
+from .file_watcher import ChangeSet, file_watcher
+from .llm_metrics import llm_metrics
+from .message_codec import message_codec
+from .metrics import metrics_registry
+from .persistence_queue import persistence_queue
+from .project_cache import project_cache
+from .project_template import project_template
+from .session_hibernator import session_hibernator
 
 # Validate configuration on startup
 Config.validate()
@@ -24,22 +36,23 @@ Config.validate()
 agent_instance: Agent | None = None
 
 
-async def on_file_change(session_id: str):
-    """Callback for file changes - triggers rebuild and notifies clients."""
+async def on_file_change(change_set: ChangeSet):
+    """Callback for a batch of file changes - triggers one rebuild and notifies clients."""
+    session_id = change_set.session_id
     try:
         # Broadcast file change notification
         await websocket_manager.broadcast_to_session(session_id, {
             "id": str(uuid.uuid4()),
             "type": "file_changed",
             "data": {
-                "message": "Files changed, rebuilding...",
-                "session_id": session_id,
+                "message": "Files may have changed, rebuilding..." if change_set.rescan else "Files changed, rebuilding...",
+                **change_set.to_dict(),
             },
             "timestamp": int(time.time() * 1000),
             "session_id": session_id,
         })
         
-        # Queue rebuild
+        # Queue rebuild (one per change set, a rescan included; runs after a build already in progress)
         await build_service.queue_build(session_id, force_rebuild=True)
     except Exception as e:
         print(f"Error handling file change for session {session_id}: {e}")
@@ -50,10 +63,20 @@ async def lifespan(app: FastAPI):
     """Lifespan context manager for startup/shutdown."""
     global agent_instance
     agent_instance = Agent()
+    persistence_queue.start()
+    await websocket_manager.start()
+    await session_hibernator.start()
+    project_template.start()
     print("Agent initialized")
     yield
     agent_instance = None
+    await project_template.stop()
+    await session_hibernator.stop()
     file_watcher.stop_all()  # Stop all file watchers on shutdown
+    await persistence_queue.stop()  # Drain queued writes before closing the database
+    await blob_store.drain()
+    await websocket_manager.stop()
+    await db.close()
     print("Agent shutdown")
 
 
@@ -75,6 +98,70 @@ async def health_check():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus-style metrics (LLM latency, tokens, throughput)."""
+    return PlainTextResponse(metrics_registry.render())
+
+
+@app.get("/debug/sessions/{session_id}/llm")
+async def session_llm_calls(session_id: str, limit: int = 50):
+    """Per-session LLM call timings: recent in-memory calls and persisted history."""
+    return {
+        "session_id": session_id,
+        "recent": llm_metrics.get_session_calls(session_id),
+        "persisted": await db.get_llm_calls(session_id, limit=limit),
+    }
+
+
+class RollbackRequest(BaseModel):
+    snapshot_id: str
+
+
+class ForkRequest(BaseModel):
+    snapshot_id: Optional[str] = None  # Defaults to the source session's current state
+
+
+@app.get("/sessions/{session_id}/snapshots")
+async def list_snapshots(session_id: str, limit: int = 50):
+    """List a session's most recent snapshots (one per turn)."""
+    return {"session_id": session_id, "snapshots": await db.list_snapshots(session_id, limit=limit)}
+
+
+@app.post("/sessions/{session_id}/rollback")
+async def rollback_session(session_id: str, request: RollbackRequest):
+    """Restore a session's project to a snapshot, including its build when one is archived."""
+    # A rollback supersedes the turn in flight
+    turn_scheduler.cancel_current(session_id)
+    await session_hibernator.wake(session_id)
+    try:
+        result = await agent_instance.rollback(session_id, request.snapshot_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    # Connected clients reload the restored code
+    code_data = await agent_instance.load_code(session_id=session_id)
+    await websocket_manager.broadcast_to_session(session_id, {
+        "id": str(uuid.uuid4()),
+        "type": MessageType.LOAD_CODE.value,
+        "data": code_data,
+        "timestamp": int(time.time() * 1000),
+        "session_id": session_id,
+    })
+    return result
+
+
+@app.post("/sessions/{session_id}/fork")
+async def fork_session(session_id: str, request: ForkRequest):
+    """Start a new session from a snapshot (or the current state) of an existing one."""
+    await session_hibernator.wake(session_id)
+    try:
+        result = await agent_instance.fork(session_id, request.snapshot_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {**result, "url": f"{config.BACKEND_URL}/preview/{result['session_id']}"}
+
+
 @app.get("/preview/{session_id}/build")
 async def build_preview(session_id: str, background: bool = True):
     """
@@ -85,6 +172,7 @@ async def build_preview(session_id: str, background: bool = True):
                    If False, wait for build to complete (blocking)
     """
     try:
+        await session_hibernator.wake(session_id)
         if background:
             # Queue build (non-blocking - better than lovable!)
             result = await build_service.queue_build(session_id, force_rebuild=True)
@@ -111,6 +199,7 @@ async def build_status(session_id: str):
 @app.get("/preview/{session_id}/{full_path:path}")
 async def serve_preview_files(session_id: str, full_path: str, request: Request):
     """Serve built files for a session - handles all paths under /preview/{session_id}/."""
+    await session_hibernator.wake(session_id)
     build_path = build_service.get_build_path(session_id)
     
     if build_path and build_path.exists():
@@ -142,6 +231,7 @@ async def serve_preview_files(session_id: str, full_path: str, request: Request)
 @app.get("/preview/{session_id}")
 async def serve_preview_root(session_id: str):
     """Serve the preview root - serves index.html or simple preview."""
+    await session_hibernator.wake(session_id)
     build_path = build_service.get_build_path(session_id)
     
     if build_path and build_path.exists():
@@ -156,18 +246,15 @@ async def serve_preview_root(session_id: str):
 async def preview_session_simple(session_id: str):
     """Simple preview using React CDN (fallback when build not available)."""
     try:
-        # Load code files for this session
-        file_map, package_json = code_executor.load_code(session_id)
-        
-        # Also check database
-        from .database import db
-        db_files = db.get_code_files(session_id)
-        if db_files:
-            file_map = {k: v.encode("utf-8") for k, v in db_files.items()}
+        # Load code files for this session (cached, read from the local project)
+        project = await project_cache.load(session_id)
+        code_map = project.code_map
         
-        # Convert bytes to strings
-        code_map = {path: content.decode("utf-8") if isinstance(content, bytes) else content 
-                   for path, content in file_map.items()}
+        # Fall back to the database when there is no local copy of the project
+        if not code_map:
+            code_map = persistence_queue.apply_pending(
+                session_id, await db.get_code_files(session_id)
+            )
         
         # Find App.tsx or App.jsx (main component)
         app_file = None
@@ -233,97 +320,217 @@ async def preview_session_simple(session_id: str):
         return HTMLResponse(content=error_html, status_code=500)
 
 
+async def handle_ws_message(
+    websocket: WebSocket, msg: dict, request_id: str, turns: dict[str, Turn]
+) -> Optional[dict]:
+    """Handle one client message, returning the direct response (if any)."""
+    session_id = (msg.get("data") or {}).get("session_id")
+    if session_id:
+        # A hibernated session is rehydrated before anything touches it
+        await session_hibernator.wake(session_id)
+
+    match msg.get("type"):
+        case MessageType.USER.value:
+            session_id = msg["data"]["session_id"]
+            # Connect to session for build progress updates
+            await websocket_manager.connect(websocket, session_id)
+            
+            feedback = msg["data"]["text"]
+
+            # Turns are serialized per session; progress is broadcast to
+            # every connection on the session, tagged with this request id
+            turns[request_id] = await turn_scheduler.submit(
+                session_id, feedback, agent_instance.send_feedback, request_id=request_id
+            )
+            return None
+
+        case MessageType.INIT.value:
+            session_id = msg["data"]["session_id"]
+            # Connect to session for build progress updates
+            await websocket_manager.connect(websocket, session_id)
+            
+            # One database round trip; the initial code goes out with INIT
+            bootstrap = await agent_instance.bootstrap(session_id)
+            
+            # Set preview URL
+            preview_url = f"{config.BACKEND_URL}/preview/{session_id}"
+
+            return {
+                "id": str(uuid.uuid4()),
+                "type": MessageType.INIT.value,
+                "data": {
+                    "exists": bootstrap["exists"],
+                    "session_id": session_id,
+                    "url": preview_url,
+                    "code_map": bootstrap["code_map"],
+                    "package_json": bootstrap["package_json"],
+                    "version": bootstrap["version"],
+                    "history": bootstrap["history"],
+                    # Reconnects send this back (with the last seq seen) to resume
+                    "stream": websocket_manager.get_stream_position(session_id),
+                },
+                "timestamp": int(time.time() * 1000),
+                "session_id": session_id,
+            }
+
+        case MessageType.LOAD_CODE.value:
+            session_id = msg["data"]["session_id"]
+            # Connect to session for build progress updates
+            await websocket_manager.connect(websocket, session_id)
+            
+            # A client that already has files sends their hashes and gets only the difference
+            code_data = await agent_instance.load_code(
+                session_id=session_id, known_hashes=msg["data"].get("hashes")
+            )
+
+            return {
+                "id": str(uuid.uuid4()),
+                "type": MessageType.LOAD_CODE.value,
+                "data": code_data,
+                "timestamp": int(time.time() * 1000),
+                "session_id": session_id,
+            }
+
+        case MessageType.RESUME.value:
+            session_id = msg["data"]["session_id"]
+            # Reconnect after a drop: replay the session events missed since resume_from
+            replayed = await websocket_manager.resume(
+                websocket,
+                session_id,
+                msg["data"].get("stream_id"),
+                int(msg["data"].get("resume_from", 0)),
+            )
+
+            data = {"session_id": session_id, "replayed": replayed}
+            if replayed is None:
+                # Too much was missed: send the current state instead
+                code_data = await agent_instance.load_code(session_id=session_id)
+                data["snapshot"] = {
+                    **code_data,
+                    "build": build_service.get_build_status(session_id),
+                    "turn": turn_scheduler.get_current_turn(session_id),
+                }
+            # Everything up to this position is queued ahead of this reply
+            data["stream"] = websocket_manager.get_stream_position(session_id)
+
+            return {
+                "id": str(uuid.uuid4()),
+                "type": MessageType.RESUME.value,
+                "data": data,
+                "timestamp": int(time.time() * 1000),
+                "session_id": session_id,
+            }
+
+        case _:
+            return {"error": f"Unknown message type: {msg.get('type')}"}
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket endpoint for real-time communication."""
-    session_id: str | None = None
-    
+    """
+    WebSocket endpoint for real-time communication.
+
+    Every message runs as its own task, so a long request (a generation,
+    a cold INIT) doesn't hold up the others on the same socket. Responses
+    carry the request_id of the message they answer (the client's
+    request_id or id, else a generated one), and a cancel message stops an
+    in-flight request along with the turn it started.
+    """
+    await websocket.accept()
+    # In-flight requests and the turns started by USER requests, by request id
+    requests: dict[str, asyncio.Task] = {}
+    turns: dict[str, Turn] = {}
+
+    async def reply(message: dict, request_id: str):
+        message["request_id"] = request_id
+        await websocket_manager.send_personal_message(message, websocket)
+
+    async def run_request(msg: dict, request_id: str):
+        try:
+            response = await handle_ws_message(websocket, msg, request_id, turns)
+            if response is not None:
+                await reply(response, request_id)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"Error handling {msg.get('type')} request {request_id}: {e}")
+            await reply({"error": str(e)}, request_id)
+        finally:
+            requests.pop(request_id, None)
+
+    async def cancel_request(request_id: str) -> bool:
+        cancelled = False
+        task = requests.get(request_id)
+        if task is not None:
+            task.cancel()
+            cancelled = True
+        turn = turns.pop(request_id, None)
+        if turn is not None and await turn_scheduler.cancel(turn.session_id, turn.id):
+            cancelled = True
+        return cancelled
+
     try:
         while True:
             # Receive message
-            data = await websocket.receive_text()
-            msg = json.loads(data)
+            msg = await message_codec.receive(websocket)
+            request_id = str(msg.get("request_id") or msg.get("id") or uuid.uuid4())
 
             if not agent_instance:
-                await websocket.send_json({"error": "Agent not initialized"})
+                await reply({"error": "Agent not initialized"}, request_id)
                 continue
 
-            # Handle different message types
-            match msg.get("type"):
-                case MessageType.USER.value:
-                    session_id = msg["data"]["session_id"]
-                    # Connect to session for build progress updates
-                    await websocket_manager.connect(websocket, session_id)
-                    
-                    feedback = msg["data"]["text"]
-
-                    # Stream responses
-                    async for response in agent_instance.send_feedback(
-                        session_id=session_id, feedback=feedback
-                    ):
-                        await websocket.send_json(response)
-
-                case MessageType.INIT.value:
-                    session_id = msg["data"]["session_id"]
-                    # Connect to session for build progress updates
-                    await websocket_manager.connect(websocket, session_id)
-                    
-                    exists = await agent_instance.init(session_id=session_id)
-
-                    from .code_executor import code_executor
-                    project_data = code_executor.create_project(session_id)
-                    
-                    # Set preview URL
-                    preview_url = f"{config.BACKEND_URL}/preview/{session_id}"
-
-                    response = {
+            if msg.get("type") == MessageType.CANCEL.value:
+                target = (msg.get("data") or {}).get("request_id")
+                cancelled = await cancel_request(target) if target else False
+                await reply(
+                    {
                         "id": str(uuid.uuid4()),
-                        "type": MessageType.INIT.value,
-                        "data": {
-                            "exists": exists,
-                            "session_id": session_id,
-                            "url": preview_url,
-                        },
+                        "type": MessageType.CANCEL.value,
+                        "data": {"request_id": target, "cancelled": cancelled},
                         "timestamp": int(time.time() * 1000),
-                        "session_id": session_id,
-                    }
-                    await websocket.send_json(response)
-
-                case MessageType.LOAD_CODE.value:
-                    session_id = msg["data"]["session_id"]
-                    # Connect to session for build progress updates
-                    await websocket_manager.connect(websocket, session_id)
-                    
-                    code_data = await agent_instance.load_code(session_id=session_id)
-
-                    response = {
-                        "id": str(uuid.uuid4()),
-                        "type": MessageType.LOAD_CODE.value,
-                        "data": code_data,
-                        "timestamp": int(time.time() * 1000),
-                        "session_id": session_id,
-                    }
-                    await websocket.send_json(response)
+                    },
+                    request_id,
+                )
+                continue
+
+            if request_id in requests:
+                await reply({"error": f"Request {request_id} is already in flight"}, request_id)
+                continue
+            if len(requests) >= config.WS_MAX_CONCURRENT_REQUESTS:
+                await reply(
+                    {"error": f"Too many concurrent requests (limit {config.WS_MAX_CONCURRENT_REQUESTS})"},
+                    request_id,
+                )
+                continue
 
-                case _:
-                    await websocket.send_json({"error": f"Unknown message type: {msg.get('type')}"})
+            # Forget turns that already finished
+            for turn_request_id, turn in list(turns.items()):
+                if turn.status not in (TurnStatus.QUEUED, TurnStatus.RUNNING):
+                    del turns[turn_request_id]
+
+            requests[request_id] = asyncio.create_task(run_request(msg, request_id))
 
     except WebSocketDisconnect:
-        if session_id:
-            websocket_manager.disconnect(websocket, session_id)
+        websocket_manager.release(websocket)
         print("Client disconnected")
     except Exception as e:
-        if session_id:
-            websocket_manager.disconnect(websocket, session_id)
         print(f"WebSocket error: {e}")
-        try:
-            await websocket.send_json({"error": str(e)})
-        except:
-            pass
-
+        # Through the connection's writer: encoded for this client, after what is already queued
+        await websocket_manager.send_personal_message({"error": str(e)}, websocket)
+        await websocket_manager.drain(websocket)
+        websocket_manager.release(websocket)
+    finally:
+        # Requests die with their socket; turns keep running for the session's other tabs
+        for task in requests.values():
+            task.cancel()
 
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host=config.HOST, port=config.PORT)
+    uvicorn.run(
+        app,
+        host=config.HOST,
+        port=config.PORT,
+        ws_per_message_deflate=config.WS_PER_MESSAGE_DEFLATE,
+    )
 
@@ -0,0 +1,311 @@
+"""Hibernation of idle sessions: archive their projects, drop their state, wake them on access."""
+
+import asyncio
+import io
+import json
+import os
+import shutil
+import tarfile
+import time
+import uuid
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+from .blob_store import content_hash
+from .build_service import build_key, build_service
+from .code_executor import code_executor
+from .config import config
+from .file_watcher import ChangeSet, file_watcher
+from .metrics import Sample, metrics_registry
+from .persistence_queue import persistence_queue
+from .project_cache import project_cache
+from .turn_scheduler import turn_scheduler
+from .websocket_manager import websocket_manager
+
+# Archive member describing how to bring a session back
+MANIFEST_NAME = ".hibernation.json"
+
+# Project entries left out of archives (dependencies go to the shared store,
+# build output is restored from the build archive or rebuilt)
+ARCHIVE_EXCLUDED = {"node_modules", "dist"}
+
+
+class SessionHibernator:
+    """
+    Hibernates sessions nobody has touched for SESSION_IDLE_SECONDS.
+
+    A hibernated session has no file watcher, no build, stream or cache
+    state and no project directory: its project is a tar.gz under
+    PROJECTS_DIR/.hibernated, and its node_modules live on in a store
+    shared by package.json hash (PROJECTS_DIR/.deps). Any access goes
+    through wake(), which extracts the project again, hardlinks the
+    stored node_modules back and restores the archived build, so callers
+    never see the difference beyond the extraction time.
+    """
+
+    def __init__(self):
+        self.projects_dir = Path(config.PROJECTS_DIR)
+        self.archive_dir = self.projects_dir / ".hibernated"
+        self.deps_dir = self.projects_dir / ".deps"
+        # Active sessions by time of last access (monotonic)
+        self.last_active: dict[str, float] = {}
+        self.hibernated: set[str] = set()
+        # Change callbacks of sessions that were watched, to watch them again on wake
+        self.watch_callbacks: dict[str, Callable[[ChangeSet], Awaitable[None]]] = {}
+        self.locks: dict[str, asyncio.Lock] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.hibernations = 0
+        self.wakes = 0
+        self.wake_seconds = 0.0
+
+    def _archive_path(self, session_id: str) -> Path:
+        return self.archive_dir / f"{session_id}.tar.gz"
+
+    def _lock(self, session_id: str) -> asyncio.Lock:
+        lock = self.locks.get(session_id)
+        if lock is None:
+            lock = self.locks[session_id] = asyncio.Lock()
+        return lock
+
+    async def start(self):
+        """Pick up the sessions on disk and start sweeping idle ones."""
+        if self.archive_dir.is_dir():
+            self.hibernated.update(
+                path.name.removesuffix(".tar.gz") for path in self.archive_dir.glob("*.tar.gz")
+            )
+        # Projects left by a previous run count as active from now on
+        now = time.monotonic()
+        if self.projects_dir.is_dir():
+            for path in self.projects_dir.iterdir():
+                if path.is_dir() and not path.name.startswith(".") and path.name not in self.hibernated:
+                    self.last_active.setdefault(path.name, now)
+        if config.SESSION_IDLE_SECONDS > 0:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop sweeping."""
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(config.SESSION_SWEEP_INTERVAL_SECONDS)
+            await self.sweep()
+
+    async def sweep(self) -> int:
+        """Hibernate every idle session; returns how many were hibernated."""
+        cutoff = time.monotonic() - config.SESSION_IDLE_SECONDS
+        hibernated = 0
+        for session_id, last_active in list(self.last_active.items()):
+            if last_active > cutoff:
+                continue
+            try:
+                if await self.hibernate(session_id):
+                    hibernated += 1
+            except Exception as e:
+                print(f"Error hibernating session {session_id}: {e}")
+        return hibernated
+
+    def is_busy(self, session_id: str) -> bool:
+        """Whether a session has a connected client, a turn or a build."""
+        return (
+            websocket_manager.get_connection_count(session_id) > 0
+            or session_id in turn_scheduler.workers
+            or build_service.is_busy(session_id)
+        )
+
+    async def hibernate(self, session_id: str) -> bool:
+        """Archive an idle session's project and drop its state; False if it is busy."""
+        async with self._lock(session_id):
+            if session_id in self.hibernated or self.is_busy(session_id):
+                return False
+            project_path = code_executor.get_project_path(session_id)
+            if not project_path.is_dir():
+                self.last_active.pop(session_id, None)
+                return False
+
+            # Wakes wait on the lock from here on
+            self.hibernated.add(session_id)
+            try:
+                # The database copy must be current before the local one goes
+                if not await persistence_queue.flush_session(session_id):
+                    self.hibernated.discard(session_id)
+                    print(f"Not hibernating session {session_id}: its files could not be persisted")
+                    return False
+
+                handler = file_watcher.handlers.get(session_id)
+                if handler is not None:
+                    self.watch_callbacks[session_id] = handler.on_change
+                file_watcher.stop_watching(session_id)
+                code_executor.forget_tagged_writes(session_id)
+
+                manifest = {
+                    "hibernated_at": time.time(),
+                    "built": build_service.is_built(session_id),
+                }
+                build_service.forget_session(session_id)
+                websocket_manager.forget_session(session_id)
+                project_cache.invalidate(session_id)
+
+                await asyncio.to_thread(self._archive, session_id, manifest)
+            except BaseException:
+                # The project is still on disk; its state reloads lazily
+                self.hibernated.discard(session_id)
+                raise
+
+            self.last_active.pop(session_id, None)
+            self.hibernations += 1
+            print(f"Hibernated session {session_id}")
+            return True
+
+    def _archive(self, session_id: str, manifest: dict):
+        """Write a session's project to its archive, then remove the project directory."""
+        project_path = code_executor.get_project_path(session_id)
+        modules_path = project_path / "node_modules"
+        package_json_path = project_path / "package.json"
+        deps_key = None
+        if modules_path.is_symlink():
+            # Still the golden template's: linked again on wake
+            manifest["shared_modules"] = str(modules_path.resolve())
+        elif modules_path.is_dir() and package_json_path.exists():
+            deps_key = content_hash(package_json_path.read_text(encoding="utf-8"))
+        manifest["deps"] = deps_key
+
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        archive_path = self._archive_path(session_id)
+        tmp_path = self.archive_dir / f".{session_id}.{uuid.uuid4().hex}"
+        try:
+            with tarfile.open(tmp_path, "w:gz") as tar:
+                for entry in project_path.iterdir():
+                    if entry.name in ARCHIVE_EXCLUDED or entry.name.startswith("."):
+                        continue
+                    tar.add(entry, arcname=entry.name)
+                data = json.dumps(manifest).encode("utf-8")
+                info = tarfile.TarInfo(MANIFEST_NAME)
+                info.size = len(data)
+                info.mtime = int(time.time())
+                tar.addfile(info, io.BytesIO(data))
+            os.replace(tmp_path, archive_path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+        if deps_key is not None:
+            self._store_deps(modules_path, deps_key)
+        shutil.rmtree(project_path, ignore_errors=True)
+
+    def _store_deps(self, modules_path: Path, deps_key: str):
+        """Keep a node_modules tree in the shared store (unless an identical one is there)."""
+        store_path = self.deps_dir / deps_key
+        if not store_path.exists():
+            self.deps_dir.mkdir(parents=True, exist_ok=True)
+            try:
+                modules_path.rename(store_path)
+            except OSError:
+                # Stored concurrently by another session with the same package.json
+                pass
+        if store_path.exists():
+            # Mark as recently used
+            os.utime(store_path)
+        self._prune_deps()
+
+    def _prune_deps(self):
+        """Drop the least recently used node_modules trees beyond the limit."""
+        stored = sorted(
+            (path for path in self.deps_dir.iterdir() if not path.name.startswith(".")),
+            key=lambda path: path.stat().st_mtime,
+        )
+        for path in stored[: max(0, len(stored) - config.DEPS_STORE_MAX_ENTRIES)]:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def touch(self, session_id: str):
+        """Record an access to an active session."""
+        self.last_active[session_id] = time.monotonic()
+
+    async def wake(self, session_id: str) -> bool:
+        """
+        Make sure a session is active, rehydrating it if it is hibernated.
+
+        Cheap for active sessions, so every access can go through it.
+        Returns whether the session had to be woken.
+        """
+        self.touch(session_id)
+        lock = self._lock(session_id)
+        # A held lock means a wake may still be restoring the build and watcher
+        if session_id not in self.hibernated and not lock.locked():
+            return False
+        async with lock:
+            if session_id not in self.hibernated:
+                return False
+            started = time.monotonic()
+            manifest = await asyncio.to_thread(self._restore, session_id)
+            self.hibernated.discard(session_id)
+            self.touch(session_id)
+
+            if manifest.get("deps"):
+                build_service.installed_deps[session_id] = manifest["deps"]
+            if manifest.get("built"):
+                project = await project_cache.load(session_id)
+                if not await build_service.restore_build(
+                    session_id, build_key(project.code_map, project.package_json)
+                ):
+                    await build_service.queue_build(session_id)
+            on_change = self.watch_callbacks.pop(session_id, None)
+            if on_change is not None:
+                await file_watcher.watch_session(session_id, on_change)
+
+            elapsed = time.monotonic() - started
+            self.wakes += 1
+            self.wake_seconds += elapsed
+        print(f"Woke session {session_id} in {elapsed:.2f}s")
+        return True
+
+    def _restore(self, session_id: str) -> dict:
+        """Extract a session's archive back into its project directory."""
+        archive_path = self._archive_path(session_id)
+        project_path = code_executor.get_project_path(session_id)
+        tmp_path = self.projects_dir / f".{session_id}.{uuid.uuid4().hex}"
+        try:
+            with tarfile.open(archive_path, "r:gz") as tar:
+                tar.extractall(tmp_path, filter="data")
+            manifest_path = tmp_path / MANIFEST_NAME
+            manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+            manifest_path.unlink()
+
+            shared_path = Path(manifest["shared_modules"]) if manifest.get("shared_modules") else None
+            store_path = self.deps_dir / manifest["deps"] if manifest.get("deps") else None
+            if shared_path is not None and shared_path.is_dir():
+                (tmp_path / "node_modules").symlink_to(shared_path, target_is_directory=True)
+            elif store_path is not None and store_path.is_dir():
+                code_executor.link_tree(store_path, tmp_path / "node_modules")
+                os.utime(store_path)
+            else:
+                # Pruned from the store: the next build installs again
+                manifest["deps"] = None
+
+            if project_path.exists():
+                # Left over from a hibernation interrupted after archiving
+                shutil.rmtree(project_path)
+            tmp_path.rename(project_path)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        archive_path.unlink()
+        return manifest
+
+    def get_metrics(self) -> list[Sample]:
+        """Metrics samples for /metrics."""
+        return [
+            ("sessions_active", {}, len(self.last_active)),
+            ("sessions_hibernated", {}, len(self.hibernated)),
+            ("session_hibernations_total", {}, self.hibernations),
+            ("session_wakes_total", {}, self.wakes),
+            ("session_wake_seconds_total", {}, self.wake_seconds),
+        ]
+
+
+# Global session hibernator instance
+session_hibernator = SessionHibernator()
+metrics_registry.register(session_hibernator.get_metrics)
@@ -0,0 +1,555 @@
+"""SQLite storage backend implementing the Database interface (single-node deployments, offline runs)."""
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+# supabase_schema.sql translated to SQLite: UUIDs and timestamps are TEXT
+# (ISO-8601 UTC, so they sort chronologically), JSONB columns are JSON TEXT
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    session_id TEXT UNIQUE NOT NULL,
+    project_url TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    user_id TEXT,
+    metadata TEXT NOT NULL DEFAULT '{}',
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    content TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS code_files (
+    id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+    file_path TEXT NOT NULL,
+    blob_hash TEXT NOT NULL REFERENCES blobs(hash),
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    UNIQUE(session_id, file_path)
+);
+
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+    role TEXT NOT NULL CHECK (role IN ('user', 'assistant', 'system')),
+    content TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS conversation_summaries (
+    session_id TEXT PRIMARY KEY REFERENCES sessions(session_id) ON DELETE CASCADE,
+    summary TEXT NOT NULL DEFAULT '',
+    summarized_through TEXT,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS llm_calls (
+    id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+    turn_id TEXT NOT NULL,
+    function_name TEXT NOT NULL,
+    client_name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    ttft_ms REAL,
+    plan_complete_ms REAL,
+    total_ms REAL,
+    file_done_ms TEXT NOT NULL DEFAULT '{}',
+    input_tokens INTEGER,
+    output_tokens INTEGER,
+    tokens_estimated INTEGER NOT NULL DEFAULT 0,
+    tokens_per_sec REAL,
+    cost_usd REAL,
+    created_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS snapshots (
+    id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+    turn_id TEXT,
+    parent_id TEXT REFERENCES snapshots(id) ON DELETE SET NULL,
+    manifest TEXT NOT NULL DEFAULT '{}',
+    package_json_hash TEXT,
+    created_at TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_code_files_session_id ON code_files(session_id);
+CREATE INDEX IF NOT EXISTS idx_conversations_session_created ON conversations(session_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_llm_calls_session_turn ON llm_calls(session_id, turn_id);
+CREATE INDEX IF NOT EXISTS idx_snapshots_session_created ON snapshots(session_id, created_at DESC);
+"""
+
+# Moves file contents of databases created before code_files referenced blobs
+INLINE_CONTENT_MIGRATION = """
+ALTER TABLE code_files ADD COLUMN blob_hash TEXT REFERENCES blobs(hash);
+INSERT INTO blobs (hash, content, size, created_at)
+SELECT blob_hash(content), content, length(content), MIN(created_at) FROM code_files GROUP BY content
+ON CONFLICT (hash) DO NOTHING;
+UPDATE code_files SET blob_hash = blob_hash(content);
+ALTER TABLE code_files DROP COLUMN content;
+"""
+
+# Columns stored as JSON text
+JSON_COLUMNS = {"metadata", "manifest", "file_done_ms"}
+
+# Columns callers may set through update_session / save_llm_call
+SESSION_UPDATE_COLUMNS = {"project_url", "user_id", "metadata"}
+LLM_CALL_COLUMNS = {
+    "session_id",
+    "turn_id",
+    "function_name",
+    "client_name",
+    "status",
+    "ttft_ms",
+    "plan_complete_ms",
+    "total_ms",
+    "file_done_ms",
+    "input_tokens",
+    "output_tokens",
+    "tokens_estimated",
+    "tokens_per_sec",
+    "cost_usd",
+}
+
+# Bound parameters per IN (...) query
+IN_CHUNK = 500
+
+
+def blob_hash(content: str) -> str:
+    """Address of a blob (the same as blob_store.content_hash)."""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def now() -> str:
+    """Current time as a sortable ISO-8601 UTC timestamp."""
+    return datetime.now(timezone.utc).isoformat(timespec="microseconds")
+
+
+def row_to_dict(row: sqlite3.Row) -> dict:
+    """Convert a row to the dict shape the Supabase backend returns."""
+    data = dict(row)
+    for column in JSON_COLUMNS & data.keys():
+        if isinstance(data[column], str):
+            data[column] = json.loads(data[column])
+    if "tokens_estimated" in data:
+        data["tokens_estimated"] = bool(data["tokens_estimated"])
+    return data
+
+
+class SQLiteDatabase:
+    """
+    Database interface over a local SQLite file in WAL mode.
+
+    Implements the same async methods as Database. Queries run on a single
+    dedicated thread that owns the connection, so calls are serialized (as
+    SQLite writes are anyway) and never block the event loop. The RPCs of
+    the Supabase schema (apply_code_changes, save_snapshot,
+    bootstrap_session, ...) are implemented as transactions here.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open the database and create the schema on first use (runs on the db thread)."""
+        if self._conn is None:
+            if self.path != ":memory:":
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.create_function("blob_hash", 1, blob_hash, deterministic=True)
+            conn.executescript(SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(code_files)")}
+            if "content" in columns:
+                conn.executescript(f"BEGIN; {INLINE_CONTENT_MIGRATION} COMMIT;")
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Run a function with the connection on the db thread."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: fn(self._connect()))
+
+    async def _transaction(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Run a function inside one write transaction."""
+
+        def run(conn: sqlite3.Connection):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(conn)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            return result
+
+        return await self._run(run)
+
+    async def close(self):
+        """Close the connection."""
+
+        def close(_conn):
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+        if self._conn is not None:
+            await self._run(close)
+
+    def _fetch_one(self, conn: sqlite3.Connection, sql: str, params: tuple = ()) -> Optional[dict]:
+        row = conn.execute(sql, params).fetchone()
+        return row_to_dict(row) if row else None
+
+    def _fetch_all(self, conn: sqlite3.Connection, sql: str, params: tuple = ()) -> list[dict]:
+        return [row_to_dict(row) for row in conn.execute(sql, params).fetchall()]
+
+    def _insert_session(self, conn: sqlite3.Connection, session_id: str, project_url=None, metadata=None):
+        timestamp = now()
+        conn.execute(
+            "INSERT INTO sessions (id, session_id, project_url, created_at, updated_at, metadata) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (str(uuid.uuid4()), session_id, project_url, timestamp, timestamp, json.dumps(metadata or {})),
+        )
+
+    async def create_session(
+        self, session_id: str, project_url: Optional[str] = None, metadata: Optional[dict] = None
+    ) -> dict:
+        """Create a new session."""
+
+        def create(conn):
+            self._insert_session(conn, session_id, project_url, metadata)
+            return self._fetch_one(conn, "SELECT * FROM sessions WHERE session_id = ?", (session_id,))
+
+        return await self._transaction(create)
+
+    async def get_session(self, session_id: str) -> Optional[dict]:
+        """Get session by session_id."""
+        return await self._run(
+            lambda conn: self._fetch_one(conn, "SELECT * FROM sessions WHERE session_id = ?", (session_id,))
+        )
+
+    async def update_session(self, session_id: str, **kwargs) -> dict:
+        """Update session."""
+        unknown = kwargs.keys() - SESSION_UPDATE_COLUMNS
+        if unknown:
+            raise ValueError(f"Unknown session columns: {sorted(unknown)}")
+
+        def update(conn):
+            values = {
+                column: json.dumps(value) if column in JSON_COLUMNS else value
+                for column, value in kwargs.items()
+            }
+            values["updated_at"] = now()
+            assignments = ", ".join(f"{column} = ?" for column in values)
+            conn.execute(
+                f"UPDATE sessions SET {assignments} WHERE session_id = ?",
+                (*values.values(), session_id),
+            )
+            return self._fetch_one(conn, "SELECT * FROM sessions WHERE session_id = ?", (session_id,)) or {}
+
+        return await self._transaction(update)
+
+    async def bootstrap_session(self, session_id: str, history_limit: int = 50) -> dict:
+        """Get or create a session with its latest snapshot and recent history."""
+
+        def bootstrap(conn):
+            session = self._fetch_one(conn, "SELECT * FROM sessions WHERE session_id = ?", (session_id,))
+            created = session is None
+            if created:
+                self._insert_session(conn, session_id)
+                session = self._fetch_one(conn, "SELECT * FROM sessions WHERE session_id = ?", (session_id,))
+            return {
+                "session": session,
+                "created": created,
+                "snapshot": self._latest_snapshot(conn, session_id),
+                "history": self._recent_messages(conn, session_id, history_limit),
+            }
+
+        return await self._transaction(bootstrap)
+
+    def _upsert_file(self, conn: sqlite3.Connection, session_id: str, file_path: str, content: str):
+        timestamp = now()
+        content_hash = blob_hash(content)
+        conn.execute(
+            "INSERT INTO blobs (hash, content, size, created_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (hash) DO NOTHING",
+            (content_hash, content, len(content), timestamp),
+        )
+        conn.execute(
+            "INSERT INTO code_files (id, session_id, file_path, blob_hash, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (session_id, file_path) DO UPDATE SET "
+            "blob_hash = excluded.blob_hash, updated_at = excluded.updated_at",
+            (str(uuid.uuid4()), session_id, file_path, content_hash, timestamp, timestamp),
+        )
+
+    async def save_code_file(self, session_id: str, file_path: str, content: str) -> dict:
+        """Save or update a code file."""
+
+        def save(conn):
+            self._upsert_file(conn, session_id, file_path, content)
+            return self._fetch_one(
+                conn,
+                "SELECT * FROM code_files WHERE session_id = ? AND file_path = ?",
+                (session_id, file_path),
+            )
+
+        return await self._transaction(save)
+
+    async def save_code_files(
+        self, session_id: str, files: dict[str, str], deleted: Optional[list[str]] = None
+    ) -> int:
+        """Save a change set in one transaction and return the new project version."""
+
+        def apply(conn):
+            row = conn.execute(
+                "UPDATE sessions SET version = version + 1, updated_at = ? WHERE session_id = ? "
+                "RETURNING version",
+                (now(), session_id),
+            ).fetchone()
+            if row is None:
+                raise ValueError(f"Session {session_id} not found")
+            for file_path, content in files.items():
+                self._upsert_file(conn, session_id, file_path, content)
+            conn.executemany(
+                "DELETE FROM code_files WHERE session_id = ? AND file_path = ?",
+                [(session_id, file_path) for file_path in deleted or []],
+            )
+            return int(row["version"])
+
+        return await self._transaction(apply)
+
+    async def get_code_files(self, session_id: str) -> dict[str, str]:
+        """Get all code files for a session."""
+        rows = await self._run(
+            lambda conn: conn.execute(
+                "SELECT code_files.file_path, blobs.content FROM code_files "
+                "JOIN blobs ON blobs.hash = code_files.blob_hash WHERE code_files.session_id = ?",
+                (session_id,),
+            ).fetchall()
+        )
+        return {row["file_path"]: row["content"] for row in rows}
+
+    async def get_missing_blobs(self, hashes: list[str]) -> set[str]:
+        """Get the hashes that have no stored blob yet."""
+
+        def missing(conn):
+            stored: set[str] = set()
+            for start in range(0, len(hashes), IN_CHUNK):
+                chunk = hashes[start : start + IN_CHUNK]
+                placeholders = ", ".join("?" * len(chunk))
+                rows = conn.execute(f"SELECT hash FROM blobs WHERE hash IN ({placeholders})", chunk)
+                stored.update(row["hash"] for row in rows)
+            return set(hashes) - stored
+
+        return await self._run(missing)
+
+    async def get_blobs(self, hashes: list[str]) -> dict[str, str]:
+        """Get blob contents by hash."""
+
+        def fetch(conn):
+            blobs: dict[str, str] = {}
+            for start in range(0, len(hashes), IN_CHUNK):
+                chunk = hashes[start : start + IN_CHUNK]
+                placeholders = ", ".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT hash, content FROM blobs WHERE hash IN ({placeholders})", chunk
+                )
+                blobs.update({row["hash"]: row["content"] for row in rows})
+            return blobs
+
+        return await self._run(fetch)
+
+    async def save_snapshot(
+        self,
+        session_id: str,
+        turn_id: Optional[str],
+        manifest: dict[str, str],
+        package_json_hash: Optional[str],
+        blobs: dict[str, str],
+    ) -> dict:
+        """Store new blobs and a snapshot manifest in one transaction."""
+
+        def save(conn):
+            timestamp = now()
+            conn.executemany(
+                "INSERT INTO blobs (hash, content, size, created_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (hash) DO NOTHING",
+                [(blob_hash, content, len(content), timestamp) for blob_hash, content in blobs.items()],
+            )
+            parent = self._latest_snapshot(conn, session_id)
+            snapshot_id = str(uuid.uuid4())
+            conn.execute(
+                "INSERT INTO snapshots (id, session_id, turn_id, parent_id, manifest, package_json_hash, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    snapshot_id,
+                    session_id,
+                    turn_id,
+                    parent["id"] if parent else None,
+                    json.dumps(manifest),
+                    package_json_hash,
+                    timestamp,
+                ),
+            )
+            return self._fetch_one(conn, "SELECT * FROM snapshots WHERE id = ?", (snapshot_id,))
+
+        return await self._transaction(save)
+
+    def _latest_snapshot(self, conn: sqlite3.Connection, session_id: str) -> Optional[dict]:
+        return self._fetch_one(
+            conn,
+            "SELECT * FROM snapshots WHERE session_id = ? ORDER BY created_at DESC, rowid DESC LIMIT 1",
+            (session_id,),
+        )
+
+    async def get_snapshot(self, snapshot_id: str) -> Optional[dict]:
+        """Get a snapshot, including its manifest."""
+        return await self._run(
+            lambda conn: self._fetch_one(conn, "SELECT * FROM snapshots WHERE id = ?", (snapshot_id,))
+        )
+
+    async def get_latest_snapshot(self, session_id: str) -> Optional[dict]:
+        """Get a session's most recent snapshot, including its manifest."""
+        return await self._run(lambda conn: self._latest_snapshot(conn, session_id))
+
+    async def list_snapshots(self, session_id: str, limit: int = 50) -> list[dict]:
+        """List a session's most recent snapshots (without manifests)."""
+        return await self._run(
+            lambda conn: self._fetch_all(
+                conn,
+                "SELECT id, session_id, turn_id, parent_id, package_json_hash, created_at "
+                "FROM snapshots WHERE session_id = ? ORDER BY created_at DESC, rowid DESC LIMIT ?",
+                (session_id, limit),
+            )
+        )
+
+    async def save_conversation(self, session_id: str, role: str, content: str) -> dict:
+        """Save a conversation message."""
+
+        def save(conn):
+            message_id = str(uuid.uuid4())
+            conn.execute(
+                "INSERT INTO conversations (id, session_id, role, content, created_at) VALUES (?, ?, ?, ?, ?)",
+                (message_id, session_id, role, content, now()),
+            )
+            return self._fetch_one(conn, "SELECT * FROM conversations WHERE id = ?", (message_id,))
+
+        return await self._transaction(save)
+
+    def _recent_messages(
+        self,
+        conn: sqlite3.Connection,
+        session_id: str,
+        limit: int,
+        after: Optional[str] = None,
+        before: Optional[str] = None,
+        earliest: bool = False,
+    ) -> list[dict]:
+        sql = "SELECT role, content, created_at FROM conversations WHERE session_id = ?"
+        params: list[Any] = [session_id]
+        if after:
+            sql += " AND created_at > ?"
+            params.append(after)
+        if before:
+            sql += " AND created_at < ?"
+            params.append(before)
+        if earliest:
+            sql += " ORDER BY created_at, rowid LIMIT ?"
+            params.append(limit)
+            return self._fetch_all(conn, sql, tuple(params))
+        sql += " ORDER BY created_at DESC, rowid DESC LIMIT ?"
+        params.append(limit)
+        return list(reversed(self._fetch_all(conn, sql, tuple(params))))
+
+    async def get_conversation_history(
+        self,
+        session_id: str,
+        limit: int = 50,
+        after: Optional[str] = None,
+        before: Optional[str] = None,
+        earliest: bool = False,
+    ) -> list[dict]:
+        """Get the most recent (or earliest) conversation messages for a session, oldest first."""
+        return await self._run(
+            lambda conn: self._recent_messages(
+                conn, session_id, limit, after=after, before=before, earliest=earliest
+            )
+        )
+
+    async def get_conversation_summary(self, session_id: str) -> Optional[dict]:
+        """Get the rolling summary of older conversation turns."""
+        return await self._run(
+            lambda conn: self._fetch_one(
+                conn,
+                "SELECT summary, summarized_through, message_count FROM conversation_summaries "
+                "WHERE session_id = ?",
+                (session_id,),
+            )
+        )
+
+    async def save_conversation_summary(
+        self, session_id: str, summary: str, summarized_through: str, message_count: int
+    ) -> dict:
+        """Save the rolling summary covering messages up to summarized_through."""
+
+        def save(conn):
+            conn.execute(
+                "INSERT INTO conversation_summaries (session_id, summary, summarized_through, message_count, updated_at) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (session_id) DO UPDATE SET summary = excluded.summary, "
+                "summarized_through = excluded.summarized_through, "
+                "message_count = excluded.message_count, updated_at = excluded.updated_at",
+                (session_id, summary, summarized_through, message_count, now()),
+            )
+            return self._fetch_one(
+                conn, "SELECT * FROM conversation_summaries WHERE session_id = ?", (session_id,)
+            )
+
+        return await self._transaction(save)
+
+    async def save_llm_call(self, call: dict) -> dict:
+        """Save the metrics of a single LLM call."""
+        data = {key: value for key, value in call.items() if key in LLM_CALL_COLUMNS}
+
+        def save(conn):
+            values = {
+                column: json.dumps(value) if column in JSON_COLUMNS else value
+                for column, value in data.items()
+            }
+            values["id"] = str(uuid.uuid4())
+            values["created_at"] = now()
+            columns = ", ".join(values)
+            placeholders = ", ".join("?" * len(values))
+            conn.execute(f"INSERT INTO llm_calls ({columns}) VALUES ({placeholders})", tuple(values.values()))
+            return self._fetch_one(conn, "SELECT * FROM llm_calls WHERE id = ?", (values["id"],))
+
+        return await self._transaction(save)
+
+    async def get_llm_calls(self, session_id: str, limit: int = 50) -> list[dict]:
+        """Get the most recent LLM call metrics for a session."""
+        return await self._run(
+            lambda conn: self._fetch_all(
+                conn,
+                "SELECT * FROM llm_calls WHERE session_id = ? ORDER BY created_at DESC, rowid DESC LIMIT ?",
+                (session_id, limit),
+            )
+        )
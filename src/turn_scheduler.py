@@ -0,0 +1,198 @@
+"""Per-session turn scheduler: serializes agent turns and cancels superseded ones."""
+
+import asyncio
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, AsyncGenerator, Callable, Optional
+
+from .config import config
+from .message_codec import tag_request
+from .metrics import Sample, metrics_registry
+from .websocket_manager import websocket_manager
+
+
+class TurnPolicy(Enum):
+    """What happens to an in-flight turn when a new message arrives."""
+    CANCEL = "cancel"  # newer message supersedes the in-flight generation
+    QUEUE = "queue"  # newer message waits behind the in-flight generation
+
+
+class TurnStatus(Enum):
+    """Turn status enumeration."""
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    CANCELLED = "cancelled"
+    ERROR = "error"
+
+
+@dataclass
+class Turn:
+    """A single user message being processed for a session."""
+    id: str
+    session_id: str
+    feedback: str
+    status: TurnStatus = TurnStatus.QUEUED
+    created_at: float = field(default_factory=time.time)
+    task: Optional[asyncio.Task] = None
+    request_id: Optional[str] = None  # Client request that started the turn
+
+    def to_dict(self) -> dict:
+        return {
+            "turn_id": self.id,
+            "request_id": self.request_id,
+            "session_id": self.session_id,
+            "status": self.status.value,
+            "created_at": self.created_at,
+        }
+
+
+# Runs a turn: (session_id, feedback, turn_id) -> stream of outbound messages
+# (dicts or message objects, encoded by the message codec)
+TurnRunner = Callable[..., AsyncGenerator[Any, None]]
+
+
+class TurnScheduler:
+    """
+    Runs at most one turn per session at a time.
+
+    Every message a turn produces is broadcast to all connections of the
+    session, so every tab sees the same progress.
+    """
+
+    def __init__(self, policy: TurnPolicy = TurnPolicy(config.TURN_POLICY)):
+        self.policy = policy
+        self.pending: dict[str, deque[Turn]] = {}
+        self.current: dict[str, Turn] = {}
+        self.workers: dict[str, asyncio.Task] = {}
+        self.turn_counts: dict[TurnStatus, int] = {}
+
+    async def submit(
+        self, session_id: str, feedback: str, run: TurnRunner, request_id: Optional[str] = None
+    ) -> Turn:
+        """Submit a user message as a new turn for a session."""
+        turn = Turn(
+            id=str(uuid.uuid4()), session_id=session_id, feedback=feedback, request_id=request_id
+        )
+        if self.policy == TurnPolicy.CANCEL:
+            # The newest message supersedes everything before it
+            while queue := self.pending.get(session_id):
+                await self._finish(queue.popleft(), TurnStatus.CANCELLED, reason="superseded")
+            self.cancel_current(session_id)
+
+        # Looked up after the awaits: a worker finishing meanwhile drops the session's queue
+        queue = self.pending.setdefault(session_id, deque())
+        queue.append(turn)
+        position = len(queue) - 1 + (1 if session_id in self.current else 0)
+        await self._broadcast(turn, "turn_queued", {**turn.to_dict(), "position": position})
+
+        worker = self.workers.get(session_id)
+        if worker is None or worker.done():
+            self.workers[session_id] = asyncio.create_task(self._run_session(session_id, run))
+
+        return turn
+
+    def cancel_current(
+        self, session_id: str, turn_id: Optional[str] = None, reason: str = "superseded"
+    ) -> bool:
+        """Cancel the in-flight turn of a session (optionally only if it matches turn_id)."""
+        turn = self.current.get(session_id)
+        if turn is None or turn.task is None or turn.task.done():
+            return False
+        if turn_id is not None and turn.id != turn_id:
+            return False
+        turn.task.cancel(reason)
+        return True
+
+    async def cancel(self, session_id: str, turn_id: str) -> bool:
+        """Cancel a turn by id, whether it is running or still queued."""
+        if self.cancel_current(session_id, turn_id, reason="cancelled"):
+            return True
+        queue = self.pending.get(session_id)
+        for turn in list(queue or []):
+            if turn.id == turn_id:
+                queue.remove(turn)
+                await self._finish(turn, TurnStatus.CANCELLED, reason="cancelled")
+                return True
+        return False
+
+    def get_current_turn(self, session_id: str) -> Optional[dict]:
+        """Get the in-flight turn of a session, if any."""
+        turn = self.current.get(session_id)
+        return turn.to_dict() if turn else None
+
+    async def _run_session(self, session_id: str, run: TurnRunner):
+        """Worker draining a session's turn queue one turn at a time."""
+        try:
+            # Looked up on every turn, as submit() may replace a dropped queue
+            while queue := self.pending.get(session_id):
+                turn = queue.popleft()
+                turn.status = TurnStatus.RUNNING
+                self.current[session_id] = turn
+                turn.task = asyncio.create_task(self._run_turn(turn, run))
+                # asyncio.wait doesn't propagate the turn's cancellation to the worker
+                await asyncio.wait({turn.task})
+                self.current.pop(session_id, None)
+        finally:
+            self.current.pop(session_id, None)
+            if not self.pending.get(session_id):
+                self.pending.pop(session_id, None)
+            self.workers.pop(session_id, None)
+
+    async def _run_turn(self, turn: Turn, run: TurnRunner):
+        """Stream a turn's messages to every connection of its session."""
+        try:
+            async for message in run(
+                session_id=turn.session_id, feedback=turn.feedback, turn_id=turn.id
+            ):
+                if turn.request_id is not None:
+                    tag_request(message, turn.request_id)
+                await websocket_manager.broadcast_to_session(turn.session_id, message)
+            await self._finish(turn, TurnStatus.COMPLETED)
+        except asyncio.CancelledError as e:
+            reason = e.args[0] if e.args else "superseded"
+            await self._finish(turn, TurnStatus.CANCELLED, reason=reason)
+        except Exception as e:
+            print(f"Error running turn {turn.id} for session {turn.session_id}: {e}")
+            await self._finish(turn, TurnStatus.ERROR, reason=str(e))
+
+    async def _finish(self, turn: Turn, status: TurnStatus, reason: Optional[str] = None):
+        """Record a turn's final status and notify the session."""
+        turn.status = status
+        self.turn_counts[status] = self.turn_counts.get(status, 0) + 1
+        if status == TurnStatus.COMPLETED:
+            return
+        data = turn.to_dict()
+        if reason:
+            data["reason"] = reason
+        event = "turn_cancelled" if status == TurnStatus.CANCELLED else "turn_error"
+        await self._broadcast(turn, event, data)
+
+    async def _broadcast(self, turn: Turn, message_type: str, data: dict):
+        """Broadcast a scheduler event about a turn to its session."""
+        await websocket_manager.broadcast_to_session(turn.session_id, {
+            "id": str(uuid.uuid4()),
+            "type": message_type,
+            "data": data,
+            "timestamp": int(time.time() * 1000),
+            "session_id": turn.session_id,
+            "request_id": turn.request_id,
+        })
+
+    def get_metrics(self) -> list[Sample]:
+        """Metrics samples for /metrics."""
+        samples: list[Sample] = [
+            ("turns_running", {}, len(self.current)),
+            ("turns_queued", {}, sum(len(q) for q in self.pending.values())),
+        ]
+        for status, count in self.turn_counts.items():
+            samples.append(("turns_total", {"status": status.value}, count))
+        return samples
+
+
+# Global turn scheduler instance
+turn_scheduler = TurnScheduler()
+metrics_registry.register(turn_scheduler.get_metrics)
@@ -1,63 +1,432 @@
 """WebSocket connection manager for real-time communication."""
 
-import json
-import time
+import asyncio
 import uuid
-from typing import Dict, Set
+from collections import deque
+from enum import Enum
+from typing import Any, Callable, Dict, Optional, Set
 from fastapi import WebSocket
+from starlette.websockets import WebSocketState
+
+from .config import config
+from .message_codec import Encoding, OutboundMessage, message_codec
+from .metrics import Sample, metrics_registry
+from .pubsub import create_backplane
+
+# Progress-style messages a slow consumer can miss (later ones supersede them)
+LOW_PRIORITY_TYPES = {"build_progress", "update_file", "file_changed"}
+
+# Close code sent to consumers that can't keep up ("try again later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+class SlowConsumerPolicy(Enum):
+    """What to do when a connection's outbound queue is full."""
+    DROP = "drop"  # Drop low-priority messages; disconnect only if nothing can be dropped
+    DISCONNECT = "disconnect"  # Disconnect on the first overflow
+
+
+class Connection:
+    """A WebSocket with its own bounded outbound queue and writer task."""
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        encoding: Encoding,
+        max_frame: Optional[int],
+        max_queue: int,
+        policy: SlowConsumerPolicy,
+        send_timeout: float,
+        on_close: Callable[["Connection"], None],
+    ):
+        self.id = uuid.uuid4().hex[:8]
+        self.websocket = websocket
+        self.encoding = encoding
+        self.max_frame = max_frame
+        self.max_queue = max_queue
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.on_close = on_close
+        self.sessions: Set[str] = set()
+        self.queue: deque[tuple[OutboundMessage, bool]] = deque()
+        self.closed = False
+        self.slow_consumer = False
+        self.sent = 0
+        self.dropped = 0
+        self._ready = asyncio.Event()
+        # Set while nothing is queued or being sent (and once closed)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def enqueue(self, message: OutboundMessage, low_priority: bool = False) -> bool:
+        """Queue a message without waiting for the network; False if it was dropped."""
+        if self.closed:
+            return False
+
+        if len(self.queue) >= self.max_queue:
+            if self.policy == SlowConsumerPolicy.DISCONNECT:
+                self.close("outbound queue full", slow_consumer=True)
+                return False
+            if low_priority:
+                self.dropped += 1
+                return False
+            if not self._drop_oldest_low_priority():
+                # Only messages the client can't miss are queued: it is too far behind
+                self.close("outbound queue full of undroppable messages", slow_consumer=True)
+                return False
+
+        self.queue.append((message, low_priority))
+        self._idle.clear()
+        self._ready.set()
+        return True
+
+    def _drop_oldest_low_priority(self) -> bool:
+        """Make room by dropping the oldest queued low-priority message."""
+        for index, (_, low_priority) in enumerate(self.queue):
+            if low_priority:
+                del self.queue[index]
+                self.dropped += 1
+                return True
+        return False
+
+    async def _write_loop(self):
+        """Send queued messages in order, one at a time."""
+        try:
+            while True:
+                if not self.queue:
+                    self._ready.clear()
+                    self._idle.set()
+                    await self._ready.wait()
+                    continue
+                message, _ = self.queue.popleft()
+                if self.max_frame:
+                    frames = message_codec.chunk(message, self.encoding, self.max_frame)
+                else:
+                    frames = [message.frame(self.encoding)]
+                for frame in frames:
+                    if isinstance(frame, bytes):
+                        send = self.websocket.send_bytes(frame)
+                    else:
+                        send = self.websocket.send_text(frame)
+                    await asyncio.wait_for(send, self.send_timeout)
+                self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except TimeoutError:
+            self.close(f"send took over {self.send_timeout}s", slow_consumer=True)
+        except Exception as e:
+            self.close(f"send failed: {e!r}")
+
+    async def drain(self):
+        """Wait until everything queued has been sent (or the connection closed)."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), self.send_timeout)
+        except TimeoutError:
+            pass
+
+    def close(self, reason: Optional[str] = None, slow_consumer: bool = False):
+        """Stop the writer and detach the connection; slow consumers are told to reconnect later."""
+        if self.closed:
+            return
+        self.closed = True
+        self.slow_consumer = slow_consumer
+        self.queue.clear()
+        self._idle.set()
+        if asyncio.current_task() is not self._writer:
+            self._writer.cancel()
+        if reason:
+            print(f"Closing websocket {self.id} ({reason})")
+            asyncio.create_task(self._close_websocket())
+        self.on_close(self)
+
+    async def _close_websocket(self):
+        """Close the underlying socket, ignoring errors from an already dead one."""
+        try:
+            if self.websocket.application_state == WebSocketState.CONNECTED:
+                await self.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE)
+        except Exception:
+            pass
+
+
+class ReplayBuffer:
+    """A session's recent events, numbered in the order they were delivered."""
+
+    def __init__(self, size: int):
+        self.stream_id = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self.events: deque[tuple[int, OutboundMessage]] = deque(maxlen=size)
+
+    def append(self, message: OutboundMessage):
+        """Number a message and keep it for replay."""
+        self.seq += 1
+        message.sequence(self.seq)
+        self.events.append((self.seq, message))
+
+    def since(self, seq: int) -> Optional[list[OutboundMessage]]:
+        """Events after `seq`, or None if some of them are no longer buffered."""
+        if seq > self.seq:
+            return None
+        oldest = self.events[0][0] if self.events else self.seq + 1
+        if seq < oldest - 1:
+            return None
+        return [message for event_seq, message in self.events if event_seq > seq]
+
+    def position(self) -> dict:
+        """Where the stream is: clients resume from here after reconnecting."""
+        return {"stream_id": self.stream_id, "seq": self.seq}
 
 
 class WebSocketManager:
-    """Manages WebSocket connections and broadcasts messages."""
-    
-    def __init__(self):
+    """
+    Manages WebSocket connections and broadcasts messages.
+
+    Sends never wait on the network: every connection has a bounded
+    outbound queue drained by its own writer task, so a slow or half-dead
+    client only delays itself. When a queue is full the slow-consumer
+    policy drops low-priority (progress) messages or disconnects the client.
+
+    Each message is encoded once per wire format (JSON, or msgpack when a
+    client negotiates it on connect) and the same frame goes to every
+    recipient.
+
+    Broadcasts go through the pub/sub backplane, so with several workers a
+    message published by any of them reaches the session's sockets on all
+    of them. The backplane is subscribed to a session while this process
+    has at least one socket on it.
+
+    Delivered broadcasts are numbered per session and kept in a bounded
+    replay buffer. The stream stays subscribed for a retention period
+    after the last socket leaves, so a client that reconnects with the
+    last seq it saw gets exactly the events it missed. Only sessions with
+    sockets here (or retained for one) have a buffer: nobody could resume
+    the stream of any other session from this process.
+    """
+
+    def __init__(
+        self,
+        max_queue: int = config.WS_SEND_QUEUE_SIZE,
+        policy: SlowConsumerPolicy = SlowConsumerPolicy(config.WS_SLOW_CONSUMER_POLICY),
+        send_timeout: float = config.WS_SEND_TIMEOUT_SECONDS,
+        replay_size: int = config.WS_REPLAY_BUFFER_SIZE,
+        replay_retention: float = config.WS_REPLAY_RETENTION_SECONDS,
+    ):
         # Map of session_id -> Set of WebSocket connections
         self.active_connections: Dict[str, Set[WebSocket]] = {}
-    
+        self.connections: Dict[WebSocket, Connection] = {}
+        self.max_queue = max_queue
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.replay_size = replay_size
+        self.replay_retention = replay_retention
+        self.replay_buffers: Dict[str, ReplayBuffer] = {}
+        # Sessions without sockets whose stream is kept for reconnects
+        self.retained: Dict[str, asyncio.TimerHandle] = {}
+        self.messages_dropped = 0
+        self.slow_consumer_disconnects = 0
+        self.resumes = 0
+        self.resume_snapshots = 0
+        self.events_replayed = 0
+        self.backplane = create_backplane(self._deliver)
+
+    async def start(self):
+        """Connect to the pub/sub backplane."""
+        await self.backplane.start()
+
+    async def stop(self):
+        """Disconnect from the pub/sub backplane."""
+        await self.backplane.stop()
+
+    def _get_connection(self, websocket: WebSocket) -> Connection:
+        """Get (or start) the outbound queue of a WebSocket."""
+        connection = self.connections.get(websocket)
+        if connection is None:
+            connection = Connection(
+                websocket,
+                message_codec.negotiate(websocket),
+                message_codec.negotiate_max_frame(websocket),
+                self.max_queue,
+                self.policy,
+                self.send_timeout,
+                self._on_connection_closed,
+            )
+            self.connections[websocket] = connection
+        return connection
+
+    def _on_connection_closed(self, connection: Connection):
+        """Forget a closed connection."""
+        self.messages_dropped += connection.dropped
+        if self.connections.get(connection.websocket) is connection:
+            del self.connections[connection.websocket]
+        for session_id in connection.sessions:
+            self._remove_socket(session_id, connection.websocket)
+        if connection.slow_consumer:
+            self.slow_consumer_disconnects += 1
+
     async def connect(self, websocket: WebSocket, session_id: str):
-        """Connect a WebSocket to a session."""
-        await websocket.accept()
+        """Connect a WebSocket to a session (accepting it if needed)."""
+        if websocket.application_state == WebSocketState.CONNECTING:
+            await websocket.accept()
+        connection = self._get_connection(websocket)
+        connection.sessions.add(session_id)
         if session_id not in self.active_connections:
             self.active_connections[session_id] = set()
-        self.active_connections[session_id].add(websocket)
+        sockets = self.active_connections[session_id]
+        if websocket not in sockets:
+            sockets.add(websocket)
+            retained = self.retained.pop(session_id, None)
+            if retained is not None:
+                # The subscription kept for reconnects now belongs to this socket
+                retained.cancel()
+            else:
+                self.backplane.subscribe(session_id)
         print(f"WebSocket connected for session {session_id}")
-    
+
+    def _remove_socket(self, session_id: str, websocket: WebSocket):
+        """Detach a socket from a session, releasing its backplane subscription."""
+        sockets = self.active_connections.get(session_id)
+        if sockets is None or websocket not in sockets:
+            return
+        sockets.discard(websocket)
+        if sockets:
+            self.backplane.unsubscribe(session_id)
+            return
+        del self.active_connections[session_id]
+        # Keep the last socket's subscription (and the replay buffer) for a while
+        self.retained[session_id] = asyncio.get_running_loop().call_later(
+            self.replay_retention, self._release_session, session_id
+        )
+
+    def _release_session(self, session_id: str):
+        """Drop the stream of a session nobody reconnected to."""
+        if self.retained.pop(session_id, None) is None:
+            return
+        self.backplane.unsubscribe(session_id)
+        self.replay_buffers.pop(session_id, None)
+
+    def forget_session(self, session_id: str):
+        """Drop the stream of a session without sockets right away (it is being hibernated)."""
+        retained = self.retained.get(session_id)
+        if retained is not None:
+            retained.cancel()
+            self._release_session(session_id)
+        self.replay_buffers.pop(session_id, None)
+
+    def _get_replay_buffer(self, session_id: str) -> ReplayBuffer:
+        buffer = self.replay_buffers.get(session_id)
+        if buffer is None:
+            buffer = ReplayBuffer(self.replay_size)
+            self.replay_buffers[session_id] = buffer
+        return buffer
+
+    def get_stream_position(self, session_id: str) -> dict:
+        """Current stream id and seq of a session (for a connected socket)."""
+        return self._get_replay_buffer(session_id).position()
+
+    async def resume(
+        self, websocket: WebSocket, session_id: str, stream_id: Optional[str], resume_from: int
+    ) -> Optional[int]:
+        """
+        Reattach a reconnecting socket and queue the events it missed.
+
+        Returns how many events were replayed, or None if the gap can't be
+        replayed (buffer overrun, or a different stream, e.g. after a
+        restart) and the client needs a state snapshot instead.
+        """
+        await self.connect(websocket, session_id)
+        self.resumes += 1
+        buffer = self.replay_buffers.get(session_id)
+        missed = None
+        if buffer is not None and buffer.stream_id == stream_id:
+            missed = buffer.since(resume_from)
+        if missed is None:
+            self.resume_snapshots += 1
+            return None
+
+        connection = self._get_connection(websocket)
+        for message in missed:
+            connection.enqueue(message, message.type in LOW_PRIORITY_TYPES)
+        self.events_replayed += len(missed)
+        return len(missed)
+
     def disconnect(self, websocket: WebSocket, session_id: str):
         """Disconnect a WebSocket from a session."""
-        if session_id in self.active_connections:
-            self.active_connections[session_id].discard(websocket)
-            if not self.active_connections[session_id]:
-                del self.active_connections[session_id]
+        self._remove_socket(session_id, websocket)
+        connection = self.connections.get(websocket)
+        if connection is not None:
+            connection.sessions.discard(session_id)
         print(f"WebSocket disconnected for session {session_id}")
-    
-    async def send_personal_message(self, message: dict, websocket: WebSocket):
-        """Send a message to a specific WebSocket connection."""
-        try:
-            await websocket.send_json(message)
-        except Exception as e:
-            print(f"Error sending personal message: {e}")
-    
-    async def broadcast_to_session(self, session_id: str, message: dict):
-        """Broadcast a message to all connections for a session."""
+
+    def release(self, websocket: WebSocket):
+        """Drop a WebSocket entirely once its endpoint is done with it."""
+        connection = self.connections.get(websocket)
+        if connection is not None:
+            connection.close()
+
+    async def send_personal_message(self, message: Any, websocket: WebSocket):
+        """Send a message to a specific WebSocket connection (queued, in order with broadcasts)."""
+        self._get_connection(websocket).enqueue(OutboundMessage(message))
+
+    async def drain(self, websocket: WebSocket):
+        """Wait until a WebSocket's queued messages are sent (at most the send timeout)."""
+        connection = self.connections.get(websocket)
+        if connection is not None:
+            await connection.drain()
+
+    async def broadcast_to_session(self, session_id: str, message: Any):
+        """Broadcast a message (a dict or message object) to every connection of a session."""
+        await self.backplane.publish(session_id, OutboundMessage(message))
+
+    async def _deliver(self, session_id: str, message: OutboundMessage):
+        """Number a published message and queue it on this process's connections for the session."""
         if session_id not in self.active_connections:
+            if session_id in self.retained:
+                # Kept for a socket that may reconnect here
+                self._get_replay_buffer(session_id).append(message)
             return
-        
-        # Create a copy of the set to avoid modification during iteration
-        connections = self.active_connections[session_id].copy()
-        
-        for connection in connections:
-            try:
-                await connection.send_json(message)
-            except Exception as e:
-                print(f"Error broadcasting to session {session_id}: {e}")
-                # Remove dead connection
-                self.active_connections[session_id].discard(connection)
-    
+        self._get_replay_buffer(session_id).append(message)
+
+        low_priority = message.type in LOW_PRIORITY_TYPES
+        # Create a copy of the set: a full queue may disconnect a connection while iterating
+        for websocket in list(self.active_connections[session_id]):
+            connection = self.connections.get(websocket)
+            if connection is not None:
+                connection.enqueue(message, low_priority)
+
     def get_connection_count(self, session_id: str) -> int:
         """Get the number of active connections for a session."""
         return len(self.active_connections.get(session_id, set()))
 
+    def get_metrics(self) -> list[Sample]:
+        """Metrics samples for /metrics."""
+        samples: list[Sample] = [
+            ("ws_connections", {}, len(self.connections)),
+            ("ws_sessions", {}, len(self.active_connections)),
+            (
+                "ws_messages_dropped_total",
+                {},
+                self.messages_dropped + sum(c.dropped for c in self.connections.values()),
+            ),
+            ("ws_slow_consumer_disconnects_total", {}, self.slow_consumer_disconnects),
+            ("ws_replay_streams", {}, len(self.replay_buffers)),
+            ("ws_replay_retained_sessions", {}, len(self.retained)),
+            ("ws_resumes_total", {}, self.resumes),
+            ("ws_resume_snapshots_total", {}, self.resume_snapshots),
+            ("ws_events_replayed_total", {}, self.events_replayed),
+        ]
+        for connection in self.connections.values():
+            labels = {
+                "connection": connection.id,
+                "session": ",".join(sorted(connection.sessions)),
+                "encoding": connection.encoding.value,
+            }
+            samples.append(("ws_connection_queue_depth", labels, len(connection.queue)))
+            samples.append(("ws_connection_sent_total", labels, connection.sent))
+            samples.append(("ws_connection_dropped_total", labels, connection.dropped))
+        return samples
+
 
 # Global WebSocket manager instance
 websocket_manager = WebSocketManager()
-
+metrics_registry.register(websocket_manager.get_metrics)
+metrics_registry.register(websocket_manager.backplane.get_metrics)
@@ -9,20 +9,55 @@ CREATE TABLE IF NOT EXISTS sessions (
     created_at TIMESTAMPTZ DEFAULT NOW(),
     updated_at TIMESTAMPTZ DEFAULT NOW(),
     user_id UUID REFERENCES auth.users(id) ON DELETE CASCADE,
-    metadata JSONB DEFAULT '{}'::jsonb
+    metadata JSONB DEFAULT '{}'::jsonb,
+    version BIGINT NOT NULL DEFAULT 0
 );
 
--- Code files table to store project code
+-- Project version, bumped by every applied change set
+ALTER TABLE sessions ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0;
+
+-- Content-addressed file contents, shared by all sessions and snapshots
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,  -- sha256 of the content
+    content TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- Address of a blob (the same as blob_store.content_hash)
+CREATE OR REPLACE FUNCTION blob_hash(p_content TEXT)
+RETURNS TEXT AS $$
+    SELECT encode(sha256(convert_to(p_content, 'UTF8')), 'hex');
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Code files table: the current project, each file's content stored as a blob
 CREATE TABLE IF NOT EXISTS code_files (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
     session_id TEXT NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
     file_path TEXT NOT NULL,
-    content TEXT NOT NULL,
+    blob_hash TEXT NOT NULL REFERENCES blobs(hash),
     created_at TIMESTAMPTZ DEFAULT NOW(),
     updated_at TIMESTAMPTZ DEFAULT NOW(),
     UNIQUE(session_id, file_path)
 );
 
+-- Databases created before code_files referenced blobs: move file contents into blobs
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = 'code_files' AND column_name = 'content'
+    ) THEN
+        INSERT INTO blobs (hash, content, size)
+        SELECT DISTINCT blob_hash(content), content, length(content) FROM code_files
+        ON CONFLICT (hash) DO NOTHING;
+        ALTER TABLE code_files ADD COLUMN IF NOT EXISTS blob_hash TEXT REFERENCES blobs(hash);
+        UPDATE code_files SET blob_hash = blob_hash(content);
+        ALTER TABLE code_files ALTER COLUMN blob_hash SET NOT NULL;
+        ALTER TABLE code_files DROP COLUMN content;
+    END IF;
+END $$;
+
 -- Conversation history table
 CREATE TABLE IF NOT EXISTS conversations (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -32,15 +67,62 @@ CREATE TABLE IF NOT EXISTS conversations (
     created_at TIMESTAMPTZ DEFAULT NOW()
 );
 
+-- Rolling summary of conversation turns that no longer fit the prompt budget
+CREATE TABLE IF NOT EXISTS conversation_summaries (
+    session_id TEXT PRIMARY KEY REFERENCES sessions(session_id) ON DELETE CASCADE,
+    summary TEXT NOT NULL DEFAULT '',
+    summarized_through TIMESTAMPTZ,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- Per-call LLM latency and token metrics
+CREATE TABLE IF NOT EXISTS llm_calls (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    session_id TEXT NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+    turn_id TEXT NOT NULL,
+    function_name TEXT NOT NULL,
+    client_name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    ttft_ms DOUBLE PRECISION,
+    plan_complete_ms DOUBLE PRECISION,
+    total_ms DOUBLE PRECISION,
+    file_done_ms JSONB DEFAULT '{}'::jsonb,
+    input_tokens INTEGER,
+    output_tokens INTEGER,
+    tokens_estimated BOOLEAN DEFAULT FALSE,
+    tokens_per_sec DOUBLE PRECISION,
+    cost_usd DOUBLE PRECISION,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- Per-turn project snapshots: a manifest mapping file paths to blob hashes
+CREATE TABLE IF NOT EXISTS snapshots (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    session_id TEXT NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+    turn_id TEXT,
+    parent_id UUID REFERENCES snapshots(id) ON DELETE SET NULL,
+    manifest JSONB NOT NULL DEFAULT '{}'::jsonb,  -- {"path": "hash"}
+    package_json_hash TEXT,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
 -- Create indexes for performance
 CREATE INDEX IF NOT EXISTS idx_sessions_session_id ON sessions(session_id);
 CREATE INDEX IF NOT EXISTS idx_code_files_session_id ON code_files(session_id);
 CREATE INDEX IF NOT EXISTS idx_conversations_session_id ON conversations(session_id);
+CREATE INDEX IF NOT EXISTS idx_conversations_session_created ON conversations(session_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_llm_calls_session_turn ON llm_calls(session_id, turn_id);
+CREATE INDEX IF NOT EXISTS idx_snapshots_session_created ON snapshots(session_id, created_at DESC);
 
 -- Enable Row Level Security (RLS)
 ALTER TABLE sessions ENABLE ROW LEVEL SECURITY;
 ALTER TABLE code_files ENABLE ROW LEVEL SECURITY;
 ALTER TABLE conversations ENABLE ROW LEVEL SECURITY;
+ALTER TABLE conversation_summaries ENABLE ROW LEVEL SECURITY;
+ALTER TABLE llm_calls ENABLE ROW LEVEL SECURITY;
+ALTER TABLE blobs ENABLE ROW LEVEL SECURITY;
+ALTER TABLE snapshots ENABLE ROW LEVEL SECURITY;
 
 -- RLS Policies (adjust based on your auth requirements)
 -- For now, allow all operations - you should customize these
@@ -53,6 +135,18 @@ CREATE POLICY "Allow all operations on code_files" ON code_files
 CREATE POLICY "Allow all operations on conversations" ON conversations
     FOR ALL USING (true) WITH CHECK (true);
 
+CREATE POLICY "Allow all operations on conversation_summaries" ON conversation_summaries
+    FOR ALL USING (true) WITH CHECK (true);
+
+CREATE POLICY "Allow all operations on llm_calls" ON llm_calls
+    FOR ALL USING (true) WITH CHECK (true);
+
+CREATE POLICY "Allow all operations on blobs" ON blobs
+    FOR ALL USING (true) WITH CHECK (true);
+
+CREATE POLICY "Allow all operations on snapshots" ON snapshots
+    FOR ALL USING (true) WITH CHECK (true);
+
 -- Function to update updated_at timestamp
 CREATE OR REPLACE FUNCTION update_updated_at_column()
 RETURNS TRIGGER AS $$
@@ -62,6 +156,135 @@ BEGIN
 END;
 $$ language 'plpgsql';
 
+-- Apply a change set (upserts + deletes) atomically and return the new project version
+-- p_files: [{"file_path": "...", "content": "..."}]
+CREATE OR REPLACE FUNCTION apply_code_changes(
+    p_session_id TEXT,
+    p_files JSONB DEFAULT '[]'::jsonb,
+    p_deleted TEXT[] DEFAULT '{}'
+)
+RETURNS BIGINT AS $$
+DECLARE
+    new_version BIGINT;
+BEGIN
+    -- Bumping the version locks the session row, so change sets apply in order
+    UPDATE sessions
+    SET version = version + 1
+    WHERE session_id = p_session_id
+    RETURNING version INTO new_version;
+
+    IF new_version IS NULL THEN
+        RAISE EXCEPTION 'Session % not found', p_session_id;
+    END IF;
+
+    INSERT INTO blobs (hash, content, size)
+    SELECT DISTINCT blob_hash(f->>'content'), f->>'content', length(f->>'content')
+    FROM jsonb_array_elements(p_files) AS f
+    ON CONFLICT (hash) DO NOTHING;
+
+    INSERT INTO code_files (session_id, file_path, blob_hash)
+    SELECT p_session_id, f->>'file_path', blob_hash(f->>'content')
+    FROM jsonb_array_elements(p_files) AS f
+    ON CONFLICT (session_id, file_path) DO UPDATE SET blob_hash = EXCLUDED.blob_hash;
+
+    DELETE FROM code_files
+    WHERE session_id = p_session_id AND file_path = ANY(p_deleted);
+
+    RETURN new_version;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Hashes (out of p_hashes) that have no stored blob yet
+CREATE OR REPLACE FUNCTION missing_blobs(p_hashes TEXT[])
+RETURNS TEXT[] AS $$
+    SELECT COALESCE(array_agg(h), '{}')
+    FROM unnest(p_hashes) AS h
+    WHERE NOT EXISTS (SELECT 1 FROM blobs WHERE blobs.hash = h);
+$$ LANGUAGE sql STABLE;
+
+-- Store new blobs and a snapshot manifest in one transaction
+-- p_blobs: [{"hash": "...", "content": "..."}] (only blobs not stored yet)
+CREATE OR REPLACE FUNCTION save_snapshot(
+    p_session_id TEXT,
+    p_turn_id TEXT,
+    p_manifest JSONB,
+    p_package_json_hash TEXT,
+    p_blobs JSONB DEFAULT '[]'::jsonb
+)
+RETURNS snapshots AS $$
+DECLARE
+    new_snapshot snapshots;
+BEGIN
+    INSERT INTO blobs (hash, content, size)
+    SELECT b->>'hash', b->>'content', length(b->>'content')
+    FROM jsonb_array_elements(p_blobs) AS b
+    ON CONFLICT (hash) DO NOTHING;
+
+    INSERT INTO snapshots (session_id, turn_id, parent_id, manifest, package_json_hash)
+    VALUES (
+        p_session_id,
+        p_turn_id,
+        (SELECT id FROM snapshots WHERE session_id = p_session_id ORDER BY created_at DESC LIMIT 1),
+        p_manifest,
+        p_package_json_hash
+    )
+    RETURNING * INTO new_snapshot;
+
+    RETURN new_snapshot;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Get or create a session and return everything a client needs to open it:
+-- the session row, whether it was just created, the latest snapshot (file
+-- manifest) and the most recent conversation messages, oldest first
+CREATE OR REPLACE FUNCTION bootstrap_session(
+    p_session_id TEXT,
+    p_history_limit INTEGER DEFAULT 50
+)
+RETURNS JSONB AS $$
+DECLARE
+    session_row sessions;
+    latest_snapshot snapshots;
+    created BOOLEAN := FALSE;
+BEGIN
+    INSERT INTO sessions (session_id)
+    VALUES (p_session_id)
+    ON CONFLICT (session_id) DO NOTHING
+    RETURNING * INTO session_row;
+
+    IF session_row.id IS NULL THEN
+        SELECT * INTO session_row FROM sessions WHERE session_id = p_session_id;
+    ELSE
+        created := TRUE;
+    END IF;
+
+    SELECT * INTO latest_snapshot
+    FROM snapshots
+    WHERE session_id = p_session_id
+    ORDER BY created_at DESC
+    LIMIT 1;
+
+    RETURN jsonb_build_object(
+        'session', to_jsonb(session_row),
+        'created', created,
+        'snapshot', CASE WHEN latest_snapshot.id IS NULL THEN NULL ELSE to_jsonb(latest_snapshot) END,
+        'history', COALESCE(
+            (
+                SELECT jsonb_agg(recent ORDER BY recent.created_at)
+                FROM (
+                    SELECT role, content, created_at
+                    FROM conversations
+                    WHERE session_id = p_session_id
+                    ORDER BY created_at DESC
+                    LIMIT p_history_limit
+                ) AS recent
+            ),
+            '[]'::jsonb
+        )
+    );
+END;
+$$ LANGUAGE plpgsql;
+
 -- Triggers to auto-update updated_at
 CREATE TRIGGER update_sessions_updated_at BEFORE UPDATE ON sessions
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
@@ -69,3 +292,6 @@ CREATE TRIGGER update_sessions_updated_at BEFORE UPDATE ON sessions
 CREATE TRIGGER update_code_files_updated_at BEFORE UPDATE ON code_files
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
+CREATE TRIGGER update_conversation_summaries_updated_at BEFORE UPDATE ON conversation_summaries
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
@@ -0,0 +1,15 @@
+"""Test configuration: an isolated environment, set before any src module reads config."""
+
+import os
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix="agent-tests-")
+os.environ.update({
+    "OPENAI_API_KEY": "test",
+    "DATABASE_BACKEND": "sqlite",
+    "SQLITE_PATH": os.path.join(_tmp, "app.db"),
+    "PROJECTS_DIR": os.path.join(_tmp, "projects"),
+    "PERSIST_DEAD_LETTER_DIR": os.path.join(_tmp, "dead_letter"),
+    "PUBSUB_BACKEND": "local",
+    "SESSION_IDLE_SECONDS": "0",
+})
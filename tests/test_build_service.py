@@ -0,0 +1,87 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+
+from src.build_service import build_service
+from src.code_executor import code_executor
+from src.project_cache import project_cache
+
+# Logs each invocation; "run build" writes dist from the current App.tsx
+FAKE_NPM = """#!/bin/sh
+echo "$*" >> "$NPM_LOG"
+if [ "$1" = "install" ]; then
+  mkdir -p node_modules
+elif [ "$1" = "run" ]; then
+  sleep 0.2
+  mkdir -p dist
+  cat src/App.tsx > dist/index.html
+fi
+"""
+
+
+@pytest.fixture
+def npm_log(tmp_path, monkeypatch):
+    bin_path = tmp_path / "bin"
+    bin_path.mkdir()
+    (bin_path / "npm").write_text(FAKE_NPM)
+    (bin_path / "npm").chmod(0o755)
+    log_path = tmp_path / "npm.log"
+    log_path.touch()
+    monkeypatch.setenv("PATH", f"{bin_path}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("NPM_LOG", str(log_path))
+    return log_path
+
+
+def new_project() -> str:
+    session_id = str(uuid.uuid4())
+    code_executor.create_project(session_id)
+    return session_id
+
+
+def write_app(session_id: str, content: str):
+    code_executor.save_code(session_id, {"App.tsx": content})
+    project_cache.invalidate(session_id)
+
+
+def test_concurrent_builds_run_npm_once(npm_log):
+    session_id = new_project()
+
+    async def main():
+        return await asyncio.gather(
+            build_service.build_project(session_id, force_rebuild=True),
+            build_service.build_project(session_id, force_rebuild=True),
+        )
+
+    results = asyncio.run(main())
+    assert sorted(result["status"] for result in results) == ["building", "success"]
+    assert npm_log.read_text().splitlines() == ["install", "run build"]
+
+
+def test_identical_inputs_restore_the_archived_build(npm_log):
+    session_id = new_project()
+    dist_html = code_executor.get_project_path(session_id) / "dist" / "index.html"
+
+    write_app(session_id, "export default 1")
+    assert asyncio.run(build_service.build_project(session_id, force_rebuild=True))["status"] == "success"
+    write_app(session_id, "export default 2")
+    assert asyncio.run(build_service.build_project(session_id, force_rebuild=True))["status"] == "success"
+    # package.json unchanged: the second build skipped the install
+    assert npm_log.read_text().splitlines() == ["install", "run build", "run build"]
+    assert dist_html.read_text() == "export default 2"
+
+    # Back to the first inputs (a rollback): the archived output comes back without npm
+    write_app(session_id, "export default 1")
+    result = asyncio.run(build_service.build_project(session_id, force_rebuild=True))
+    assert result["message"] == "Build restored from cache"
+    assert npm_log.read_text().splitlines() == ["install", "run build", "run build"]
+    assert dist_html.read_text() == "export default 1"
+    assert build_service.build_status[session_id].value == "success"
+
+    # Building again writes a fresh dist rather than through the archive's hardlinks
+    write_app(session_id, "export default 3")
+    asyncio.run(build_service.build_project(session_id, force_rebuild=True))
+    write_app(session_id, "export default 1")
+    asyncio.run(build_service.build_project(session_id, force_rebuild=True))
+    assert dist_html.read_text() == "export default 1"
@@ -0,0 +1,81 @@
+import asyncio
+import uuid
+
+import src.conversation_memory
+from src.conversation_memory import RECENT_FETCH_LIMIT, ConversationMemory
+from src.database import db
+
+
+async def add_messages(session_id: str, count: int):
+    await db.create_session(session_id)
+    for i in range(count):
+        await db.save_conversation(session_id, "user" if i % 2 == 0 else "assistant", f"message {i}")
+
+
+def test_messages_beyond_the_fetch_are_summarized():
+    memory = ConversationMemory(token_budget=10_000, max_message_tokens=100, summary_tokens=1_000)
+    session_id = str(uuid.uuid4())
+
+    async def main():
+        await add_messages(session_id, RECENT_FETCH_LIMIT + 10)
+        # Every fetched message fits the budget, but ten older ones weren't fetched
+        history = await memory.get_history(session_id)
+        assert history.summary == ""
+        assert [m["content"] for m in history.messages] == [f"message {i}" for i in range(10, RECENT_FETCH_LIMIT + 10)]
+        await asyncio.gather(*memory.summary_tasks.values())
+        return await db.get_conversation_summary(session_id), await memory.get_history(session_id)
+
+    summary, history = asyncio.run(main())
+    assert summary["message_count"] == 10
+    assert summary["summary"].splitlines()[0] == "- User: message 0"
+    # The summary is kept apart for the system prompt, never a turn of its own
+    assert history.summary == summary["summary"]
+    assert len(history.messages) == RECENT_FETCH_LIMIT
+    assert {m["role"] for m in history.messages} == {"user", "assistant"}
+
+
+def test_summary_pages_through_every_unsummarized_message(monkeypatch):
+    monkeypatch.setattr(src.conversation_memory, "SUMMARY_FETCH_LIMIT", 4)
+    memory = ConversationMemory(token_budget=10_000, max_message_tokens=100, summary_tokens=1_000)
+    session_id = str(uuid.uuid4())
+
+    async def main():
+        await add_messages(session_id, RECENT_FETCH_LIMIT + 10)
+        await memory.get_history(session_id)
+        await asyncio.gather(*memory.summary_tasks.values())
+        return await db.get_conversation_summary(session_id)
+
+    summary = asyncio.run(main())
+    assert summary["message_count"] == 10
+    assert summary["summary"].splitlines() == [
+        f"- {'User' if i % 2 == 0 else 'Assistant'}: message {i}" for i in range(10)
+    ]
+
+
+def test_messages_over_the_budget_are_summarized():
+    memory = ConversationMemory(token_budget=7, max_message_tokens=100, summary_tokens=1_000)
+    session_id = str(uuid.uuid4())
+
+    async def main():
+        await add_messages(session_id, 6)
+        history = await memory.get_history(session_id)
+        await asyncio.gather(*memory.summary_tasks.values())
+        return history, await db.get_conversation_summary(session_id)
+
+    history, summary = asyncio.run(main())
+    assert len(history.messages) == 2
+    assert summary["message_count"] == 4
+
+
+def test_nothing_to_summarize_schedules_nothing():
+    memory = ConversationMemory(token_budget=10_000, max_message_tokens=100, summary_tokens=1_000)
+    session_id = str(uuid.uuid4())
+
+    async def main():
+        await add_messages(session_id, 4)
+        history = await memory.get_history(session_id)
+        return history, dict(memory.summary_tasks)
+
+    history, tasks = asyncio.run(main())
+    assert len(history.messages) == 4
+    assert tasks == {}
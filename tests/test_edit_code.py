@@ -0,0 +1,45 @@
+import asyncio
+import uuid
+
+from src.agent_v2 import Agent
+from src.code_executor import code_executor
+from src.persistence_queue import persistence_queue
+from src.project_cache import project_cache
+
+
+def test_normalize_changes_keys_files_relative_to_src():
+    session_id = str(uuid.uuid4())
+    code_map, deleted = code_executor.normalize_changes(
+        session_id,
+        {"/App.tsx": "a", "./components/Button.tsx": "b", "../../escape.tsx": "c"},
+        ["/old.tsx", "old.tsx", "App.tsx", "/../outside.tsx"],
+    )
+    assert code_map == {"App.tsx": "a", "components/Button.tsx": "b"}
+    assert deleted == ["old.tsx"]
+
+
+def test_edit_code_uses_one_path_for_disk_cache_and_database():
+    session_id = str(uuid.uuid4())
+    code_executor.create_project(session_id)
+
+    async def main():
+        await project_cache.load(session_id)
+        await Agent().edit_code(
+            session_id=session_id, code_map={"/App.tsx": "export default 1"}, deleted=["/index.css"]
+        )
+        cached = await project_cache.load(session_id)
+        project_cache.invalidate(session_id)
+        on_disk = await project_cache.load(session_id)
+        return cached, on_disk
+
+    cached, on_disk = asyncio.run(main())
+    assert cached.code_map == on_disk.code_map
+    assert cached.code_map["App.tsx"] == "export default 1"
+    assert "/App.tsx" not in cached.code_map
+    assert "index.css" not in cached.code_map
+
+    pending = persistence_queue.pending.pop(session_id)
+    assert {path: write.content for path, write in pending.items()} == {
+        "App.tsx": "export default 1",
+        "index.css": None,
+    }
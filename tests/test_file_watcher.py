@@ -0,0 +1,233 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+import uuid
+
+import pytest
+from watchdog.events import (
+    EVENT_TYPE_CREATED,
+    EVENT_TYPE_DELETED,
+    EVENT_TYPE_MODIFIED,
+    EVENT_TYPE_MOVED,
+    FileCreatedEvent,
+    FileDeletedEvent,
+    FileModifiedEvent,
+    FileMovedEvent,
+)
+
+from src import file_watcher as file_watcher_module
+from src.code_executor import WriteOrigin, code_executor
+from src.file_watcher import (
+    CodeChangeHandler,
+    FileWatcher,
+    SharedInotify,
+    SharedObserver,
+    load_inotify_c,
+)
+
+requires_inotify = pytest.mark.skipif(file_watcher_module.Inotify is None, reason="inotify not available")
+
+
+class Recorder:
+    """Collects what a backend dispatches from its thread."""
+
+    def __init__(self):
+        self.events: queue.Queue = queue.Queue()
+        self.rescans: list[str] = []
+        self.threads: set[str] = set()
+
+    def dispatch(self, session_id, event):
+        self.threads.add(threading.current_thread().name)
+        self.events.put((session_id, event.event_type, event.src_path, getattr(event, "dest_path", "")))
+
+    def rescan(self, session_id):
+        self.rescans.append(session_id)
+
+    def wait_for(self, predicate, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        seen = []
+        while time.monotonic() < deadline:
+            try:
+                item = self.events.get(timeout=0.05)
+            except queue.Empty:
+                continue
+            seen.append(item)
+            if predicate(item):
+                return item
+        raise AssertionError(f"no matching event, saw {seen}")
+
+
+@pytest.fixture
+def inotify():
+    recorder = Recorder()
+    backend = SharedInotify(recorder.dispatch, recorder.rescan)
+    yield backend, recorder
+    backend.stop()
+
+
+@requires_inotify
+def test_shared_inotify_routes_events_to_sessions(inotify, tmp_path):
+    backend, recorder = inotify
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    backend.add("a", tmp_path / "a")
+    backend.add("b", tmp_path / "b")
+
+    (tmp_path / "b" / "App.tsx").write_text("x")
+    assert recorder.wait_for(lambda e: e[1] == EVENT_TYPE_CREATED)[0] == "b"
+    assert recorder.wait_for(lambda e: e[1] == EVENT_TYPE_MODIFIED)[:3] == (
+        "b", EVENT_TYPE_MODIFIED, str(tmp_path / "b" / "App.tsx")
+    )
+    assert recorder.threads == {"file-watcher"}
+
+
+@requires_inotify
+def test_shared_inotify_watches_new_directories_and_moves(inotify, tmp_path):
+    backend, recorder = inotify
+    backend.add("s", tmp_path)
+
+    (tmp_path / "components").mkdir()
+    recorder.wait_for(lambda e: e[1] == EVENT_TYPE_CREATED and e[2].endswith("components"))
+    (tmp_path / "components" / "Button.tsx").write_text("x")
+    recorder.wait_for(lambda e: e[1] == EVENT_TYPE_MODIFIED and e[2].endswith("Button.tsx"))
+
+    os.rename(tmp_path / "components" / "Button.tsx", tmp_path / "Button.tsx")
+    moved = recorder.wait_for(lambda e: e[1] == EVENT_TYPE_MOVED)
+    assert moved[2:] == (str(tmp_path / "components" / "Button.tsx"), str(tmp_path / "Button.tsx"))
+
+    (tmp_path / "Button.tsx").unlink()
+    recorder.wait_for(lambda e: e[1] == EVENT_TYPE_DELETED and e[2].endswith("Button.tsx"))
+
+
+@requires_inotify
+def test_shared_inotify_remove_stops_a_session(inotify, tmp_path):
+    backend, recorder = inotify
+    (tmp_path / "a" / "nested").mkdir(parents=True)
+    (tmp_path / "b").mkdir()
+    backend.add("a", tmp_path / "a")
+    backend.add("b", tmp_path / "b")
+    assert backend.watch_count() == 3
+
+    backend.remove(tmp_path / "a")
+    assert backend.watch_count() == 1
+    (tmp_path / "a" / "gone.tsx").write_text("x")
+    (tmp_path / "b" / "kept.tsx").write_text("x")
+    assert recorder.wait_for(lambda e: e[1] == EVENT_TYPE_MODIFIED)[0] == "b"
+
+
+@requires_inotify
+def test_shared_inotify_overflow_rescans_every_session(inotify, tmp_path):
+    backend, recorder = inotify
+    (tmp_path / "a").mkdir()
+    backend.add("a", tmp_path / "a")
+    # Created while events were being lost
+    (tmp_path / "a" / "missed").mkdir()
+
+    overflow = file_watcher_module.InotifyConstants.IN_Q_OVERFLOW
+    backend._handle_events((-1).to_bytes(4, "little", signed=True) + overflow.to_bytes(4, "little") + bytes(8))
+
+    assert recorder.rescans == ["a"]
+    assert str(tmp_path / "a" / "missed") in backend.descriptors
+
+
+def test_unverified_watchdog_version_falls_back_to_an_observer(monkeypatch):
+    assert load_inotify_c((99, 0)) is None
+
+    monkeypatch.setattr(file_watcher_module, "Inotify", None)
+    watcher = FileWatcher()
+    assert isinstance(watcher.backend, SharedObserver)
+
+
+def run_handler(session_id: str, root, actions, debounce=0.02, max_delay=1.0, settle=0.1) -> list[dict]:
+    """Feed events to a CodeChangeHandler on a running loop; returns the change sets delivered."""
+    delivered: list[dict] = []
+
+    async def on_change(change_set):
+        delivered.append(change_set.to_dict())
+
+    async def main():
+        handler = CodeChangeHandler(session_id, root, on_change, asyncio.get_running_loop(), debounce, max_delay)
+        for action in actions:
+            if isinstance(action, (int, float)):
+                await asyncio.sleep(action)
+            else:
+                handler.dispatch(action)
+        await asyncio.sleep(settle)
+        return handler
+
+    asyncio.run(main())
+    return delivered
+
+
+def changes(change_set: dict) -> dict:
+    return {change["path"]: change["kind"] for change in change_set["changes"]}
+
+
+def test_events_in_a_quiet_window_make_one_change_set(tmp_path):
+    src = str(tmp_path)
+    delivered = run_handler("s", tmp_path, [
+        FileCreatedEvent(f"{src}/New.tsx"),
+        FileModifiedEvent(f"{src}/New.tsx"),
+        FileModifiedEvent(f"{src}/App.tsx"),
+        FileModifiedEvent(f"{src}/App.tsx"),
+        FileCreatedEvent(f"{src}/Temp.tsx"),
+        FileDeletedEvent(f"{src}/Temp.tsx"),
+        FileCreatedEvent(f"{src}/Draft.tsx"),
+        FileMovedEvent(f"{src}/Draft.tsx", f"{src}/Final.tsx"),
+        FileModifiedEvent(f"{src}/notes.md"),
+        FileModifiedEvent(f"{src}/node_modules/react/index.js"),
+    ])
+    assert len(delivered) == 1
+    assert changes(delivered[0]) == {"New.tsx": "created", "App.tsx": "modified", "Final.tsx": "created"}
+
+
+def test_constant_activity_is_delivered_after_the_max_delay(tmp_path):
+    actions = []
+    for _ in range(10):
+        actions += [FileModifiedEvent(f"{tmp_path}/App.tsx"), 0.015]
+    delivered = run_handler("s", tmp_path, actions, debounce=0.02, max_delay=0.05)
+    assert len(delivered) >= 2
+    assert all(changes(change_set) == {"App.tsx": "modified"} for change_set in delivered)
+
+
+def test_server_writes_are_ignored_but_external_edits_are_not(tmp_path):
+    session_id = str(uuid.uuid4())
+    code_executor.create_project(session_id)
+    src = code_executor.get_project_path(session_id) / "src"
+    code_executor.save_code(session_id, {"App.tsx": "from the agent"})
+
+    delivered = run_handler(session_id, src, [FileModifiedEvent(f"{src}/App.tsx")])
+    assert delivered == []
+
+    (src / "App.tsx").write_text("edited by hand")
+    delivered = run_handler(session_id, src, [FileModifiedEvent(f"{src}/App.tsx")])
+    assert [changes(change_set) for change_set in delivered] == [{"App.tsx": "modified"}]
+
+
+@requires_inotify
+def test_file_watcher_delivers_only_external_changes():
+    session_id = str(uuid.uuid4())
+    code_executor.create_project(session_id)
+    src = code_executor.get_project_path(session_id) / "src"
+    watcher = FileWatcher()
+    delivered: list[dict] = []
+
+    async def on_change(change_set):
+        delivered.append(change_set.to_dict())
+
+    async def main():
+        await watcher.watch_session(session_id, on_change)
+        handler = watcher.handlers[session_id]
+        handler.debounce_seconds = 0.05
+        code_executor.save_code(session_id, {"App.tsx": "agent", "main.tsx": "agent"})
+        await asyncio.sleep(0.3)
+        (src / "index.css").write_text("body { color: red }")
+        await asyncio.sleep(0.3)
+        watcher.stop_all()
+        return handler.self_writes_ignored
+
+    ignored = asyncio.run(main())
+    assert [changes(change_set) for change_set in delivered] == [{"index.css": "modified"}]
+    assert ignored == {WriteOrigin.AGENT: 2}
@@ -0,0 +1,53 @@
+import asyncio
+import uuid
+from types import SimpleNamespace
+
+from src.agent_v2 import Agent
+from src.llm_metrics import llm_metrics
+
+
+class FakeModelClient:
+    """Streams canned partials for any BAML function."""
+
+    def __init__(self, partials: dict[str, list]):
+        self.calls: list[str] = []
+        self.stream = SimpleNamespace(**{
+            name: self._streamer(name, chunks) for name, chunks in partials.items()
+        })
+
+    def _streamer(self, name, chunks):
+        def stream(**args):
+            self.calls.append(name)
+            return iter(chunks)
+
+        return stream
+
+
+def partial(plan_state: str, *paths: str) -> SimpleNamespace:
+    return SimpleNamespace(
+        plan=SimpleNamespace(state=plan_state, value="Add a header"),
+        files=[SimpleNamespace(path=path) for path in paths],
+    )
+
+
+def test_stream_function_tracks_each_call(monkeypatch):
+    partials = [partial("Incomplete"), partial("Complete"), partial("Complete", "Header.tsx")]
+    fake = FakeModelClient({"EditCode": partials})
+    monkeypatch.setattr(Agent, "get_model_client", lambda self, client_name, collector=None: fake)
+    session_id = str(uuid.uuid4())
+
+    async def main():
+        stream = Agent().stream_function("EditCode", "OpenAIClient", {}, session_id=session_id, turn_id="t1")
+        return [item async for item in stream]
+
+    assert asyncio.run(main()) == partials
+    assert fake.calls == ["EditCode"]
+    [call] = llm_metrics.get_session_calls(session_id)
+    assert call["function_name"] == "EditCode"
+    assert call["client_name"] == "OpenAIClient"
+    assert call["turn_id"] == "t1"
+    assert call["status"] == "ok"
+    assert call["ttft_ms"] is not None
+    assert call["plan_complete_ms"] >= call["ttft_ms"]
+    assert set(call["file_done_ms"]) == {"Header.tsx"}
+    assert call["output_tokens"] and call["tokens_estimated"]
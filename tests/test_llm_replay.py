@@ -0,0 +1,159 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+from baml_client import partial_types
+from baml_client.async_client import b
+from src.config import Config, config
+from src.llm_replay import BAML_STREAM_INTERNALS, LLMReplay, aiter_stream, mock_client_registry
+from src.mock_llm_server import _completion_chunk
+
+PLAN = "x" * 200
+
+
+class SlowModelServer:
+    """OpenAI-style streaming endpoint that sends a few characters at a time and logs how each request ended."""
+
+    def __init__(self):
+        self.outcomes: list[str] = []
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(asyncio.start_server(self.handle, "127.0.0.1", 0))
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    async def handle(self, reader, writer):
+        await reader.read(65536)
+        writer.write(b"HTTP/1.1 200 OK\r\ncontent-type: text/event-stream\r\nconnection: close\r\n\r\n")
+        text = json.dumps({"plan": PLAN, "files": [], "package_json": "{}"})
+        try:
+            for i in range(0, len(text), 4):
+                writer.write(_completion_chunk("c", "mock-model", {"content": text[i:i + 4]}).encode())
+                await writer.drain()
+                await asyncio.sleep(0.02)
+            writer.write(_completion_chunk("c", "mock-model", {}, finish_reason="stop").encode())
+            writer.write(b"data: [DONE]\n\n")
+            await writer.drain()
+            self.outcomes.append("completed")
+        except ConnectionError:
+            self.outcomes.append("aborted")
+        writer.close()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+@pytest.fixture
+def model_server():
+    server = SlowModelServer()
+    yield server
+    server.close()
+
+
+def open_edit_code(port: int):
+    client = b.with_options(client_registry=mock_client_registry(f"http://127.0.0.1:{port}/v1"))
+    return client.stream.EditCode(history=[], history_summary="", feedback="hi", code_files=[], package_json="{}")
+
+
+def test_live_stream_ends_with_the_complete_output(model_server):
+    async def main():
+        partials = [partial async for partial in aiter_stream(open_edit_code(model_server.port))]
+        return partials[-1]
+
+    final = asyncio.run(main())
+    assert final.plan.value == PLAN and final.plan.state == "Complete"
+    assert model_server.outcomes == ["completed"]
+
+
+@pytest.mark.skipif(not BAML_STREAM_INTERNALS, reason="baml-py version without cancellable streams")
+def test_closing_a_live_stream_aborts_the_request(model_server):
+    async def main():
+        stream = aiter_stream(open_edit_code(model_server.port))
+        async for _ in stream:
+            break
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await stream.aclose()
+        closed_in = loop.time() - started
+        # Give the server time to notice
+        for _ in range(100):
+            if model_server.outcomes:
+                break
+            await asyncio.sleep(0.02)
+        return closed_in
+
+    assert asyncio.run(main()) < 0.5
+    assert model_server.outcomes == ["aborted"]
+
+
+def new_replay(monkeypatch, tmp_path, mode: str) -> LLMReplay:
+    monkeypatch.setattr(config, "LLM_REPLAY_MODE", mode)
+    monkeypatch.setattr(config, "LLM_REPLAY_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "LLM_REPLAY_SPEED", 0)
+    return LLMReplay()
+
+
+def test_replay_yields_the_recorded_partials(monkeypatch, tmp_path):
+    partials = [
+        partial_types.CodeChanges(plan={"value": "Add", "state": "Incomplete"}, files=[]),
+        partial_types.CodeChanges(plan={"value": "Add a header", "state": "Complete"}, files=[]),
+    ]
+    args = {"feedback": "hi"}
+
+    async def run(replay, open_stream):
+        return [p async for p in replay.stream("EditCode", "OpenAIClient", args, open_stream)]
+
+    recorder = new_replay(monkeypatch, tmp_path, "record")
+    assert asyncio.run(run(recorder, lambda: iter(partials))) == partials
+
+    def live_call():
+        raise AssertionError("replay must not call the model")
+
+    player = new_replay(monkeypatch, tmp_path, "replay")
+    assert asyncio.run(run(player, live_call)) == partials
+
+    args = {"feedback": "never recorded"}
+    with pytest.raises(FileNotFoundError):
+        asyncio.run(run(player, live_call))
+
+
+def test_offline_runs_do_not_need_an_api_key(monkeypatch):
+    monkeypatch.setattr(Config, "OPENAI_API_KEY", "")
+    monkeypatch.setattr(Config, "LLM_MOCK_BASE_URL", "")
+    monkeypatch.setattr(Config, "LLM_REPLAY_MODE", "off")
+    with pytest.raises(ValueError, match="OPENAI_API_KEY"):
+        Config.validate()
+
+    monkeypatch.setattr(Config, "LLM_REPLAY_MODE", "replay")
+    Config.validate()
+
+    monkeypatch.setattr(Config, "LLM_REPLAY_MODE", "off")
+    monkeypatch.setattr(Config, "LLM_MOCK_BASE_URL", "http://127.0.0.1:8100/v1")
+    Config.validate()
+
+
+def test_cancelled_turn_leaves_no_recording(monkeypatch, tmp_path):
+    async def live_call():
+        yield partial_types.CodeChanges(plan={"value": "Add", "state": "Incomplete"}, files=[])
+        await asyncio.Event().wait()
+
+    recorder = new_replay(monkeypatch, tmp_path, "record")
+
+    async def main():
+        seen = []
+
+        async def turn():
+            async for partial in recorder.stream("EditCode", "OpenAIClient", {}, live_call):
+                seen.append(partial)
+
+        task = asyncio.create_task(turn())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return seen
+
+    assert len(asyncio.run(main())) == 1
+    assert list(tmp_path.iterdir()) == []
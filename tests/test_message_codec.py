@@ -0,0 +1,114 @@
+import asyncio
+import json
+
+import msgpack
+import pytest
+from starlette.websockets import WebSocketState
+
+from src.agent_v2 import Message, MessageType
+from src.websocket_manager import WebSocketManager
+from src.message_codec import CHUNKED_TYPE, Encoding, OutboundMessage, message_codec, split_frame
+
+MESSAGE = {
+    "id": "m1",
+    "type": "agent_partial",
+    "data": {"offset": 3, "delta": "héllo ✓ wörld", "files": ["App.tsx"], "n": 1.5, "ok": True},
+    "session_id": "s",
+}
+
+
+def decode(frame):
+    return message_codec.decode({"text": frame} if isinstance(frame, str) else {"bytes": frame})
+
+
+@pytest.mark.parametrize("encoding", list(Encoding))
+def test_messages_round_trip(encoding):
+    frame = message_codec.encode(MESSAGE, encoding)
+    assert isinstance(frame, str if encoding == Encoding.JSON else bytes)
+    assert decode(frame) == MESSAGE
+
+
+@pytest.mark.parametrize("encoding", list(Encoding))
+def test_message_objects_and_enums_encode_as_plain_values(encoding):
+    message = Message.new(MessageType.AGENT_FINAL, {"kind": MessageType.USER}, id="m2", session_id="s")
+    decoded = decode(OutboundMessage(message).frame(encoding))
+    assert decoded["type"] == "agent_final"
+    assert decoded["data"] == {"kind": "user"}
+
+
+def test_frames_are_encoded_once_and_resequenced():
+    message = OutboundMessage(dict(MESSAGE))
+    first = message.frame(Encoding.JSON)
+    assert message.frame(Encoding.JSON) is first
+    message.sequence(7)
+    assert json.loads(message.frame(Encoding.JSON))["seq"] == 7
+    assert msgpack.unpackb(message.frame(Encoding.MSGPACK))["seq"] == 7
+
+
+def test_json_frames_received_from_another_worker_are_reused():
+    frame = message_codec.encode(MESSAGE, Encoding.JSON)
+    message = OutboundMessage.from_json(frame)
+    assert message.type == "agent_partial"
+    assert message.frame(Encoding.JSON) is frame
+
+
+class MsgpackWebSocket:
+    """A client that negotiated msgpack; records each frame's kind."""
+
+    def __init__(self):
+        self.application_state = WebSocketState.CONNECTED
+        self.query_params = {"encoding": "msgpack"}
+        self.frames: list[tuple[str, object]] = []
+
+    async def send_text(self, frame: str):
+        self.frames.append(("text", json.loads(frame)))
+
+    async def send_bytes(self, frame: bytes):
+        self.frames.append(("bytes", msgpack.unpackb(frame)))
+
+    async def close(self, code: int = 1000):
+        self.application_state = WebSocketState.DISCONNECTED
+
+
+def test_personal_messages_use_the_connection_encoding_and_order():
+    manager = WebSocketManager()
+    websocket = MsgpackWebSocket()
+
+    async def main():
+        await manager.connect(websocket, "s")
+        await manager.broadcast_to_session("s", dict(MESSAGE))
+        await manager.send_personal_message({"error": "boom"}, websocket)
+        await manager.drain(websocket)
+        manager.release(websocket)
+
+    asyncio.run(main())
+    assert [kind for kind, _ in websocket.frames] == ["bytes", "bytes"]
+    assert websocket.frames[0][1]["id"] == "m1"
+    assert websocket.frames[1][1] == {"error": "boom"}
+
+
+@pytest.mark.parametrize("encoding", list(Encoding))
+def test_chunked_transfers_reassemble(encoding):
+    message = OutboundMessage({**MESSAGE, "request_id": "r1", "data": {"content": "ünïcode ✓ " * 2000}})
+    frames = message_codec.chunk(message, encoding, 4096)
+    header, pieces = decode(frames[0]), frames[1:]
+
+    assert header["type"] == CHUNKED_TYPE
+    assert header["request_id"] == "r1"
+    assert header["data"]["chunks"] == len(pieces) > 1
+    assert header["data"]["message_type"] == "agent_partial"
+    for piece in pieces:
+        assert len(piece.encode("utf-8") if isinstance(piece, str) else piece) <= 4096
+    joined = "".join(pieces) if encoding == Encoding.JSON else b"".join(pieces)
+    assert decode(joined) == message.message
+
+
+def test_small_messages_are_not_chunked():
+    message = OutboundMessage(MESSAGE)
+    assert message_codec.chunk(message, Encoding.JSON, 4096) == [message.frame(Encoding.JSON)]
+
+
+def test_text_frames_split_on_character_boundaries():
+    pieces = split_frame("a✓" * 10, 4)
+    assert "".join(pieces) == "a✓" * 10
+    assert all(len(piece.encode("utf-8")) <= 4 for piece in pieces)
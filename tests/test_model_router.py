@@ -0,0 +1,106 @@
+import asyncio
+from collections import deque
+
+import pytest
+
+from src.config import config
+from src.llm_metrics import llm_metrics
+from src.model_router import STREAM_RESET, ModelRouter
+
+FAST, SLOW = "FastCodingClient", "OpenAIClient"
+
+
+@pytest.fixture
+def router(monkeypatch):
+    monkeypatch.setattr(llm_metrics, "ttft_samples", {})
+    monkeypatch.setattr(llm_metrics, "throughput_samples", {})
+    monkeypatch.setattr(config, "LLM_HEDGE_MIN_MS", 0)
+    monkeypatch.setattr(config, "LLM_HEDGE_DEFAULT_MS", 20)
+    router = ModelRouter()
+    router.hedge_enabled = True
+    return router
+
+
+def set_stats(client: str, ttft_ms: float, tokens_per_sec: float):
+    llm_metrics.ttft_samples[client] = deque([ttft_ms] * 10)
+    llm_metrics.throughput_samples[client] = deque([tokens_per_sec] * 10)
+
+
+async def scripted(script: list):
+    """Yields partials after delays; an exception in the script is raised."""
+    for delay, item in script:
+        await asyncio.sleep(delay)
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+def run(router: ModelRouter, scripts: dict[str, list], clients: list[str]) -> list:
+    async def main():
+        out = []
+        async for partial in router.stream(
+            lambda client: scripted(scripts[client]),
+            input_chars=100,
+            is_complete=lambda partial: partial.endswith("done"),
+            clients=clients,
+        ):
+            out.append("RESET" if partial is STREAM_RESET else partial)
+        return out
+
+    return asyncio.run(main())
+
+
+def test_unknown_configured_clients_are_dropped(monkeypatch):
+    monkeypatch.setattr(config, "LLM_ROUTER_CLIENTS", f"{FAST},NoSuchClient,{SLOW}")
+    assert ModelRouter().clients == [FAST, SLOW]
+
+    monkeypatch.setattr(config, "LLM_ROUTER_CLIENTS", "NoSuchClient")
+    assert set(ModelRouter().clients) == {FAST, SLOW, "ClaudeClient"}
+
+
+def test_ranking_follows_ttft_and_throughput(router):
+    set_stats(FAST, ttft_ms=300, tokens_per_sec=100)
+    set_stats(SLOW, ttft_ms=4000, tokens_per_sec=200)
+    # Small requests: time to first token dominates
+    assert router.rank_clients(1_000, [SLOW, FAST]) == [FAST, SLOW]
+    # Large requests: generation speed dominates
+    assert router.rank_clients(400_000, [FAST, SLOW]) == [SLOW, FAST]
+
+
+def test_failover_before_the_first_token(router):
+    set_stats(FAST, ttft_ms=100, tokens_per_sec=100)
+    set_stats(SLOW, ttft_ms=500, tokens_per_sec=100)
+    out = run(
+        router,
+        {FAST: [(0, ConnectionError("down"))], SLOW: [(0, "b"), (0, "b done")]},
+        [FAST, SLOW],
+    )
+    assert out == ["b", "b done"]
+    assert router.failovers == 1
+
+
+def test_failover_mid_stream_resets_the_partials(router):
+    set_stats(FAST, ttft_ms=100, tokens_per_sec=100)
+    set_stats(SLOW, ttft_ms=500, tokens_per_sec=100)
+    out = run(
+        router,
+        {FAST: [(0, "a"), (0, ConnectionError("dropped"))], SLOW: [(0, "b"), (0, "b done")]},
+        [FAST, SLOW],
+    )
+    assert out == ["a", "RESET", "b", "b done"]
+
+
+def test_hedge_winner_replaces_the_leader(router):
+    out = run(
+        router,
+        {FAST: [(0.03, "a"), (0.2, "a done")], SLOW: [(0.012, "b"), (0.012, "b done")]},
+        [FAST, SLOW],
+    )
+    assert router.hedges_fired == 1
+    assert out in (["b", "b done"], ["a", "RESET", "b done"])
+    assert router.hedge_wins == {SLOW: 1}
+
+
+def test_last_client_error_is_raised(router):
+    with pytest.raises(ConnectionError):
+        run(router, {FAST: [(0, ConnectionError("down"))], SLOW: [(0, ConnectionError("down"))]}, [FAST, SLOW])
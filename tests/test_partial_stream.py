@@ -0,0 +1,149 @@
+import asyncio
+
+from src.partial_stream import (
+    FRAME_DUE,
+    FileProgressThrottle,
+    PlanDeltaEncoder,
+    earliest_due,
+    text_checksum,
+    utf16_length,
+    with_frame_ticks,
+)
+
+
+class Client:
+    """Applies plan deltas the way the frontend does (UTF-16 offsets, String.slice)."""
+
+    def __init__(self):
+        self.units = b""  # UTF-16-LE code units
+
+    def apply(self, data: dict):
+        if data.get("reset"):
+            self.units = b""
+        assert data["offset"] * 2 == len(self.units), "delta does not continue the text"
+        self.units = self.units[: data["offset"] * 2] + data["delta"].encode("utf-16-le")
+
+    @property
+    def text(self) -> str:
+        return self.units.decode("utf-16-le")
+
+
+def stream(encoder: PlanDeltaEncoder, client: Client, snapshots: list[str]):
+    for snapshot in snapshots:
+        delta = encoder.update(snapshot)
+        if delta:
+            client.apply(delta)
+
+
+def test_reassembled_plan_matches_the_final_checksum():
+    text = "Plan: add a 🚀 launch button, then déploy ✓"
+    encoder, client = PlanDeltaEncoder(0), Client()
+    stream(encoder, client, [text[:i] for i in range(1, len(text))])
+    final = encoder.finish(text)
+    client.apply(final)
+
+    assert client.text == text
+    assert final["length"] == utf16_length(text) == len(client.units) // 2
+    assert final["checksum"] == text_checksum(client.text)
+
+
+def test_updates_within_a_frame_are_coalesced():
+    encoder, client = PlanDeltaEncoder(60), Client()
+    deltas = [encoder.update(text) for text in ("a", "ab", "abc", "abcd")]
+    assert deltas[0] == {"offset": 0, "delta": "a"}
+    assert deltas[1:] == [None, None, None]
+    assert encoder.flush() == {"offset": 1, "delta": "bcd"}
+    assert encoder.flush() is None
+
+
+def test_rewritten_text_replaces_what_was_sent():
+    encoder, client = PlanDeltaEncoder(0), Client()
+    stream(encoder, client, ["Use a modal", "Use a modal for"])
+    client.apply(encoder.update("Use a drawer"))
+    assert client.text == "Use a drawer"
+
+
+def test_restart_replaces_even_a_matching_prefix():
+    encoder, client = PlanDeltaEncoder(0), Client()
+    stream(encoder, client, ["Add a header"])
+    encoder.restart()
+    delta = encoder.update("Add a header and footer")
+    assert delta == {"offset": 0, "delta": "Add a header and footer", "reset": True}
+    client.apply(delta)
+    final = encoder.finish("Add a header and footer")
+    client.apply(final)
+    assert final["checksum"] == text_checksum(client.text)
+
+
+def test_file_progress_is_throttled_per_frame():
+    throttle = FileProgressThrottle(60)
+    assert throttle.add("App.tsx") == {"text": "Working on App.tsx", "files": ["App.tsx"], "count": 1}
+    assert throttle.add("Button.tsx") is None
+    assert throttle.add("index.css") is None
+    assert throttle.flush() == {
+        "text": "Working on index.css",
+        "files": ["Button.tsx", "index.css"],
+        "count": 3,
+    }
+    assert throttle.flush() is None
+
+
+def test_held_updates_come_due_after_the_frame():
+    encoder, throttle = PlanDeltaEncoder(60), FileProgressThrottle(60)
+    assert earliest_due(encoder, throttle) is None
+    encoder.update("Add")
+    encoder.update("Add a header")
+    throttle.add("App.tsx")
+    throttle.add("Header.tsx")
+    assert 59 < earliest_due(encoder, throttle) <= 60
+    encoder.flush()
+    throttle.flush()
+    assert earliest_due(encoder, throttle) is None
+
+
+def test_trailing_updates_are_flushed_while_the_model_is_slow():
+    async def model():
+        yield "Add"
+        yield "Add a"
+        # Thinking about the next token
+        await asyncio.sleep(0.3)
+        yield "Add a header"
+
+    async def main():
+        encoder, client = PlanDeltaEncoder(0.05), Client()
+        seen = []
+        async for item in with_frame_ticks(model(), lambda: earliest_due(encoder)):
+            delta = encoder.flush() if item is FRAME_DUE else encoder.update(item)
+            if delta:
+                client.apply(delta)
+            seen.append("tick" if item is FRAME_DUE else client.text)
+        return seen
+
+    seen = asyncio.run(main())
+    # "Add a" arrived within the frame of "Add", and went out on the trailing edge
+    assert seen == ["Add", "Add", "tick", "Add a header"]
+
+
+def test_closing_the_ticks_closes_the_stream():
+    closed = asyncio.Event()
+
+    async def model():
+        try:
+            yield "Add"
+            await asyncio.sleep(10)
+        finally:
+            closed.set()
+
+    async def main():
+        ticks = with_frame_ticks(model(), lambda: None)
+        assert await anext(ticks) == "Add"
+        consumer = asyncio.create_task(anext(ticks))
+        await asyncio.sleep(0.01)
+        consumer.cancel()
+        try:
+            await consumer
+        except asyncio.CancelledError:
+            pass
+        return closed.is_set()
+
+    assert asyncio.run(main())
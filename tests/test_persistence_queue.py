@@ -0,0 +1,154 @@
+import asyncio
+import json
+
+import pytest
+
+from src.database import db
+from src.persistence_queue import WriteBehindQueue
+
+
+class FlakyStore:
+    """Stands in for Database.save_code_files, failing the first `failures` calls (or a session's)."""
+
+    def __init__(self):
+        self.failures = 0
+        self.failing: set[str] = set()
+        self.calls: list[tuple[str, dict, list]] = []
+
+    async def save_code_files(self, session_id, files, deleted=None):
+        self.calls.append((session_id, dict(files), list(deleted or [])))
+        if session_id in self.failing:
+            raise ConnectionError("database unavailable")
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("database unavailable")
+        return len(self.calls)
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = FlakyStore()
+    monkeypatch.setattr(db, "save_code_files", store.save_code_files)
+    return store
+
+
+@pytest.fixture
+def new_queue(tmp_path):
+    def new_queue(**kwargs) -> WriteBehindQueue:
+        options = {
+            "flush_interval": 60,
+            "max_attempts": 3,
+            "retry_base_delay": 10,
+            "retry_max_delay": 60,
+            "dead_letter_dir": str(tmp_path / "dead_letter"),
+        }
+        return WriteBehindQueue(**{**options, **kwargs})
+    return new_queue
+
+
+def test_repeated_writes_coalesce_into_one_flush(store, new_queue):
+    queue = new_queue()
+    queue.enqueue("s", {"App.tsx": "v1", "index.css": "a"})
+    queue.enqueue("s", {"App.tsx": "v2"}, deleted=["index.css"])
+
+    assert queue.writes_coalesced == 2
+    assert queue.apply_pending("s", {"App.tsx": "db", "index.css": "db", "main.tsx": "db"}) == {
+        "App.tsx": "v2",
+        "main.tsx": "db",
+    }
+    assert asyncio.run(queue.flush_session("s"))
+    assert store.calls == [("s", {"App.tsx": "v2"}, ["index.css"])]
+    assert queue.get_queue_depth() == 0
+
+
+def test_failed_flush_is_requeued_behind_newer_writes(store, new_queue):
+    queue = new_queue()
+    store.failures = 1
+    queue.enqueue("s", {"App.tsx": "v1", "main.tsx": "m"})
+
+    async def main():
+        flushing = asyncio.create_task(queue.flush_session("s"))
+        await asyncio.sleep(0)
+        # Written while the failing flush was in flight
+        queue.enqueue("s", {"App.tsx": "v2"})
+        return await flushing
+
+    assert not asyncio.run(main())
+    assert {path: w.content for path, w in queue.pending["s"].items()} == {"App.tsx": "v2", "main.tsx": "m"}
+
+
+def test_failing_session_backs_off_then_is_dead_lettered(store, new_queue):
+    queue = new_queue()
+    store.failing = {"s"}
+    queue.enqueue("s", {"App.tsx": "v1"})
+    queue.enqueue("other", {"App.tsx": "x"})
+
+    asyncio.run(queue.flush_all())
+    assert queue.failures == {"s": 1}
+    # Still backing off: the periodic flush skips the session, others go through
+    queue.enqueue("other", {"App.tsx": "y"})
+    calls = len(store.calls)
+    asyncio.run(queue.flush_all())
+    assert [call[0] for call in store.calls[calls:]] == ["other"]
+
+    # Explicit flushes ignore the backoff; the last attempt dead-letters the writes but keeps them
+    assert not asyncio.run(queue.flush_session("s"))
+    assert not asyncio.run(queue.flush_session("s"))
+    assert {path: w.content for path, w in queue.pending["s"].items()} == {"App.tsx": "v1"}
+    assert queue.dead_lettered == {"s"} and queue.writes_dead_lettered == 1
+    record = json.loads((queue.dead_letter_dir / "s.json").read_text())
+    assert record["session_id"] == "s" and record["files"] == {"App.tsx": "v1"}
+
+    # Once the database is back the writes land and the dead-letter file goes
+    store.failing = set()
+    assert asyncio.run(queue.flush_session("s"))
+    assert store.calls[-1] == ("s", {"App.tsx": "v1"}, [])
+    assert queue.dead_lettered == set()
+    assert not (queue.dead_letter_dir / "s.json").exists()
+
+
+def test_stop_persists_the_batch_of_a_cancelled_flush(store, new_queue, monkeypatch):
+    queue = new_queue()
+    started = asyncio.Event()
+    release = asyncio.Event()
+    save_code_files = store.save_code_files
+
+    async def slow_save(session_id, files, deleted=None):
+        if not started.is_set():
+            started.set()
+            await release.wait()
+        return await save_code_files(session_id, files, deleted)
+
+    monkeypatch.setattr(db, "save_code_files", slow_save)
+
+    async def main():
+        queue.start()
+        queue.enqueue("s", {"App.tsx": "v1", "main.tsx": "m"})
+        queue._wakeup.set()
+        await started.wait()
+        # Edited again while the first flush is in flight, then shut down
+        queue.enqueue("s", {"App.tsx": "v2"})
+        await queue.stop()
+
+    asyncio.run(main())
+    assert store.calls == [("s", {"App.tsx": "v2", "main.tsx": "m"}, [])]
+    assert queue.get_queue_depth() == 0
+
+
+def test_stop_dead_letters_what_it_cannot_persist(store, new_queue):
+    queue = new_queue()
+    store.failing = {"s"}
+    queue.enqueue("s", {"App.tsx": "v1"}, deleted=["old.tsx"])
+    asyncio.run(queue.stop())
+    record = json.loads((queue.dead_letter_dir / "s.json").read_text())
+    assert record["files"] == {"App.tsx": "v1", "old.tsx": None}
+
+
+def test_success_resets_the_backoff(store, new_queue):
+    queue = new_queue()
+    store.failures = 1
+    queue.enqueue("s", {"App.tsx": "v1"})
+    assert not asyncio.run(queue.flush_session("s"))
+    assert asyncio.run(queue.flush_session("s"))
+    assert queue.failures == {} and queue.retry_at == {}
+    assert queue.get_queue_depth() == 0
@@ -0,0 +1,79 @@
+import asyncio
+import uuid
+
+from src.blob_store import content_hash
+from src.code_executor import code_executor
+from src.project_cache import ProjectCache
+
+
+def new_project() -> str:
+    session_id = str(uuid.uuid4())
+    code_executor.create_project(session_id)
+    return session_id
+
+
+def test_every_change_gets_a_new_version():
+    cache = ProjectCache()
+    session_id = new_project()
+
+    async def main():
+        first = await cache.load(session_id)
+        assert (await cache.load(session_id)).version == first.version
+        hashes = first.file_hashes()
+
+        version = cache.update(session_id, {"App.tsx": "export default 2"}, deleted=["index.css"])
+        updated = await cache.load(session_id)
+        return first, hashes, version, updated
+
+    first, hashes, version, updated = asyncio.run(main())
+    assert version == updated.version > first.version
+    assert updated.code_map["App.tsx"] == "export default 2"
+    assert "index.css" not in updated.code_map and "index.css" in first.code_map
+    # Hashes carried over and only recomputed for what changed
+    assert updated.hashes["App.tsx"] == content_hash("export default 2")
+    assert updated.hashes["main.tsx"] == hashes["main.tsx"]
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_invalidate_reloads_from_disk_at_a_new_version():
+    cache = ProjectCache()
+    session_id = new_project()
+
+    async def main():
+        first = await cache.load(session_id)
+        code_executor.save_code(session_id, {"App.tsx": "edited outside"})
+        assert (await cache.load(session_id)).code_map["App.tsx"] != "edited outside"
+        cache.invalidate(session_id)
+        return first, await cache.load(session_id)
+
+    first, reloaded = asyncio.run(main())
+    assert reloaded.version > first.version
+    assert reloaded.code_map["App.tsx"] == "edited outside"
+
+
+def test_a_change_during_a_load_is_not_cached_stale():
+    cache = ProjectCache()
+    session_id = new_project()
+
+    async def main():
+        loading = asyncio.create_task(cache.load(session_id))
+        await asyncio.sleep(0)
+        # Nothing is cached yet, but the load in flight read the old files
+        assert cache.update(session_id, {"App.tsx": "new"}) is None
+        await loading
+        return session_id in cache.entries
+
+    assert not asyncio.run(main())
+
+
+def test_least_recently_used_projects_are_evicted():
+    sessions = [new_project() for _ in range(3)]
+    cache = ProjectCache(max_bytes=1)
+
+    async def main():
+        for session_id in sessions:
+            await cache.load(session_id)
+
+    asyncio.run(main())
+    assert list(cache.entries) == [sessions[-1]]
+    assert cache.evictions == 2
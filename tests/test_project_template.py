@@ -0,0 +1,70 @@
+import asyncio
+import json
+import os
+import uuid
+
+import pytest
+
+from src.build_service import build_service
+from src.code_executor import TEMPLATE_DIST_MARKER, TEMPLATE_READY_MARKER, code_executor
+from src.config import config
+
+# Builds in place, through whatever dist/index.html is (a hardlink would change its other names)
+FAKE_NPM = """#!/bin/sh
+if [ "$1" = "run" ]; then
+  mkdir -p dist
+  echo "built $(pwd)" > dist/index.html
+fi
+"""
+
+
+@pytest.fixture
+def template(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "PROJECT_TEMPLATE_DIR", str(tmp_path / "templates"))
+    monkeypatch.setattr(config, "PROJECT_TEMPLATE_VERSION", "test")
+    path = tmp_path / "templates" / "test"
+    (path / "src").mkdir(parents=True)
+    (path / "src" / "App.tsx").write_text("export default 0")
+    (path / "package.json").write_text(json.dumps({"name": "template"}))
+    (path / "node_modules" / "react").mkdir(parents=True)
+    (path / "node_modules" / "react" / "index.js").write_text("react")
+    (path / "dist").mkdir()
+    (path / "dist" / "index.html").write_text("template build")
+    (path / TEMPLATE_READY_MARKER).write_text("{}")
+
+    bin_path = tmp_path / "bin"
+    bin_path.mkdir()
+    (bin_path / "npm").write_text(FAKE_NPM)
+    (bin_path / "npm").chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_path}{os.pathsep}{os.environ['PATH']}")
+    return path
+
+
+def test_clone_shares_the_template_until_it_diverges(template):
+    session_id = str(uuid.uuid4())
+    code_executor.create_project(session_id)
+    project_path = code_executor.get_project_path(session_id)
+
+    assert (project_path / "node_modules").is_symlink()
+    assert (project_path / "dist" / "index.html").stat().st_ino == (template / "dist" / "index.html").stat().st_ino
+    assert code_executor.shares_template_dist(session_id)
+    assert code_executor.template_deps_key(session_id) is not None
+
+    (project_path / "src" / "App.tsx").write_text("export default 1")
+    assert (template / "src" / "App.tsx").read_text() == "export default 0"
+
+
+def test_first_build_of_a_clone_leaves_the_template_dist_alone(template):
+    session_id = str(uuid.uuid4())
+    code_executor.create_project(session_id)
+    project_path = code_executor.get_project_path(session_id)
+
+    result = asyncio.run(build_service.build_project(session_id, force_rebuild=True))
+
+    assert result["status"] == "success", result
+    assert (template / "dist" / "index.html").read_text() == "template build"
+    assert (project_path / "dist" / "index.html").read_text().startswith("built")
+    assert not code_executor.shares_template_dist(session_id)
+    assert not (project_path / TEMPLATE_DIST_MARKER).exists()
+    # Dependencies were the template's: no install, node_modules still shared
+    assert (project_path / "node_modules").is_symlink()
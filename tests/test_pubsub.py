@@ -0,0 +1,89 @@
+import asyncio
+
+from src.message_codec import OutboundMessage
+from src.pubsub import Backplane, PubSubBroker, SocketBackplane
+
+
+class RecordingBackplane(Backplane):
+    """Local backplane logging the subscribe/unsubscribe calls it makes."""
+
+    def __init__(self):
+        self.delivered: list[str] = []
+        self.calls: list[str] = []
+
+        async def deliver(channel, message):
+            self.delivered.append(channel)
+
+        super().__init__(deliver)
+
+    def _on_subscribe(self, channel: str):
+        self.calls.append(f"SUB {channel}")
+
+    def _on_unsubscribe(self, channel: str):
+        self.calls.append(f"UNSUB {channel}")
+
+
+def test_channels_are_refcounted():
+    backplane = RecordingBackplane()
+    backplane.subscribe("s")
+    backplane.subscribe("s")
+    backplane.unsubscribe("s")
+    assert backplane.subscriptions == {"s": 1}
+    backplane.unsubscribe("s")
+    backplane.unsubscribe("s")  # Extra releases are ignored
+    assert backplane.subscriptions == {}
+    assert backplane.calls == ["SUB s", "UNSUB s"]
+
+    async def main():
+        await backplane.publish("s", OutboundMessage({"type": "x"}))
+        backplane.subscribe("s")
+        await backplane.publish("s", OutboundMessage({"type": "x"}))
+
+    asyncio.run(main())
+    assert backplane.delivered == ["s"]
+
+
+def test_broker_forwards_only_while_a_channel_is_referenced(tmp_path):
+    path = str(tmp_path / "pubsub.sock")
+    received: list[str] = []
+
+    async def deliver(channel, message):
+        received.append(message.message["n"])
+
+    async def ignore(channel, message):
+        pass
+
+    async def main():
+        broker = PubSubBroker(path)
+        broker_task = asyncio.create_task(broker.serve())
+        publisher = SocketBackplane(ignore, path)
+        subscriber = SocketBackplane(deliver, path)
+        await asyncio.sleep(0.05)
+        await publisher.start()
+        await subscriber.start()
+        await asyncio.wait_for(asyncio.gather(publisher.connected.wait(), subscriber.connected.wait()), 2)
+
+        async def publish(n):
+            await publisher.publish("s", OutboundMessage({"type": "x", "n": n}))
+            await asyncio.sleep(0.05)
+
+        subscriber.subscribe("s")
+        subscriber.subscribe("s")
+        await asyncio.sleep(0.05)
+        await publish(1)
+        subscriber.unsubscribe("s")  # One reference left
+        await asyncio.sleep(0.05)
+        await publish(2)
+        subscriber.unsubscribe("s")
+        await asyncio.sleep(0.05)
+        await publish(3)
+        channels = dict(broker.channels)
+
+        await publisher.stop()
+        await subscriber.stop()
+        broker_task.cancel()
+        await asyncio.gather(broker_task, return_exceptions=True)
+        return channels
+
+    assert asyncio.run(main()) == {}
+    assert received == [1, 2]
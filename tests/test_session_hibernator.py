@@ -0,0 +1,73 @@
+import asyncio
+import uuid
+
+from src.code_executor import code_executor
+from src.database import db
+from src.file_watcher import file_watcher
+from src.persistence_queue import persistence_queue
+from src.session_hibernator import session_hibernator
+
+
+def test_hibernate_keeps_a_session_whose_files_could_not_be_persisted(monkeypatch):
+    session_id = str(uuid.uuid4())
+    code_executor.create_project(session_id)
+    persistence_queue.enqueue(session_id, {"App.tsx": "unsaved"})
+
+    async def unavailable(*args, **kwargs):
+        raise ConnectionError("database unavailable")
+
+    monkeypatch.setattr(db, "save_code_files", unavailable)
+    assert not asyncio.run(session_hibernator.hibernate(session_id))
+    assert session_id not in session_hibernator.hibernated
+    assert code_executor.get_project_path(session_id).is_dir()
+    assert session_id in persistence_queue.pending
+
+    persistence_queue.pending.pop(session_id)
+    persistence_queue.failures.pop(session_id, None)
+    persistence_queue.retry_at.pop(session_id, None)
+
+
+def test_hibernated_session_wakes_with_its_files():
+    session_id = str(uuid.uuid4())
+    code_executor.create_project(session_id)
+    code_executor.save_code(session_id, {"App.tsx": "export default 1"})
+    project_path = code_executor.get_project_path(session_id)
+
+    assert asyncio.run(session_hibernator.hibernate(session_id))
+    assert session_id in session_hibernator.hibernated
+    assert not project_path.exists()
+    assert session_hibernator._archive_path(session_id).exists()
+
+    assert asyncio.run(session_hibernator.wake(session_id))
+    assert session_id not in session_hibernator.hibernated
+    assert (project_path / "src" / "App.tsx").read_text() == "export default 1"
+    assert not session_hibernator._archive_path(session_id).exists()
+    assert not asyncio.run(session_hibernator.wake(session_id))
+
+
+def test_concurrent_wakes_return_after_the_session_is_watched_again(monkeypatch):
+    session_id = str(uuid.uuid4())
+    code_executor.create_project(session_id)
+    assert asyncio.run(session_hibernator.hibernate(session_id))
+
+    events = []
+
+    async def on_change(change_set):
+        pass
+
+    async def watch_session(session_id, on_change):
+        await asyncio.sleep(0.05)
+        events.append("watched")
+
+    session_hibernator.watch_callbacks[session_id] = on_change
+    monkeypatch.setattr(file_watcher, "watch_session", watch_session)
+
+    async def wake():
+        woken = await session_hibernator.wake(session_id)
+        events.append(f"woken={woken}")
+
+    async def main():
+        await asyncio.gather(wake(), wake())
+
+    asyncio.run(main())
+    assert events == ["watched", "woken=True", "woken=False"]
@@ -0,0 +1,59 @@
+import asyncio
+import sqlite3
+
+from src.sqlite_database import SQLiteDatabase, blob_hash
+
+
+def test_identical_files_share_one_blob(tmp_path):
+    db = SQLiteDatabase(str(tmp_path / "app.db"))
+
+    async def main():
+        for session_id in ("a", "b"):
+            await db.create_session(session_id)
+            await db.save_code_files(session_id, {"App.tsx": "export default 1", "main.tsx": "render()"})
+        await db.save_code_files("b", {"App.tsx": "export default 2"})
+        files = await db.get_code_files("a"), await db.get_code_files("b")
+        await db.close()
+        return files
+
+    files_a, files_b = asyncio.run(main())
+    assert files_a == {"App.tsx": "export default 1", "main.tsx": "render()"}
+    assert files_b == {"App.tsx": "export default 2", "main.tsx": "render()"}
+    conn = sqlite3.connect(tmp_path / "app.db")
+    assert conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0] == 3
+
+
+def test_inline_file_contents_move_to_blobs(tmp_path):
+    path = tmp_path / "app.db"
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        """
+        CREATE TABLE sessions (
+            id TEXT PRIMARY KEY, session_id TEXT UNIQUE NOT NULL, project_url TEXT,
+            created_at TEXT NOT NULL, updated_at TEXT NOT NULL, user_id TEXT,
+            metadata TEXT NOT NULL DEFAULT '{}', version INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE code_files (
+            id TEXT PRIMARY KEY, session_id TEXT NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+            file_path TEXT NOT NULL, content TEXT NOT NULL, created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL, UNIQUE(session_id, file_path)
+        );
+        INSERT INTO sessions VALUES ('1', 'a', NULL, 't', 't', NULL, '{}', 0);
+        INSERT INTO code_files VALUES ('1', 'a', 'App.tsx', 'export default 1', 't', 't');
+        INSERT INTO code_files VALUES ('2', 'a', 'Copy.tsx', 'export default 1', 't', 't');
+        """
+    )
+    conn.close()
+
+    db = SQLiteDatabase(str(path))
+
+    async def main():
+        files = await db.get_code_files("a")
+        await db.close()
+        return files
+
+    assert asyncio.run(main()) == {"App.tsx": "export default 1", "Copy.tsx": "export default 1"}
+    conn = sqlite3.connect(path)
+    assert [row[0] for row in conn.execute("SELECT hash FROM blobs")] == [blob_hash("export default 1")]
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(code_files)")}
+    assert "content" not in columns and "blob_hash" in columns
@@ -0,0 +1,108 @@
+import asyncio
+
+from src.turn_scheduler import TurnPolicy, TurnScheduler, TurnStatus
+from src.websocket_manager import websocket_manager
+
+
+def recording_runner(ran: list[str], delay: float = 0.0):
+    async def run(*, session_id, feedback, turn_id):
+        await asyncio.sleep(delay)
+        ran.append(feedback)
+        yield {"type": "agent_final", "data": {"turn_id": turn_id}}
+
+    return run
+
+
+def capture_broadcasts(monkeypatch, delays: dict[str, float] | None = None) -> list[dict]:
+    sent: list[dict] = []
+
+    async def broadcast_to_session(session_id, message):
+        if isinstance(message, dict):
+            await asyncio.sleep((delays or {}).get(message.get("type"), 0))
+            sent.append(message)
+
+    monkeypatch.setattr(websocket_manager, "broadcast_to_session", broadcast_to_session)
+    return sent
+
+
+async def drain(scheduler: TurnScheduler, session_id: str):
+    while session_id in scheduler.workers:
+        await asyncio.sleep(0.01)
+
+
+def test_queue_policy_runs_turns_in_order(monkeypatch):
+    capture_broadcasts(monkeypatch)
+    scheduler = TurnScheduler(TurnPolicy.QUEUE)
+    ran: list[str] = []
+
+    async def main():
+        run = recording_runner(ran, delay=0.01)
+        turns = [await scheduler.submit("s", text, run) for text in ("one", "two", "three")]
+        await drain(scheduler, "s")
+        return turns
+
+    turns = asyncio.run(main())
+    assert ran == ["one", "two", "three"]
+    assert [turn.status for turn in turns] == [TurnStatus.COMPLETED] * 3
+    assert "s" not in scheduler.pending
+
+
+def test_cancel_policy_supersedes_running_and_queued_turns(monkeypatch):
+    sent = capture_broadcasts(monkeypatch)
+    scheduler = TurnScheduler(TurnPolicy.CANCEL)
+    ran: list[str] = []
+
+    async def main():
+        run = recording_runner(ran, delay=0.05)
+        first = await scheduler.submit("s", "one", run)
+        await asyncio.sleep(0.01)
+        second = await scheduler.submit("s", "two", run)
+        await drain(scheduler, "s")
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert ran == ["two"]
+    assert first.status == TurnStatus.CANCELLED
+    assert second.status == TurnStatus.COMPLETED
+    cancelled = [m for m in sent if m["type"] == "turn_cancelled"]
+    assert [m["data"]["turn_id"] for m in cancelled] == [first.id]
+
+
+def test_cancel_by_id_removes_a_queued_turn(monkeypatch):
+    capture_broadcasts(monkeypatch)
+    scheduler = TurnScheduler(TurnPolicy.QUEUE)
+    ran: list[str] = []
+
+    async def main():
+        run = recording_runner(ran, delay=0.02)
+        await scheduler.submit("s", "one", run)
+        queued = await scheduler.submit("s", "two", run)
+        assert await scheduler.cancel("s", queued.id)
+        await drain(scheduler, "s")
+        return queued
+
+    queued = asyncio.run(main())
+    assert ran == ["one"]
+    assert queued.status == TurnStatus.CANCELLED
+
+
+def test_submit_while_worker_is_finishing(monkeypatch):
+    # The superseded turn's cancellation broadcast is slow enough for the
+    # running turn to finish and its worker to drop the session's queue
+    capture_broadcasts(monkeypatch, delays={"turn_cancelled": 0.05})
+    scheduler = TurnScheduler(TurnPolicy.QUEUE)
+    ran: list[str] = []
+
+    async def main():
+        run = recording_runner(ran, delay=0.01)
+        await scheduler.submit("s", "one", run)
+        await scheduler.submit("s", "two", run)
+        scheduler.policy = TurnPolicy.CANCEL
+        third = await scheduler.submit("s", "three", run)
+        await drain(scheduler, "s")
+        return third
+
+    third = asyncio.run(main())
+    assert ran == ["one", "three"]
+    assert third.status == TurnStatus.COMPLETED
+    assert "s" not in scheduler.pending
@@ -0,0 +1,199 @@
+import asyncio
+import json
+
+from starlette.websockets import WebSocketState
+
+from src.message_codec import Encoding, OutboundMessage
+from src.websocket_manager import (
+    SLOW_CONSUMER_CLOSE_CODE,
+    Connection,
+    ReplayBuffer,
+    SlowConsumerPolicy,
+    WebSocketManager,
+)
+
+
+class FakeWebSocket:
+    """Records the frames a connection's writer sends."""
+
+    def __init__(self):
+        self.application_state = WebSocketState.CONNECTED
+        self.query_params: dict[str, str] = {}
+        self.frames: list[dict] = []
+
+    async def send_text(self, frame: str):
+        self.frames.append(json.loads(frame))
+
+    async def send_bytes(self, frame: bytes):
+        raise AssertionError("JSON clients get text frames")
+
+    async def close(self, code: int = 1000):
+        self.application_state = WebSocketState.DISCONNECTED
+
+
+class StalledWebSocket(FakeWebSocket):
+    """A client that stops reading: sends never complete."""
+
+    def __init__(self):
+        super().__init__()
+        self.close_code = None
+
+    async def send_text(self, frame: str):
+        await asyncio.Event().wait()
+
+    async def close(self, code: int = 1000):
+        await super().close(code)
+        self.close_code = code
+
+
+def stalled_connection(policy: SlowConsumerPolicy, max_queue: int = 2, send_timeout: float = 30) -> Connection:
+    closed = []
+    connection = Connection(
+        StalledWebSocket(), Encoding.JSON, None, max_queue, policy, send_timeout, closed.append
+    )
+    connection.closed_by = closed
+    return connection
+
+
+def event(n: int) -> dict:
+    return {"id": str(n), "type": "agent_partial", "data": {"n": n}}
+
+
+def test_full_queue_drops_progress_before_disconnecting():
+    async def main():
+        connection = stalled_connection(SlowConsumerPolicy.DROP)
+        assert connection.enqueue(OutboundMessage(event(0)))
+        await asyncio.sleep(0)  # The writer takes it and stalls
+        assert connection.enqueue(OutboundMessage(event(1)), low_priority=True)
+        assert connection.enqueue(OutboundMessage(event(2)))
+
+        # Full: new progress is dropped, then queued progress makes room
+        assert not connection.enqueue(OutboundMessage(event(3)), low_priority=True)
+        assert connection.enqueue(OutboundMessage(event(4)))
+        assert connection.dropped == 2
+        assert [message.message["data"]["n"] for message, _ in connection.queue] == [2, 4]
+        assert not connection.closed
+
+        # Nothing left to drop
+        assert not connection.enqueue(OutboundMessage(event(5)))
+        await asyncio.sleep(0)
+        return connection
+
+    connection = asyncio.run(main())
+    assert connection.closed and connection.slow_consumer
+    assert connection.closed_by == [connection]
+    assert connection.websocket.close_code == SLOW_CONSUMER_CLOSE_CODE
+
+
+def test_disconnect_policy_closes_on_the_first_overflow():
+    async def main():
+        connection = stalled_connection(SlowConsumerPolicy.DISCONNECT, max_queue=1)
+        connection.enqueue(OutboundMessage(event(0)))
+        await asyncio.sleep(0)
+        assert connection.enqueue(OutboundMessage(event(1)))
+        assert not connection.enqueue(OutboundMessage(event(2)), low_priority=True)
+        await asyncio.sleep(0)
+        return connection
+
+    connection = asyncio.run(main())
+    assert connection.closed and connection.slow_consumer
+    assert connection.dropped == 0
+    assert connection.websocket.close_code == SLOW_CONSUMER_CLOSE_CODE
+
+
+def test_stalled_send_times_out_as_a_slow_consumer():
+    async def main():
+        connection = stalled_connection(SlowConsumerPolicy.DROP, send_timeout=0.02)
+        connection.enqueue(OutboundMessage(event(0)))
+        await asyncio.sleep(0.1)
+        return connection
+
+    connection = asyncio.run(main())
+    assert connection.closed and connection.slow_consumer
+    assert connection.sent == 0
+
+
+def test_replay_buffer_returns_only_what_it_still_holds():
+    buffer = ReplayBuffer(3)
+    for n in range(5):
+        buffer.append(OutboundMessage(event(n)))
+    assert buffer.position()["seq"] == 5
+    assert [m.type for m in buffer.since(3)] == ["agent_partial"] * 2
+    assert buffer.since(1) is None  # overrun
+    assert buffer.since(6) is None  # ahead of the stream
+    assert buffer.since(5) == []
+
+
+def test_replay_buffer_edges():
+    def seqs(messages):
+        return None if messages is None else [m.message["seq"] for m in messages]
+
+    buffer = ReplayBuffer(3)
+    assert seqs(buffer.since(0)) == []  # Empty: up to date
+    assert seqs(buffer.since(1)) is None
+
+    for n in range(3):
+        buffer.append(OutboundMessage(event(n)))
+    assert seqs(buffer.since(0)) == [1, 2, 3]  # Full but nothing evicted yet
+
+    buffer.append(OutboundMessage(event(3)))
+    assert seqs(buffer.since(0)) is None  # Event 1 is gone
+    assert seqs(buffer.since(1)) == [2, 3, 4]  # Exactly at the oldest boundary
+    assert seqs(buffer.since(4)) == []
+    assert seqs(buffer.since(-1)) is None
+
+
+def test_sessions_without_local_sockets_get_no_replay_buffer():
+    manager = WebSocketManager()
+
+    async def main():
+        await manager._deliver("elsewhere", OutboundMessage(event(1)))
+
+    asyncio.run(main())
+    assert manager.replay_buffers == {}
+
+
+def test_reconnect_replays_the_events_missed_while_retained():
+    manager = WebSocketManager(replay_size=10, replay_retention=60)
+
+    async def main():
+        first = FakeWebSocket()
+        await manager.connect(first, "s")
+        for n in range(3):
+            await manager.broadcast_to_session("s", event(n))
+        position = manager.get_stream_position("s")
+        manager.disconnect(first, "s")
+        manager.release(first)
+
+        # Published while nobody is connected: kept for the retained stream
+        for n in range(3, 5):
+            await manager.broadcast_to_session("s", event(n))
+
+        second = FakeWebSocket()
+        replayed = await manager.resume(second, "s", position["stream_id"], position["seq"])
+        await asyncio.sleep(0.01)
+        stale = FakeWebSocket()
+        snapshot = await manager.resume(stale, "s", "another-stream", 0)
+        return replayed, second.frames, snapshot
+
+    replayed, frames, snapshot = asyncio.run(main())
+    assert replayed == 2
+    assert [frame["data"]["n"] for frame in frames] == [3, 4]
+    assert snapshot is None
+
+
+def test_released_stream_drops_its_buffer():
+    manager = WebSocketManager(replay_retention=0.01)
+
+    async def main():
+        websocket = FakeWebSocket()
+        await manager.connect(websocket, "s")
+        await manager.broadcast_to_session("s", event(1))
+        manager.disconnect(websocket, "s")
+        assert "s" in manager.replay_buffers
+        await asyncio.sleep(0.05)
+        await manager._deliver("s", OutboundMessage(event(2)))
+
+    asyncio.run(main())
+    assert manager.replay_buffers == {}
+    assert manager.retained == {}